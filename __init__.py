@@ -24,6 +24,8 @@ from __future__ import division
 __version__ = '$Revision: 1 $'
 # $Source$
 
-import individuals, models
+import advection, checkpoint, history, individuals, models, parallel
+import output, population, resampling, tables
 
-__all__ = ['individuals', 'models']
+__all__ = ['advection', 'checkpoint', 'history', 'individuals', 'models',
+           'output', 'parallel', 'population', 'resampling', 'tables']
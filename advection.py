@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for Lagrangian modelling.
+
+This module implements the transport of individuals by velocity fields.
+
+Disclaimer
+----------
+This software may be used, copied, or redistributed as long as it is
+not sold and this copyright notice is reproduced on each copy made.
+This routine is provided as is without any express or implied
+warranties whatsoever.
+
+Author
+------
+Sebastian Krieger (sebastian.krieger@usp.br)
+
+Revision
+--------
+1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+from numpy import add, cos, deg2rad, empty, multiply, ones, pi
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+# Mean Earth radius (in meters).
+EARTH_RADIUS = 6371e3
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def inside(domain, x, y, z):
+    """
+    Checks whether positions are inside domain.
+
+    Parameters
+    ----------
+    domain : tuple
+        Domain boundaries as (x_min, x_max, y_min, y_max, z_min, z_max).
+        Boundaries set to None are open.
+    x, y, z : array like
+        Positions.
+
+    Returns
+    -------
+    mask : array like
+        True where positions are inside the domain.
+
+    """
+    mask = (x == x)
+    if domain is None:
+        return mask
+    for value, lower, upper in zip([x, y, z], domain[0::2], domain[1::2]):
+        if lower is not None:
+            mask &= value >= lower
+        if upper is not None:
+            mask &= value <= upper
+    return mask
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class Advection(object):
+    """
+    Lagrangian advection of individuals.
+
+    Positions are advanced with the classical fourth order Runge-Kutta
+    scheme using velocities read from the environmental pools 'u', 'v'
+    and 'w'. Individuals are processed in chunks with preallocated
+    stage arrays, so memory use does not depend on population size.
+    Individuals outside the domain do not move, and `in_domain` is
+    updated after every step.
+
+    Parameters
+    ----------
+    chunk : int, optional
+        Number of individuals advected at once.
+    spherical : bool, optional
+        If True, x and y are longitude and latitude in degrees and
+        horizontal velocities are given in meters per unit time.
+
+    """
+    # Environmental variables holding velocity components.
+    keys = ['u', 'v', 'w']
+
+    def __init__(self, chunk=65536, spherical=False):
+        self.chunk = int(chunk)
+        self.spherical = spherical
+        self._buffers = None
+
+    def velocity(self, environments, t, P, out):
+        """
+        Reads velocities at positions `P` into `out`.
+
+        Both `P` and `out` have shape (3, n), with rows holding x, y, z
+        and dx/dt, dy/dt, dz/dt respectively.
+
+        """
+        x, y, z = P
+        if hasattr(environments, 'read'):
+            values = environments.read(t, z, y, x, self.keys)
+            values = [values[key] for key in self.keys]
+        else:
+            values = [environments[key] for key in self.keys]
+            values = [item.read(t, z, y, x) if hasattr(item, 'read') else
+                      item for item in values]
+        for i, value in enumerate(values):
+            out[i] = value
+        if self.spherical:
+            # Converts horizontal velocities to degrees per unit time.
+            multiply(out[0], 180 / (pi * EARTH_RADIUS), out=out[0])
+            out[0] /= cos(deg2rad(y))
+            multiply(out[1], 180 / (pi * EARTH_RADIUS), out=out[1])
+        return out
+
+    def step(self, individual, t, dt, environments):
+        """
+        Advances positions of `individual` from time `t` to `t + dt`.
+
+        Parameters
+        ----------
+        individual : Individual
+            Population to advect.
+        t, dt : float
+            Time and time step.
+        environments : dictionary
+            Environmental pools, which must contain the velocity
+            components.
+
+        """
+        n = individual.size()
+        in_domain = individual.in_domain
+        if in_domain is None:
+            in_domain = ones(n, dtype=bool)
+        # Only individuals inside the domain at the beginning of the
+        # step move.
+        moving = in_domain.copy()
+        x, y, z = individual.x, individual.y, individual.z
+        if x.ndim == 1:
+            members = [(x, y, z)]
+        else:
+            # Ensemble members are advected one after the other.
+            members = zip(x, y, z)
+        for x, y, z in members:
+            for i in range(0, n, self.chunk):
+                sl = slice(i, min(i + self.chunk, n))
+                m = sl.stop - sl.start
+                P0, P, k1, k2, k3, k4 = self.buffers(m, x.dtype)
+                P0[0], P0[1], P0[2] = x[sl], y[sl], z[sl]
+                self.velocity(environments, t, P0, k1)
+                self._stage(P0, dt / 2, k1, P)
+                self.velocity(environments, t + dt / 2, P, k2)
+                self._stage(P0, dt / 2, k2, P)
+                self.velocity(environments, t + dt / 2, P, k3)
+                self._stage(P0, dt, k3, P)
+                self.velocity(environments, t + dt, P, k4)
+                # P = dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+                add(k2, k3, out=P)
+                multiply(P, 2, out=P)
+                add(P, k1, out=P)
+                add(P, k4, out=P)
+                multiply(P, dt / 6, out=P)
+                multiply(P, moving[sl], out=P)
+                add(P0, P, out=P0)
+                x[sl], y[sl], z[sl] = P0
+                in_domain[sl] &= inside(individual.domain, *P0)
+        # Setting the mask again updates the active set of individuals.
+        individual.in_domain = in_domain
+
+    def buffers(self, n, dtype=float):
+        """Returns six stage buffers of shape (3, n)."""
+        B = self._buffers
+        if (B is None) or (B.shape[2] < n) or (B.dtype != dtype):
+            B = self._buffers = empty((6, 3, n), dtype=dtype)
+        return B[:, :, :n]
+
+    @staticmethod
+    def _stage(P0, h, k, out):
+        """Calculates stage position `P0 + h * k`."""
+        multiply(k, h, out=out)
+        add(P0, out, out=out)
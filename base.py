@@ -21,7 +21,9 @@ Revision
 """
 from __future__ import division
 
+from collections import defaultdict
 from sys import stdout
+from timeit import default_timer
 
 __version__ = '$Revision: 1 $'
 __author__ = 'Sebastian Krieger (sebastian.krieger@usp.br)'
@@ -31,6 +33,119 @@ __author__ = 'Sebastian Krieger (sebastian.krieger@usp.br)'
 ###############################################################################
 # CLASSES
 ###############################################################################
+class _NullTimer(object):
+    """Timer context that does nothing, used when profiling is off."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _Timer(object):
+    """Timer context accumulating elapsed time into a profiler."""
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *args):
+        profiler = self.profiler
+        profiler.times[self.name] += default_timer() - self.start
+        profiler.calls[self.name] += 1
+        return False
+
+
+class Profiler(object):
+    """
+    Named timers and counters for instrumentation of models.
+
+    Timers measure inclusive wall-clock time of named phases, e. g.
+
+        with profiler.timer('growth'):
+            ...
+
+    When the profiler is disabled, timers and counters cost no more
+    than a function call. Model steps are recorded with `step`, which
+    stores the time spent in each phase since the previous step.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Turns instrumentation on or off.
+
+    """
+    _null = _NullTimer()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        """Clears every timer, counter and step record."""
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.records = []
+        self._last = dict()
+
+    def timer(self, name):
+        """Returns context manager timing phase `name`."""
+        if self.enabled:
+            return _Timer(self, name)
+        return self._null
+
+    def count(self, name, n=1):
+        """Increments counter `name` by `n`."""
+        if self.enabled:
+            self.counters[name] += n
+
+    def step(self, t):
+        """Records time spent in each phase since the previous step."""
+        if not self.enabled:
+            return
+        record = dict(t=t)
+        for name, value in self.times.items():
+            record[name] = value - self._last.get(name, 0.)
+        self._last = dict(self.times)
+        self.records.append(record)
+
+    def summary(self):
+        """
+        Returns dictionary with total time, number of calls and mean
+        time of every phase, and the value of every counter.
+
+        """
+        result = dict()
+        for name, value in self.times.items():
+            result[name] = dict(time=value, calls=self.calls[name],
+                                mean=value / max(self.calls[name], 1))
+        for name, value in self.counters.items():
+            result[name] = value
+        return result
+
+    def report(self):
+        """Returns summary formatted as a table."""
+        lines = ['{0:<30s} {1:>12s} {2:>10s} {3:>12s}'.format(
+            'Phase', 'Time (s)', 'Calls', 'Mean (s)')]
+        for name in sorted(self.times.keys()):
+            lines.append('{0:<30s} {1:12.6f} {2:10d} {3:12.6g}'.format(
+                name, self.times[name], self.calls[name],
+                self.times[name] / max(self.calls[name], 1)))
+        for name in sorted(self.counters.keys()):
+            lines.append('{0:<30s} {1:>12d}'.format(name,
+                                                     self.counters[name]))
+        return '\n'.join(lines) + '\n'
+
+
+# Default profiler used throughout the library. Set `profiler.enabled`
+# to collect timings.
+profiler = Profiler()
+
+
 class BaseClass(object):
     """Base class for module."""
     def __init__(self, **kwargs):
@@ -50,10 +165,7 @@ class BaseClass(object):
         self._attributes[attrib] = val
 
     def _get_attribute(self, attrib):
-        if attrib in self._attributes.keys():
-            return self._attributes[attrib]
-        else:
-            return None
+        return self._attributes.get(attrib)
 
     def message(self, s):
         """Prints `s` to standard output."""
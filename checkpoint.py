@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for Lagrangian modelling.
+
+This module implements binary checkpoints of models and populations.
+
+Disclaimer
+----------
+This software may be used, copied, or redistributed as long as it is
+not sold and this copyright notice is reproduced on each copy made.
+This routine is provided as is without any express or implied
+warranties whatsoever.
+
+Author
+------
+Sebastian Krieger (sebastian.krieger@usp.br)
+
+Revision
+--------
+1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+import json
+from importlib import import_module
+from os import fsync, listdir, makedirs, remove, rename
+from os.path import exists, isdir, join
+from warnings import warn
+from zlib import crc32
+
+from numpy import ascontiguousarray, dtype as _dtype, generic, load as _load
+from numpy import memmap, ndarray, save as _save
+
+from gaia.history import History, Policy
+from gaia.population import Population
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+# Name of checkpoint header file.
+HEADER = 'checkpoint.json'
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def save(path, model, populations):
+    """
+    Saves model and populations to checkpoint directory.
+
+    Checkpoints are made of a JSON header and raw columnar files:
+    population blocks and per individual arrays as .npy files and
+    history as append-only raw files. Saving again into the same
+    directory is incremental, only arrays changed since the previous
+    checkpoint are written and only new history items are appended.
+
+    Changed arrays and rewritten history go to new files, named after
+    the version of the checkpoint, and history is only appended past
+    the items of the previous header. Hence the previous checkpoint
+    stays valid until the new header replaces it, after which files
+    it does not refer to are removed. Attributes which are neither
+    arrays nor JSON serializable are not saved, with a warning.
+    Recording policies of history (see `History.policy`) are saved
+    with their running state, so that restored runs keep sampling as
+    uninterrupted ones.
+
+    Parameters
+    ----------
+    path : string
+        Checkpoint directory.
+    model : Model
+        Model to save.
+    populations : list
+        Populations attached to the model.
+
+    """
+    if not isdir(path):
+        makedirs(path)
+    previous = _read_header(path)
+    # Files left by interrupted saves.
+    _clean(path, previous)
+    version = previous.get('version', 0) + 1
+    old = previous.get('populations', [])
+    header = dict(model=_object_header(model), populations=[],
+                  version=version)
+    for k, individual in enumerate(populations):
+        item = _object_header(individual, arrays=True)
+        before = old[k] if k < len(old) else dict()
+        prefix = 'population{0}'.format(k)
+        # State parameters.
+        if individual.population is not None:
+            item['population'] = _save_array(
+                path, prefix + '.block',
+                individual.population._block[..., :individual.size()],
+                before.get('population'), version)
+        # Arrays, e. g. masks and ensemble parameters.
+        arrays = dict()
+        for key, value in individual._attributes.items():
+            if key.startswith('_') or not isinstance(value, ndarray):
+                continue
+            arrays[key] = _save_array(path, '{0}.{1}'.format(prefix, key),
+                                      value, before.get('arrays',
+                                                        {}).get(key),
+                                      version)
+        item['arrays'] = arrays
+        # History.
+        H = individual._attributes.get('history')
+        history = dict()
+        if H is not None:
+            for key in H.keys():
+                history[key] = _save_record(
+                    path, '{0}.history.{1}'.format(prefix, key),
+                    H.record(key), before.get('history', {}).get(key),
+                    version)
+        item['history'] = history
+        if (H is not None) and (H.chunk is not None):
+            item['compression'] = dict(chunk=H.chunk, cache=H.cache)
+        # Recording policies and their running state.
+        if (H is not None) and (len(H.policies) > 0):
+            item['policies'] = dict(
+                (key, _save_policy(path, '{0}.policy.{1}'.format(prefix, key),
+                                   policy,
+                                   before.get('policies', {}).get(key),
+                                   version))
+                for key, policy in H.policies.items())
+        header['populations'].append(item)
+    # The header is replaced atomically, so that an interrupted save
+    # leaves the previous checkpoint valid.
+    tmp = join(path, HEADER + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(header, f)
+        f.flush()
+        fsync(f.fileno())
+    rename(tmp, join(path, HEADER))
+    _clean(path, header)
+
+
+def load(path):
+    """
+    Restores model and populations from checkpoint directory.
+
+    Arrays are memory-mapped copy-on-write, so that data is only read
+    when accessed and changes do not alter the checkpoint.
+
+    Returns
+    -------
+    model : Model
+        Restored model.
+    populations : list
+        Restored populations.
+
+    """
+    header = _read_header(path)
+    if not header:
+        raise IOError('No checkpoint found in {0}.'.format(path))
+    model = _restore_object(header['model'])
+    populations = []
+    for item in header['populations']:
+        individual = _restore_object(item)
+        if 'population' in item:
+            block = _load(join(path, item['population']['file']),
+                          mmap_mode='c')
+            population = Population(individual.state_parameters,
+                                    dtype=block.dtype)
+            population._block = block
+            population._size = block.shape[-1]
+            individual._population = population
+        for key, value in item['arrays'].items():
+            individual._attributes[key] = _load(join(path, value['file']),
+                                                mmap_mode='c')
+        H = individual._attributes['history'] = History(
+            **item.get('compression', {}))
+        for key, value in item['history'].items():
+            rows, offset = value['size'], value['rows'] - value['size']
+            shape = tuple(value['shape'])
+            dtype = _dtype(value['dtype'])
+            if rows == 0:
+                continue
+            data = memmap(join(path, value['file']), dtype=dtype, mode='c',
+                          offset=offset * dtype.itemsize *
+                          int(_prod(shape)), shape=(rows, ) + shape)
+            H.record(key).load(data, total=value['total'])
+        for key, value in item.get('policies', {}).items():
+            H.policies[key] = _load_policy(path, value)
+        populations.append(individual)
+    return model, populations
+
+
+def _prod(shape):
+    n = 1
+    for item in shape:
+        n *= item
+    return n
+
+
+def _read_header(path):
+    try:
+        with open(join(path, HEADER)) as f:
+            return json.load(f)
+    except IOError:
+        return dict()
+
+
+def _object_header(obj, arrays=False):
+    """
+    Returns class and JSON serializable attributes of `obj`. Arrays are
+    expected to be saved separately if `arrays` is set.
+
+    """
+    attributes = dict()
+    for key, value in obj._attributes.items():
+        if key.startswith('_') or (key == 'history'):
+            continue
+        if isinstance(value, generic):
+            value = value.item()
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            if not (arrays and isinstance(value, ndarray)):
+                warn('Attribute {0} of {1} is not saved.'.format(
+                    key, obj.__class__.__name__), RuntimeWarning)
+            continue
+        attributes[key] = value
+    return {'class': '{0}.{1}'.format(obj.__class__.__module__,
+                                      obj.__class__.__name__),
+            'attributes': attributes}
+
+
+def _restore_object(item):
+    """Creates object from class name and attributes."""
+    module, name = item['class'].rsplit('.', 1)
+    cls = getattr(import_module(module), name)
+    obj = cls.__new__(cls)
+    obj._attributes = dict(item['attributes'])
+    return obj
+
+
+def _save_policy(path, name, policy, before=None, version=0):
+    """
+    Returns class, parameters and running state of recording policy.
+    Arrays of the state are saved as in `_save_array` and nested
+    policies, e. g. triggers of aggregates, in the same way.
+
+    """
+    before = before or dict()
+    item = dict(attributes=dict(), arrays=dict(), policies=dict())
+    item['class'] = '{0}.{1}'.format(policy.__class__.__module__,
+                                     policy.__class__.__name__)
+    for key, value in vars(policy).items():
+        child = '{0}.{1}'.format(name, key)
+        if isinstance(value, Policy):
+            item['policies'][key] = _save_policy(
+                path, child, value, before.get('policies', {}).get(key),
+                version)
+        elif isinstance(value, ndarray):
+            item['arrays'][key] = _save_array(
+                path, child, value, before.get('arrays', {}).get(key),
+                version)
+        else:
+            if isinstance(value, generic):
+                value = value.item()
+            item['attributes'][key] = value
+    return item
+
+
+def _load_policy(path, item):
+    """Restores recording policy saved by `_save_policy`."""
+    module, name = item['class'].rsplit('.', 1)
+    cls = getattr(import_module(module), name)
+    policy = cls.__new__(cls)
+    policy.__dict__.update(item['attributes'])
+    # Running state changes in place, hence it is not memory-mapped.
+    for key, value in item['arrays'].items():
+        policy.__dict__[key] = _load(join(path, value['file']))
+    for key, value in item['policies'].items():
+        policy.__dict__[key] = _load_policy(path, value)
+    return policy
+
+
+def _files(header):
+    """Returns set of data files referred to by checkpoint header."""
+    files = set()
+    for item in header.get('populations', []):
+        if 'population' in item:
+            files.add(item['population']['file'])
+        for value in item.get('arrays', {}).values():
+            files.add(value['file'])
+        for value in item.get('history', {}).values():
+            files.add(value['file'])
+        for value in item.get('policies', {}).values():
+            files.update(_policy_files(value))
+    files.discard(None)
+    return files
+
+
+def _policy_files(item):
+    """Returns set of array files of saved recording policy."""
+    files = set(value['file'] for value in item['arrays'].values())
+    for value in item['policies'].values():
+        files.update(_policy_files(value))
+    return files
+
+
+def _clean(path, header):
+    """Removes data files which `header` does not refer to."""
+    files = _files(header)
+    for name in listdir(path):
+        if name.startswith('population') and (name not in files):
+            remove(join(path, name))
+
+
+def _save_array(path, name, value, before=None, version=0):
+    """Writes array to new .npy file unless unchanged since last save."""
+    value = ascontiguousarray(value)
+    checksum = crc32(value.data) & 0xffffffff
+    item = dict(crc32=checksum, shape=list(value.shape),
+                dtype=value.dtype.str)
+    if (before is not None) and \
+            all(before.get(key) == item[key] for key in item) and \
+            exists(join(path, before['file'])):
+        item['file'] = before['file']
+        return item
+    item['file'] = '{0}.{1}.npy'.format(name, version)
+    with open(join(path, item['file']), 'wb') as f:
+        _save(f, value)
+        f.flush()
+        fsync(f.fileno())
+    return item
+
+
+def _save_record(path, name, record, before=None, version=0):
+    """
+    Appends new items of history record to raw file, or writes every
+    item to a new file if they are not contiguous with those written
+    before.
+
+    """
+    if record.shape is None:
+        return dict(file=None, rows=0, size=0, total=0, shape=[],
+                    dtype='<f8')
+    shape, dtype = list(record.shape), record.dtype.str
+    nbytes = record.dtype.itemsize * int(_prod(shape))
+    contiguous = (before is not None) and (before['shape'] == shape) and \
+        (before['dtype'] == dtype) and (before['rows'] > 0) and \
+        exists(join(path, before['file'])) and \
+        (0 <= record.total - before['total'] <= len(record))
+    if not contiguous:
+        fname, rows, mode = '{0}.{1}.raw'.format(name, version), 0, 'wb'
+        new = len(record)
+    else:
+        new = record.total - before['total']
+        # Items past those of the previous header are discarded, e. g.
+        # after interrupted saves.
+        fname, rows, mode = before['file'], before['rows'], 'r+b'
+    with open(join(path, fname), mode) as f:
+        f.seek(rows * nbytes)
+        f.truncate()
+        if new > 0:
+            # Only new items are selected, so that older compressed
+            # chunks are neither decompressed nor evicted from caches.
+            data = record.select(len(record) - new)
+            f.write(ascontiguousarray(data).data)
+        f.flush()
+        fsync(f.fileno())
+    return dict(file=fname, rows=rows + new, size=len(record),
+                total=record.total, shape=shape, dtype=dtype)
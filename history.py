@@ -0,0 +1,898 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for Lagrangian modelling.
+
+This module implements the storage backend for the history of
+individuals.
+
+Disclaimer
+----------
+This software may be used, copied, or redistributed as long as it is
+not sold and this copyright notice is reproduced on each copy made.
+This routine is provided as is without any express or implied
+warranties whatsoever.
+
+Author
+------
+Sebastian Krieger (sebastian.krieger@usp.br)
+
+Revision
+--------
+1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+import zlib
+from collections import OrderedDict
+from copy import deepcopy
+
+from numpy import (add, array, asarray, ascontiguousarray, bitwise_xor,
+                   concatenate, dtype as _dtype, empty, errstate, fmax, fmin,
+                   frombuffer, inf, intp, isnan, nan, ndarray, result_type,
+                   searchsorted, subtract, uint8)
+
+from gaia.base import profiler
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class Record(object):
+    """
+    Growable circular buffer holding the history of one variable.
+
+    Storage is preallocated and grows by doubling its capacity, so that
+    appending T items costs O(T) amortized time. When a maximum number
+    of items is set, the buffer behaves as a true circular buffer and
+    the oldest items are overwritten in place.
+
+    """
+    def __init__(self, capacity=16):
+        self._data = None
+        self._start = 0
+        self._size = 0
+        self._capacity = max(int(capacity), 1)
+        # Length of the last axis of items, if smaller than that of the
+        # storage.
+        self._width = None
+        # Number of items appended since creation, including discarded
+        # ones.
+        self.total = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value, nmax=inf):
+        """
+        Appends `value` to the record.
+
+        Parameters
+        ----------
+        value : float, array like
+            Item to append. All items in one record must have the same
+            shape.
+        nmax : int, optional
+            Number of maximum items to be stored. Older items are
+            discarded.
+
+        """
+        value = asarray(value)
+        if self._data is None:
+            n = self._capacity if nmax == inf else min(self._capacity, nmax)
+            self._data = empty((n, ) + value.shape, dtype=value.dtype)
+            self._width = None
+        elif value.shape != self.shape:
+            raise ValueError('Shape mismatch: cannot append item of shape '
+                             '{0} to record of shape {1}.'.format(
+                                 value.shape, self.shape))
+        elif result_type(self._data, value) != self._data.dtype:
+            self._reserve(self._data.shape[0], result_type(self._data, value))
+        #
+        if self._data.shape[0] > nmax:
+            # Maximum number of items was reduced since the last call,
+            # the newest ones are kept in a buffer of that size.
+            self._reserve(nmax)
+        #
+        self.total += 1
+        cap = self._data.shape[0]
+        if self._size < cap:
+            self._items()[(self._start + self._size) % cap] = value
+            self._size += 1
+        elif cap < nmax:
+            self._reserve(cap * 2 if nmax == inf else min(cap * 2, nmax))
+            self._items()[self._size] = value
+            self._size += 1
+        else:
+            # The buffer is full, overwrites the oldest item.
+            self._items()[self._start] = value
+            self._start = (self._start + 1) % cap
+
+    def view(self):
+        """
+        Returns stored items in chronological order.
+
+        The result is a view into the buffer unless the circular buffer
+        has wrapped around, in which case a copy is returned.
+
+        """
+        return self.select()
+
+    def select(self, start=None, stop=None, index=None, member=None):
+        """
+        Returns range of stored items in chronological order.
+
+        Parameters
+        ----------
+        start, stop : int, optional
+            Range of items, as in slices.
+        index : int, slice, array like, optional
+            Selection along the last axis of items, e. g. individuals.
+        member : int, optional
+            Selection along the first of two item axes, e. g. ensemble
+            members.
+
+        The result is a strided view into the buffer if the range does
+        not wrap around the circular buffer and `index` is an integer
+        or a slice. Otherwise only the selected entries are copied.
+
+        """
+        if self._data is None:
+            return None
+        start, stop, _ = slice(start, stop).indices(self._size)
+        stop = max(start, stop)
+        data = self._items()
+        sel = _selection(data.ndim - 1, index, member)
+        cap = data.shape[0]
+        a = (self._start + start) % cap
+        b = a + stop - start
+        if b <= cap:
+            return data[a:b][sel]
+        return concatenate((data[a:][sel], data[:b-cap][sel]), axis=0)
+
+    @property
+    def shape(self):
+        """Shape of each item, or None if nothing was appended."""
+        if self._data is None:
+            return None
+        return self._items().shape[1:]
+
+    @property
+    def dtype(self):
+        """Data type of items, or None if nothing was appended."""
+        if self._data is None:
+            return None
+        return self._data.dtype
+
+    @property
+    def nbytes(self):
+        """Number of bytes of allocated storage."""
+        if self._data is None:
+            return 0
+        return self._data.nbytes
+
+    def discard(self, n):
+        """Discards the `n` oldest items."""
+        n = min(int(n), self._size)
+        if (self._data is None) or (n <= 0):
+            return
+        self._start = (self._start + n) % self._data.shape[0]
+        self._size -= n
+
+    def resize(self, width, fill=None):
+        """
+        Changes the length of the last axis of items, e. g. when
+        individuals are born. Storage grows by doubling and stored
+        items are padded with `fill`, NaN by default.
+
+        """
+        if self._data is None:
+            return
+        width = int(width)
+        old = self._items().shape[-1]
+        if fill is None:
+            fill = nan if self._data.dtype.kind in 'fc' else 0
+        if width > self._data.shape[-1]:
+            data = empty(self._data.shape[:-1] +
+                         (max(width, 2 * self._data.shape[-1]), ),
+                         dtype=self._data.dtype)
+            data[..., :old] = self._data[..., :old]
+            self._data = data
+        if width > old:
+            self._data[..., old:width] = fill
+        self._width = width
+
+    def load(self, data, total=None):
+        """
+        Replaces stored items by `data`, which may be memory-mapped.
+        Items are only copied once storage needs to grow.
+
+        """
+        self._data = data
+        self._width = None
+        self._start = 0
+        self._size = data.shape[0]
+        self.total = self._size if total is None else total
+
+    def expand(self, members):
+        """Repeats stored items along a new leading member axis."""
+        if self._data is None:
+            return
+        data = self.view()
+        self._data = empty((self._data.shape[0], int(members)) +
+                           data.shape[1:], dtype=self._data.dtype)
+        self._data[:self._size] = data[:, None]
+        self._start = 0
+        self._width = None
+
+    def _items(self):
+        """Returns storage trimmed to the width of items."""
+        if self._width is None:
+            return self._data
+        return self._data[..., :self._width]
+
+    def _reserve(self, capacity, dtype=None):
+        """Moves items into new buffer of given capacity and type."""
+        if dtype is None:
+            dtype = self._data.dtype
+        data = empty((int(capacity), ) + self._data.shape[1:], dtype=dtype)
+        n = min(self._size, data.shape[0])
+        if self._width is None:
+            data[:n] = self.view()[self._size-n:]
+        else:
+            data[:n, ..., :self._width] = self.view()[self._size-n:]
+        self._data = data
+        self._start = 0
+        self._size = n
+
+
+class CompressedRecord(Record):
+    """
+    Record holding the history of one variable in compressed chunks.
+
+    Items are appended to an uncompressed buffer (see `Record`). Once
+    it holds `chunk` items, they are encoded and compressed with zlib:
+    bit patterns of floating point items are XOR-ed with those of the
+    previous item and integer items are replaced by their differences,
+    bytes of equal significance are grouped together. Smooth or slowly
+    changing time series thereby compress well, although the ratio
+    depends on the data. Queries are served by a least recently used
+    cache of `cache` decompressed chunks.
+
+    """
+    def __init__(self, chunk=1024, cache=4, capacity=16):
+        self.chunk = max(int(chunk), 1)
+        self.cache = max(int(cache), 0)
+        self._capacity = max(int(capacity), 1)
+        self._reset()
+        self.total = 0
+
+    def __len__(self):
+        return self._stored + len(self._hot)
+
+    def append(self, value, nmax=inf):
+        """
+        Appends `value` to the record.
+
+        Parameters
+        ----------
+        value : float, array like
+            Item to append. All items in one record must have the same
+            shape.
+        nmax : int, optional
+            Number of maximum items to be stored. Older items are
+            discarded.
+
+        """
+        value = asarray(value)
+        if self._shape is None:
+            self._shape, self._dtype = value.shape, value.dtype
+        elif value.shape != self._shape:
+            raise ValueError('Shape mismatch: cannot append item of shape '
+                             '{0} to record of shape {1}.'.format(
+                                 value.shape, self._shape))
+        else:
+            self._dtype = result_type(self._dtype, value)
+        self.total += 1
+        self._hot.append(value)
+        if len(self._hot) >= self.chunk:
+            self._compress(self._hot.view())
+            self._hot = Record(self._capacity)
+        if len(self) > nmax:
+            self.discard(len(self) - nmax)
+
+    def select(self, start=None, stop=None, index=None, member=None):
+        """
+        Returns range of stored items in chronological order.
+
+        Parameters are the same as in `Record.select`. Items which are
+        not compressed yet are returned as a view if the range does not
+        include compressed ones. Otherwise the decompressed chunks are
+        read-only views or the selected entries are copied.
+
+        """
+        if self._shape is None:
+            return None
+        start, stop, _ = slice(start, stop).indices(len(self))
+        stop = max(start, stop)
+        sel = _selection(len(self._shape), index, member)
+        parts = []
+        lower = -self._offset
+        for item in self._chunks:
+            upper = lower + item[1]
+            a, b = max(start, lower), min(stop, upper)
+            if a < b:
+                parts.append(self._decompress(item)[a-lower:b-lower][sel])
+            lower = upper
+        if stop > lower:
+            parts.append(self._hot.select(max(start - lower, 0),
+                                          stop - lower, index, member))
+        if len(parts) == 0:
+            return empty((0, ) + self._shape, dtype=self._dtype)[sel]
+        elif len(parts) == 1:
+            return parts[0]
+        return concatenate(parts, axis=0)
+
+    @property
+    def shape(self):
+        """Shape of each item, or None if nothing was appended."""
+        return self._shape
+
+    @property
+    def dtype(self):
+        """Data type of items, or None if nothing was appended."""
+        return self._dtype
+
+    @property
+    def nbytes(self):
+        """
+        Number of bytes of compressed chunks and of the uncompressed
+        buffer, not counting the cache.
+
+        """
+        return (sum(len(item[4]) if not isinstance(item[4], ndarray) else
+                    item[4].nbytes for item in self._chunks) +
+                self._hot.nbytes)
+
+    def discard(self, n):
+        """Discards the `n` oldest items."""
+        n = min(int(n), len(self))
+        while (n > 0) and (len(self._chunks) > 0):
+            rows = self._chunks[0][1] - self._offset
+            if rows > n:
+                self._offset += n
+                self._stored -= n
+                return
+            self._cache.pop(self._chunks.pop(0)[0], None)
+            self._offset = 0
+            self._stored -= rows
+            n -= rows
+        self._hot.discard(n)
+
+    def resize(self, width, fill=None):
+        """
+        Changes the length of the last axis of items, e. g. when
+        individuals are born. Compressed items are truncated or padded
+        with `fill`, NaN by default, when they are decompressed, as in
+        `Record.resize`.
+
+        """
+        if self._shape is None:
+            return
+        if fill is None:
+            fill = nan if self._dtype.kind in 'fc' else 0
+        width = int(width)
+        self._hot.resize(width, fill)
+        self._shape = self._shape[:-1] + (width, )
+        self._chunks = [item[:5] + (_layout(item[5], width, fill), )
+                        for item in self._chunks]
+        self._cache.clear()
+
+    def load(self, data, total=None):
+        """Replaces stored items by `data`, which are compressed."""
+        self._reset()
+        n = data.shape[0]
+        self._shape, self._dtype = data.shape[1:], data.dtype
+        full = n - n % self.chunk
+        for i in range(0, full, self.chunk):
+            self._compress(data[i:i+self.chunk])
+        if full < n:
+            self._hot.load(array(data[full:]))
+        self.total = n if total is None else total
+
+    def expand(self, members):
+        """Repeats stored items along a new leading member axis."""
+        data = self.view()
+        if data is None:
+            return
+        expanded = empty((data.shape[0], int(members)) + data.shape[1:],
+                         dtype=data.dtype)
+        expanded[:] = data[:, None]
+        self.load(expanded, self.total)
+
+    def _reset(self):
+        """Discards every stored item."""
+        # Compressed chunks as tuples of key, number of items, shape and
+        # type of items, encoded data and layout of the last axis (see
+        # `_layout`).
+        self._chunks = []
+        self._offset = 0
+        # Number of compressed items which are not discarded.
+        self._stored = 0
+        self._serial = 0
+        self._cache = OrderedDict()
+        self._hot = Record(self._capacity)
+        self._shape = None
+        self._dtype = None
+
+    def _compress(self, data):
+        """Appends chunk of items."""
+        layout = (data.shape[-1], ()) if data.ndim > 1 else None
+        self._chunks.append((self._serial, data.shape[0], data.shape[1:],
+                             data.dtype, _encode(data), layout))
+        self._serial += 1
+        self._stored += data.shape[0]
+
+    def _decompress(self, item):
+        """Returns items of chunk, decompressed if not in the cache."""
+        key, rows, shape, dtype, blob, layout = item
+        try:
+            data = self._cache.pop(key)
+        except KeyError:
+            data = _decode(blob, rows, shape, dtype)
+            if (layout is not None) and (len(layout[1]) > 0):
+                valid, start = layout[0], layout[0]
+                padded = empty((rows, ) + self._shape, dtype=self._dtype)
+                padded[..., :valid] = data[..., :valid]
+                for stop, fill in layout[1]:
+                    padded[..., start:stop] = fill
+                    start = stop
+                data = padded
+            elif (layout is not None) and (layout[0] < shape[-1]):
+                data = data[..., :layout[0]]
+            if data.dtype != self._dtype:
+                data = data.astype(self._dtype)
+            data.flags.writeable = False
+            profiler.count('history.decompressed')
+        self._cache[key] = data
+        while len(self._cache) > self.cache:
+            self._cache.popitem(last=False)
+        return data
+
+
+class Policy(object):
+    """
+    Base class for recording policies, which decide when items of a
+    variable are recorded (see `History.policy`).
+
+    """
+    # Suffixes of record names of sampled items.
+    suffixes = ('', )
+
+    def sample(self, value, time=None):
+        """
+        Returns dictionary of items to record, indexed by the suffix of
+        their record name, or None if nothing is to be recorded.
+
+        """
+        return {'': value}
+
+
+class Every(Policy):
+    """Records every `k`-th item, starting with the first one."""
+    def __init__(self, k):
+        self.k = max(int(k), 1)
+        self._count = 0
+
+    def sample(self, value, time=None):
+        count, self._count = self._count, (self._count + 1) % self.k
+        return {'': value} if count == 0 else None
+
+
+class Interval(Policy):
+    """Records items at least `dt` time units apart."""
+    def __init__(self, dt):
+        self.dt = dt
+        self._last = None
+
+    def sample(self, value, time=None):
+        if time is None:
+            raise ValueError('Interval recording requires time.')
+        if (self._last is not None) and \
+                (time < self._last + self.dt * (1 - 1e-9)):
+            return None
+        self._last = time
+        return {'': value}
+
+
+class OnChange(Policy):
+    """
+    Records items which differ from the last recorded one by more than
+    `tolerance` anywhere.
+
+    """
+    def __init__(self, tolerance=0.):
+        self.tolerance = tolerance
+        self._last = None
+
+    def sample(self, value, time=None):
+        value = asarray(value)
+        last = self._last
+        if (last is not None) and (last.shape == value.shape):
+            if not (isnan(value) != isnan(last)).any():
+                with errstate(invalid='ignore'):
+                    if not (abs(value - last) > self.tolerance).any():
+                        return None
+        self._last = array(value, copy=True)
+        return {'': value}
+
+
+class Aggregate(Policy):
+    """
+    Records running minimum, maximum and mean of items between samples
+    taken by policy `trigger`, as variables with suffixes '.min',
+    '.max' and '.mean'.
+
+    """
+    suffixes = ('.min', '.max', '.mean')
+
+    def __init__(self, trigger):
+        self.trigger = trigger
+        self._reset()
+
+    def sample(self, value, time=None):
+        value = asarray(value, dtype=float)
+        if (self._count == 0) or (self._sum.shape != value.shape):
+            self._min = array(value, copy=True)
+            self._max = array(value, copy=True)
+            self._sum = array(value, copy=True)
+            self._count = 1
+        else:
+            fmin(self._min, value, out=self._min)
+            fmax(self._max, value, out=self._max)
+            self._sum += value
+            self._count += 1
+        if self.trigger.sample(value, time) is None:
+            return None
+        items = {'.min': self._min, '.max': self._max,
+                 '.mean': self._sum / self._count}
+        self._reset()
+        return items
+
+    def _reset(self):
+        self._min = self._max = self._sum = None
+        self._count = 0
+
+
+class History(object):
+    """
+    Collection of history records indexed by variable name.
+
+    The time of every item is kept in the 'time' record, if given when
+    appending, which allows queries by time range (see `query`).
+
+    If `chunk` is set, records keep their items in compressed chunks of
+    that size and a cache of `cache` decompressed chunks per record
+    (see `CompressedRecord` and `compress`).
+
+    """
+    def __init__(self, capacity=16, chunk=None, cache=4):
+        self._records = dict()
+        self._capacity = capacity
+        self.chunk = chunk
+        self.cache = cache
+        # Recording policies indexed by variable name.
+        self._policies = dict()
+        # Writer and name to which appended items are streamed.
+        self._stream = None
+
+    def __contains__(self, key):
+        return key in self._records
+
+    def __getitem__(self, key):
+        return self._records[key].view()
+
+    def __len__(self):
+        return len(self._records)
+
+    def keys(self):
+        """Returns list of recorded variables."""
+        return self._records.keys()
+
+    def record(self, key):
+        """Returns record of variable `key`, created if needed."""
+        try:
+            return self._records[key]
+        except KeyError:
+            if self.chunk is None:
+                record = Record(self._capacity)
+            else:
+                record = CompressedRecord(self.chunk, self.cache,
+                                          self._capacity)
+            self._records[key] = record
+            return record
+
+    def compress(self, chunk=1024, cache=4):
+        """
+        Changes storage of every record to compressed chunks of `chunk`
+        items, or to uncompressed buffers if `chunk` is None. Items
+        stored so far are kept.
+
+        """
+        self.chunk, self.cache = chunk, cache
+        for key, old in list(self._records.items()):
+            del self._records[key]
+            data = old.view()
+            record = self.record(key)
+            if data is None:
+                continue
+            if chunk is None:
+                # Decompressed chunks are read-only.
+                data = array(data, copy=True)
+            record.load(data, total=old.total)
+
+    @property
+    def nbytes(self):
+        """Number of bytes of storage of every record."""
+        return sum(record.nbytes for record in self._records.values())
+
+    @property
+    def policies(self):
+        """Recording policies indexed by variable name."""
+        return self._policies
+
+    @property
+    def timed(self):
+        """True if recording policies keep the time of their items."""
+        return len(self._policies) > 0
+
+    def append(self, key, value, nmax=inf, time=None):
+        """
+        Appends `value` to the history of variable `key`, subject to
+        its recording policy. Variables with a policy keep the `time`
+        of their items in record `key` + '.time'.
+
+        """
+        policy = self._policies.get(key)
+        if policy is None:
+            self._append(key, value, nmax)
+            return
+        items = policy.sample(value, time)
+        if items is None:
+            return
+        if time is not None:
+            self._append(key + '.time', time, nmax)
+        for suffix, item in items.items():
+            self._append(key + suffix, item, nmax)
+
+    def policy(self, key, policy):
+        """
+        Sets recording policy of variable `key`, e. g. `Every`,
+        `Interval`, `OnChange` or `Aggregate`. Policies keep state,
+        hence a copy of `policy` is used. Variables without policy, or
+        with policy None, are recorded at every call.
+
+        """
+        if policy is None:
+            self._policies.pop(key, None)
+            return
+        self._policies[key] = deepcopy(policy)
+        # Items recorded so far get their times from the common record.
+        name = key + '.time'
+        if ('' in policy.suffixes) and (key in self._records) and \
+                (name not in self._records) and ('time' in self._records):
+            time = self._records['time'].view()
+            if len(time) == len(self._records[key]):
+                for item in time:
+                    self.record(name).append(item)
+
+    def _append(self, key, value, nmax):
+        """Appends `value` to record `key` and to the stream."""
+        self.record(key).append(value, nmax=nmax)
+        if self._stream is not None:
+            writer, name = self._stream
+            writer.append(name, key, value)
+
+    def stream(self, writer, name):
+        """
+        Passes every item appended from now on to `writer` (see
+        `gaia.output.StreamWriter`) as history `name`. Streaming stops
+        if `writer` is None.
+
+        """
+        self._stream = None if writer is None else (writer, name)
+
+    def expand(self, keys, members):
+        """
+        Repeats history of given variables along a new member axis,
+        e. g. when individuals become an ensemble.
+
+        """
+        for key in keys:
+            if key in self._records:
+                self._records[key].expand(members)
+
+    def resize(self, size, old):
+        """
+        Changes the number of individuals from `old` to `size` in every
+        record whose items have one entry per individual. Entries of
+        new individuals are NaN before they were born.
+
+        """
+        for record in self._records.values():
+            shape = record.shape
+            if (shape is not None) and (len(shape) > 0) and \
+                    (shape[-1] == old):
+                record.resize(size)
+
+    def query(self, keys=None, ids=None, t=None, member=None,
+              ensemble=None):
+        """
+        Returns history of selected variables, individuals and times.
+
+        Selections are applied to each record before anything is
+        copied, so that results are views into the records whenever
+        possible (see `Record.select`).
+
+        Parameters
+        ----------
+        keys : list, optional
+            List of keys to return, if not set returns all recorded
+            variables.
+        ids : int, slice, array like, optional
+            Individuals, selected along the last axis of items.
+        t : tuple, optional
+            Time range (t_start, t_end), both inclusive. Bounds set to
+            None are open. Requires the 'time' record.
+        member : int, optional
+            Ensemble member, selected from records of two dimensional
+            items.
+        ensemble : list, optional
+            Variables expanded for the ensemble (see `expand`). If set,
+            `member` is only selected from their records, including
+            those kept by recording policies, e. g. 'P.mean'.
+
+        """
+        if keys is None:
+            keys = self._records.keys()
+        if isinstance(ids, (set, frozenset)):
+            ids = sorted(ids)
+        if isinstance(ids, (list, tuple)):
+            ids = asarray(ids, dtype=intp)
+        if (t is not None) and not any(
+                (key == 'time') or key.endswith('.time') for key in
+                self._records):
+            raise ValueError('History has no time record.')
+        ranges = dict()
+        result = dict()
+        for key in keys:
+            if key not in self._records:
+                continue
+            start, stop = None, None
+            if t is not None:
+                # Variables with a recording policy have own times.
+                name = key.split('.')[0] + '.time'
+                if name not in self._records:
+                    name = 'time'
+                if name not in self._records:
+                    raise ValueError('History has no time record.')
+                if name not in ranges:
+                    ranges[name] = self._range(name, t)
+                start, stop = ranges[name]
+            if (ensemble is None) or (key.split('.')[0] in ensemble):
+                selection = member
+            else:
+                selection = None
+            result[key] = self._records[key].select(start, stop, ids,
+                                                    selection)
+        return result
+
+    def _range(self, name, t):
+        """Returns range of items of time record `name` within `t`."""
+        time = self._records[name].view()
+        start, stop = None, None
+        if t[0] is not None:
+            start = searchsorted(time, t[0], side='left')
+        if t[1] is not None:
+            stop = searchsorted(time, t[1], side='right')
+        return start, stop
+
+    def asdict(self, keys=None):
+        """
+        Returns dictionary of arrays with the history of each variable.
+
+        Parameters
+        ----------
+        keys : list, optional
+            List of keys to return, if not set returns all recorded
+            variables.
+
+        """
+        if keys is None:
+            keys = self._records.keys()
+        return dict((key, self._records[key].view()) for key in keys
+                    if key in self._records)
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def _layout(layout, width, fill):
+    """
+    Returns layout of the last axis of compressed items after resizing
+    to `width`, as the number of stored entries which are kept and the
+    (stop, fill) pairs of the ranges padded after them.
+
+    """
+    if layout is None:
+        return None
+    valid, pads = layout
+    if width <= valid:
+        return width, ()
+    kept = []
+    start = valid
+    for stop, value in pads:
+        if start >= width:
+            break
+        kept.append((min(stop, width), value))
+        start = stop
+    if start < width:
+        kept.append((width, fill))
+    return valid, tuple(kept)
+
+
+def _selection(ndim, index=None, member=None):
+    """Returns index of entries of items with `ndim` dimensions."""
+    sel = (Ellipsis, )
+    if (member is not None) and (ndim == 2):
+        sel = (slice(None), member)
+    if (index is not None) and (ndim > 0):
+        sel = sel + (index, )
+    return sel
+
+
+def _word(itemsize):
+    """Returns the largest unsigned integer type which divides items."""
+    for size in (8, 4, 2, 1):
+        if itemsize % size == 0:
+            return _dtype('u{0}'.format(size))
+
+
+def _encode(data):
+    """
+    Returns compressed chunk of items. Bit patterns of floating point
+    items are XOR-ed with those of the previous item and integer items
+    are replaced by their differences, then bytes are grouped by their
+    significance. Arrays of objects are kept as they are.
+
+    """
+    if data.dtype.hasobject or (data.size == 0):
+        return array(data, copy=True)
+    word = _word(data.dtype.itemsize)
+    value = ascontiguousarray(data).reshape(data.shape[0], -1).view(word)
+    code = value.copy()
+    if data.dtype.kind in 'biumM':
+        subtract(value[1:], value[:-1], out=code[1:])
+    else:
+        bitwise_xor(value[1:], value[:-1], out=code[1:])
+    code = ascontiguousarray(code.view(uint8).reshape(-1, word.itemsize).T)
+    return zlib.compress(code.tostring())
+
+
+def _decode(blob, rows, shape, dtype):
+    """Returns items of chunk compressed by `_encode`."""
+    if isinstance(blob, ndarray):
+        return blob
+    word = _word(dtype.itemsize)
+    code = frombuffer(zlib.decompress(blob), dtype=uint8)
+    code = ascontiguousarray(code.reshape(word.itemsize, -1).T)
+    code = code.view(word).reshape(rows, -1)
+    if dtype.kind in 'biumM':
+        add.accumulate(code, axis=0, out=code)
+    else:
+        bitwise_xor.accumulate(code, axis=0, out=code)
+    return code.view(dtype).reshape((rows, ) + tuple(shape))
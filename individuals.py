@@ -21,10 +21,19 @@ Revision
 """
 from __future__ import division
 
-from numpy import append, array, bool_, exp, tanh, ndarray, ones, nan, inf
-from numpy.core.records import fromrecords
+from copy import copy
+from functools import partial
 
-from gaia.base import BaseClass
+from numpy import (add, arange, array, asarray, atleast_1d, bool_,
+                   broadcast_to, divide, dtype as _dtype, empty, exp,
+                   flatnonzero, fmax, full, inf, intp, maximum, minimum,
+                   multiply, nan,
+                   ndarray, ndim, ones, prod, subtract, tanh)
+
+from gaia.base import BaseClass, profiler
+from gaia.history import History
+from gaia.population import Population, _fill_value, common_size
+from gaia.tables import decay_table, exp_table, tanh_table
 
 __version__ = '$Revision: 1 $'
 # $Source$
@@ -37,36 +46,175 @@ def only_positive(y):
     return y * (y >= 0) + 0 * (y < 0)
 
 
+def _take(value, index, n):
+    """Selects individuals from per individual arrays."""
+    if (index is None) or (not isinstance(value, ndarray)):
+        return value
+    if value.shape[-1:] == (n, ):
+        return value.take(index, axis=-1)
+    return value
+
+
 ###############################################################################
 # CLASSES
 #############################################################################
 class Individual(BaseClass):
     """
     Class that characterizes an individual in an individual-based model.
+
+    State parameters are stored in a columnar population block (see
+    `gaia.population.Population`) and their properties return views into
+    it. Every other attribute is stored as is.
+
     """
+    # Columnar storage of state parameters.
+    _population = None
+    # State parameters integrated in time by `gaia.models.Model`.
+    prognostic_parameters = []
+    # State parameters which add up when individuals are merged, e. g.
+    # biomass. The first one weights intensive ones.
+    extensive_parameters = []
 
     def __init__(self, **kwargs):
         # Runs BaseClass.__init__ for default object initialization.
         super(Individual, self).__init__(**kwargs)
         # Ressets state parameters
-        self._attributes['history'] = dict()
+        self._attributes['history'] = History()
         self.state_parameters = []
 
+    def _set_attribute(self, attrib, val):
+        population = self._population
+        if (population is not None) and (attrib in population):
+            population[attrib] = val
+        else:
+            self._attributes[attrib] = val
+
+    def _get_attribute(self, attrib):
+        population = self._population
+        if (population is not None) and (attrib in population):
+            return population[attrib]
+        else:
+            return self._attributes.get(attrib)
+
     def set_state_parameters(self, params):
         """Sets the state parameters of the individual."""
         self.state_parameters = params
 
-    def append_history(self, extra=None, nmax=inf):
+    @property
+    def state_parameters(self):
+        """List of state parameters stored in the population block."""
+        return self._attributes.get('state_parameters')
+
+    @state_parameters.setter
+    def state_parameters(self, params):
+        params = list(params)
+        # Moves state parameters which are not stored in the population
+        # block anymore back into the attributes dictionary.
+        old = self._population
+        if old is not None:
+            for key in old.columns:
+                if key not in params:
+                    self._attributes[key] = old[key].copy()
+        #
+        values = [self._get_attribute(key) for key in params]
+        if len(params) == 0:
+            self._population = None
+        else:
+            population = Population(params, size=common_size(values),
+                                    dtype=self.dtype)
+            for key, value in zip(params, values):
+                if value is not None:
+                    population[key] = value
+                self._attributes.pop(key, None)
+            self._population = population
+        self._attributes['state_parameters'] = params
+
+    @property
+    def population(self):
+        """Columnar storage of state parameters."""
+        return self._population
+
+    @property
+    def dtype(self):
+        """
+        Floating point type of state parameters, kernel workspaces and
+        history, e. g. 'float32' to halve memory and bandwidth.
+
+        """
+        if self._population is not None:
+            return self._population.dtype
+        return _dtype(self._attributes.get('dtype', 'float64'))
+
+    @dtype.setter
+    def dtype(self, a):
+        a = _dtype(a)
+        self._attributes['dtype'] = a.name
+        if self._population is not None:
+            self._population.astype(a)
+        for key in ['_workspace', '_compact']:
+            self._attributes.pop(key, None)
+
+    def set_ensemble(self, **parameters):
+        """
+        Turns individuals into an ensemble, e. g. for parameter sweeps.
+
+        State parameters become arrays of shape (members, size), with
+        every member starting from the current state. Given parameters
+        become arrays of shape (members, 1), so that every rate
+        calculation broadcasts over members and individuals.
+
+        Parameters
+        ----------
+        parameters : keyword arguments
+            Sequences with the parameter value of each member. Every
+            sequence must have the same length, which sets the number
+            of members. Other parameters are shared by all members.
+
+        Example
+        -------
+        plankton.set_ensemble(mu_m=[0.5, 0.6], K_Q_N=[0.15, 0.18])
+
+        """
+        values = dict((key, asarray(value, dtype=float).ravel()) for
+                      key, value in parameters.items())
+        members = set(len(value) for value in values.values())
+        if len(members) != 1:
+            raise ValueError('Parameters must have the same number of '
+                             'members.')
+        members = members.pop()
+        self._population.set_members(members)
+        self._attributes['history'].expand(self.state_parameters, members)
+        for key, value in values.items():
+            setattr(self, key, value.reshape(members, 1))
+        for key in ['_workspace', '_compact']:
+            self._attributes.pop(key, None)
+
+    @property
+    def members(self):
+        """Number of ensemble members."""
+        if self._population is None:
+            return 1
+        return self._population.members
+
+    def append_history(self, extra=None, nmax=inf, time=None):
         """
         Appends current status to individuum's history. Note that the
-        list of variables is given in state_parameters.
+        list of variables is given in state_parameters. History is kept
+        in preallocated buffers (see `gaia.history.Record`), so appending
+        does not copy previous items.
 
         Parameters
         ----------
         extra : dictionary, optional
             Dictionary containing extra values to append.
         nmax : int, optional
-            Number of maximum history items to be stored.
+            Number of maximum history items to be stored. Once reached,
+            the oldest items are overwritten in place.
+        time : float, optional
+            Model time, recorded as 'time' to allow queries by time
+            range. If not set, the latest time of individuals is only
+            used once history has a 'time' record or recording policies
+            (see `set_recording`).
 
         Returns
         -------
@@ -77,75 +225,513 @@ class Individual(BaseClass):
         append_history()
 
         """
-        for key in self.state_parameters:
-            try:
-                if nmax == inf:
-                    start = -self._attributes['history'][key].shape[0]
-                else:
-                    start = -nmax
-                self._attributes['history'][key] = (
-                    append(
-                        self._attributes['history'][key][start:, ],
-                        [self._attributes[key]],
-                        axis=0
-                    )
-                )
-            except:
-                self._attributes['history'][key] = array(
-                    [self._attributes[key]])
-
-        # Walks through every entry in extra parameter and append to history.
-        if isinstance(extra, dict):
-            for key, value in extra.items():
-                try:
-                    self._attributes['history'][key] = (
-                        append(
-                            self._attributes['history'][key],
-                            [value],
-                            axis=0
-                        )
-                    )
-                except:
-                    self._attributes['history'][key] = array([value])
-        elif extra is not None:
-            raise ValueError('Invalid data for extra values.')
-
-    def history(self, id=None, keys=None):
+        with profiler.timer('history'):
+            H = self._attributes['history']
+            if (time is None) and (H.timed or ('time' in H)):
+                time = self._latest_time()
+            if time is not None:
+                self._record_times()
+                H.append('time', time, nmax=nmax)
+            for key in self.state_parameters:
+                H.append(key, self._get_attribute(key), nmax=nmax,
+                         time=time)
+
+            # Walks through every entry in extra parameter and append to
+            # history.
+            if isinstance(extra, dict):
+                for key, value in extra.items():
+                    H.append(key, value, time=time)
+            elif extra is not None:
+                raise ValueError('Invalid data for extra values.')
+
+    def set_recording(self, **policies):
+        """
+        Sets recording policies of history variables.
+
+        By default every variable is recorded whenever `append_history`
+        is called. Slow variables may be recorded less often, e. g.
+        every k-th call, at time intervals, only when they change or as
+        running aggregates, see `gaia.history.Policy`. Their times are
+        kept in records with suffix '.time'.
+
+        Parameters
+        ----------
+        policies : keyword arguments
+            Recording policy of each variable, None records at every
+            call.
+
+        Example
+        -------
+        from gaia.history import Aggregate, Every, OnChange
+        plankton.set_recording(C_Chla=OnChange(1e-3), P=Every(10),
+                               N_P=Aggregate(Every(10)))
+
+        """
+        self._record_times()
+        H = self._attributes['history']
+        for key, policy in policies.items():
+            H.policy(key, policy)
+
+    def compress_history(self, chunk=1024, cache=4):
+        """
+        Keeps history in compressed chunks.
+
+        Long histories of smooth or slowly changing variables take much
+        less memory once chunks of `chunk` items are encoded and
+        compressed (see `gaia.history.CompressedRecord`). The last
+        `cache` decompressed chunks of every variable are kept to serve
+        queries. If `chunk` is None, history is decompressed.
+
+        Example
+        -------
+        plankton.compress_history(chunk=256)
+        model.run(365., plankton, environments)
+        print(plankton._attributes['history'].nbytes)
+
+        """
+        self._attributes['history'].compress(chunk, cache)
+
+    def stream(self, writer, name):
+        """
+        Streams history to disk.
+
+        Every item appended to the history from now on is also written
+        by `writer` (see `gaia.output.StreamWriter`) as history `name`.
+        Together with `nmax`, memory use stays flat during long runs.
+        Streaming stops if `writer` is None.
+
+        Example
+        -------
+        writer = gaia.output.StreamWriter('run')
+        plankton.stream(writer, 'plankton')
+        model.run(365., plankton, environments, nmax=10)
+        writer.close()
+
+        """
+        self._attributes['history'].stream(writer, name)
+
+    def history(self, id=None, keys=None, member=None, t=None):
         """
         Returns history according to individual id and variable key.
 
         Parameters
         ----------
-        id : int, optional
-            Array index for tracking a specific individual.
+        id : int, slice, array like, optional
+            Ids of individuals to track, which are their slots (see
+            `spawn`), e. g. 3, [1, 5] or slice(0, 100).
         keys : list, optional
             List of keys to return, if not set returns all monitored
             parameters.
+        member : int, optional
+            Ensemble member, if set only its history of state
+            parameters is returned from the ensemble history. Other
+            variables, e. g. extra values, are returned as recorded.
+        t : tuple, optional
+            Time range (t_start, t_end), both inclusive, of items to
+            return.
 
         Returns
         -------
         H : dictionary
             Dictionary with arrays of each selected parameter in
-            individual's history.
+            individual's history. Arrays are views into the history
+            whenever possible (see `gaia.history.History.query`).
+
+        Example
+        -------
+        history(id=3, keys=['x', 'y', 'z'], t=(10., 20.))
 
         """
         H = self._get_attribute('history')
-        if (keys is None) & (id is None):
-            return self._get_attribute('history')
-        elif keys is None:
-            keys = H.keys()
-        elif isinstance(keys, basestring):
+        if isinstance(keys, basestring):
             keys = [keys]
-        #
-        if id is None:
-            return dict((key, value) for (key, value) in H.iteritems()
-                        if key in keys)
+        if t is not None:
+            self._record_times()
+        ensemble = self.state_parameters if self.members > 1 else []
+        return H.query(keys, ids=id, t=t, member=member, ensemble=ensemble)
+
+    def _latest_time(self):
+        """Returns latest time of individuals, if any."""
+        t = self.t
+        if t is None:
+            return None
+        t = asarray(t)
+        return fmax.reduce(t, axis=None) if t.size else nan
+
+    def _record_times(self):
+        """
+        Records the latest time of individuals of every item appended
+        so far as 'time', if history has no 'time' record yet, so that
+        items appended without model time can be queried by time.
+
+        """
+        H = self._attributes['history']
+        if ('time' in H) or ('t' not in H):
+            return
+        t = H['t']
+        width = int(prod(t.shape[1:]))
+        if width == 0:
+            times = full(len(t), nan)
         else:
-            return dict((key, value[:, 0]) for (key, value) in H.iteritems()
-                        if key in keys)
+            times = fmax.reduce(t.reshape(len(t), width), axis=1)
+        # Not streamed, as the items were appended before.
+        record = H.record('time')
+        for item in times:
+            record.append(item)
+
+    def tendency(self, t, environments, out, rates=None):
+        """
+        Calculates time derivatives of prognostic parameters.
+
+        Parameters
+        ----------
+        t : float
+            Model time.
+        environments : dictionary
+            Environmental pools, indexed by variable name.
+        out : array like
+            Array of shape (len(prognostic_parameters), size) into which
+            the derivatives are written.
+        rates : array like, optional
+            Array of the same shape as `out` into which the linear
+            rates L of the derivatives, such that the stiff part of
+            each one is L * y, are written. Used by exponential
+            integrators, zero if unknown.
+
+        Returns
+        -------
+        out : array like
+            Time derivatives.
+
+        """
+        out[...] = 0
+        if rates is not None:
+            rates[...] = 0
+        return out
+
+    def environment(self, environments, key, t):
+        """
+        Returns environmental variable at the position of individuals.
+
+        Items in `environments` are either environmental pools, which
+        are read at current positions, or constant values.
+
+        """
+        item = environments[key]
+        if hasattr(item, 'read'):
+            return item.read(t, self.z, self.y, self.x)
+        return item
+
+    def environments(self, environments, keys, t):
+        """
+        Returns list of environmental variables at the position of
+        individuals. Groups of environmental pools (see
+        `gaia.models.EnvironmentGroup`) are read at once.
+
+        """
+        with profiler.timer('environment'):
+            if hasattr(environments, 'read'):
+                values = environments.read(t, self.z, self.y, self.x, keys)
+                return [values[key] for key in keys]
+            return [self.environment(environments, key, t) for key in keys]
+
+    def subset(self, start, stop):
+        """
+        Returns individuals from `start` to `stop` as a new object
+        sharing storage with this one.
+
+        State parameters and per individual arrays are views, hence
+        changes made to the subset are seen by the whole population.
+
+        """
+        n = self.size()
+        other = copy(self)
+        other._attributes = dict()
+        for key, value in self._attributes.items():
+            if key.startswith('_'):
+                continue
+            if isinstance(value, ndarray) and (value.shape[-1:] == (n, )):
+                value = value[..., start:stop]
+            other._attributes[key] = value
+        if self._population is not None:
+            other._population = self._population.view(start, stop)
+        return other
+
+    def subsets(self, bounds):
+        """
+        Returns subsets (see `subset`) of individuals for every pair of
+        (start, stop) in `bounds`.
+
+        Subsets are kept between calls as long as attributes and storage
+        of the population are not replaced, so that their workspaces are
+        reused, e. g. by chunked kernels evaluated at every time step.
+        Masks may change in place, hence their active individuals are
+        found again at every call.
+
+        """
+        state = [(key, value) for key, value in self._attributes.items()
+                 if not key.startswith('_')]
+        block = None if self._population is None else \
+            self._population._block
+        cached = self._attributes.get('_subsets')
+        if (cached is None) or (cached[1] is not block) or \
+                (len(cached[0]) != len(state)) or \
+                not all(self._attributes.get(key) is value for key, value
+                        in cached[0]):
+            cached = self._attributes['_subsets'] = (state, block, dict())
+        subsets = cached[2]
+        result = []
+        for start, stop in bounds:
+            try:
+                other = subsets[start, stop]
+            except KeyError:
+                other = subsets[start, stop] = self.subset(start, stop)
+            other._attributes.pop('_active', None)
+            result.append(other)
+        return result
+
+    def resize(self, size):
+        """
+        Changes the number of individuals.
+
+        State parameters and every per individual attribute array grow
+        by doubling their capacity, so that resizing costs amortized
+        O(1) per individual. New individuals are NaN, False or -1,
+        depending on the data type, and history records are padded
+        accordingly.
+
+        """
+        n, size = self.size(), int(size)
+        if size == n:
+            return
+        keys = self._individual_arrays()
+        if self._population is not None:
+            self._population.resize(size)
+        storage = self._attributes.setdefault('_storage', dict())
+        for key in keys:
+            value = self._attributes[key]
+            buf = storage.get(key)
+            if (buf is None) or (value.base is not buf):
+                buf = value
+            if size > buf.shape[-1]:
+                buf = empty(buf.shape[:-1] + (max(size, 2 * buf.shape[-1]), ),
+                            dtype=value.dtype)
+                buf[..., :n] = value
+            if size > n:
+                buf[..., n:size] = _fill_value(value.dtype)
+            storage[key] = buf
+            self._attributes[key] = buf[..., :size]
+        self._attributes['history'].resize(size, n)
+        for key in ['_active', '_workspace', '_compact']:
+            self._attributes.pop(key, None)
+
+    def spawn(self, count=1, **values):
+        """
+        Adds individuals to the population.
+
+        Slots of dead individuals are reused first, hence the id of
+        each individual equals its slot and stays the same while it
+        lives. Storage grows by doubling only once no slot is free, so
+        that spawning costs amortized O(1) per individual.
+
+        Parameters
+        ----------
+        count : int, optional
+            Number of new individuals.
+        values : keyword arguments, optional
+            Values of state parameters or per individual attributes of
+            the new individuals, others are NaN, False or -1.
+
+        Returns
+        -------
+        ids : array like
+            Ids of the new individuals.
+
+        Example
+        -------
+        plankton.spawn(2, x=[1., 2.], y=0., z=0., P=1., N_P=0.2)
+
+        """
+        ids = self._allocate(count)
+        if self._population is not None:
+            self._population._block[:, :, ids] = nan
+        for key in self._individual_arrays():
+            if key not in ['alive', 'id']:
+                value = self._attributes[key]
+                value[..., ids] = _fill_value(value.dtype)
+        in_domain = self.in_domain
+        if isinstance(in_domain, ndarray):
+            in_domain[ids] = True
+        self._set_values(ids, values)
+        return ids
+
+    def kill(self, ids):
+        """
+        Removes individuals from the population.
+
+        Individuals are marked as dead and their state parameters set
+        to NaN, so that their history shows when they died. Their ids
+        are freed for individuals born later.
+
+        """
+        ids = atleast_1d(asarray(ids, dtype=intp))
+        alive = self._array('alive', True)
+        alive[ids] = False
+        if self._population is not None:
+            self._population._block[:, :, ids] = nan
+        free = self._attributes.get('_free')
+        if free is not None:
+            free.extend(ids[::-1].tolist())
+        # Only the killed individuals leave the cached active set.
+        active = self._attributes.get('_active')
+        if active is not None:
+            active[0][ids] = False
+            active[1] = None
+
+    def divide(self, ids, fraction=0.5, **values):
+        """
+        Divides individuals, e. g. by cell division.
+
+        Each daughter is a copy of its parent and takes `fraction` of
+        its extensive parameters (see `extensive_parameters`), the
+        parent keeps the rest. Daughters are spawned as in `spawn`.
+
+        Parameters
+        ----------
+        ids : int, array like
+            Ids of the dividing individuals.
+        fraction : float, optional
+            Fraction of extensive parameters taken by daughters.
+        values : keyword arguments, optional
+            Values of state parameters or per individual attributes of
+            the daughters, e. g. their birthday.
+
+        Returns
+        -------
+        ids : array like
+            Ids of the daughters.
+
+        """
+        ids = atleast_1d(asarray(ids, dtype=intp))
+        children = self._allocate(len(ids))
+        self._copy_individuals(ids, children)
+        self.id[children] = children
+        for key in self.extensive_parameters:
+            value = self._get_attribute(key)
+            value[..., children] = value[..., ids] * fraction
+            value[..., ids] *= 1 - fraction
+        self._set_values(children, values)
+        return children
+
+    def _allocate(self, count):
+        """
+        Returns ids of `count` new live individuals, reusing free ones
+        before storage grows.
+
+        """
+        alive = self._array('alive', True)
+        # Ids default to slots, built only if not set yet.
+        self._array('id', arange(self.size()) if
+                    self._attributes.get('id') is None else None)
+        free = self._attributes.get('_free')
+        if free is None:
+            # Free list as a stack with lowest ids on top.
+            free = self._attributes['_free'] = \
+                flatnonzero(~alive)[::-1].tolist()
+        ids = []
+        while free and (len(ids) < count):
+            i = free.pop()
+            if not alive[i]:
+                alive[i] = True
+                ids.append(i)
+        k = int(count) - len(ids)
+        if k > 0:
+            n = self.size()
+            self.resize(n + k)
+            ids.extend(range(n, n + k))
+            self.alive[n:] = True
+        ids = asarray(ids, dtype=intp)
+        self.id[ids] = ids
+        self._attributes.pop('_active', None)
+        return ids
+
+    def _set_values(self, ids, values):
+        """Sets state parameters or attributes of given individuals."""
+        for key, value in values.items():
+            item = self._get_attribute(key)
+            if (key not in self.state_parameters) and \
+                    (key not in self._individual_arrays()):
+                raise ValueError('Invalid per individual attribute '
+                                 '{0}.'.format(key))
+            item[..., ids] = value
+
+    def _array(self, key, value):
+        """
+        Returns per individual attribute array, created from `value` if
+        not set or not an array.
+
+        """
+        n = self.size()
+        item = self._attributes.get(key)
+        if isinstance(item, ndarray) and (item.shape == (n, )):
+            return item
+        if item is None:
+            item = value
+        item = self._attributes[key] = array(broadcast_to(item, (n, )))
+        self._attributes.pop('_active', None)
+        return item
+
+    def _individual_arrays(self):
+        """Returns keys of attribute arrays with one item per individual."""
+        n = self.size()
+        return [key for key, value in self._attributes.items() if
+                (not key.startswith('_')) and isinstance(value, ndarray) and
+                (value.shape[-1:] == (n, ))]
+
+    def _copy_individuals(self, source, destination):
+        """Copies every attribute of individuals into other slots."""
+        if self._population is not None:
+            block = self._population._block
+            block[:, :, destination] = block[:, :, source]
+        for key in self._individual_arrays():
+            value = self._attributes[key]
+            value[..., destination] = value[..., source]
+        for key in ['_active']:
+            self._attributes.pop(key, None)
+
+    def active(self, mask=False):
+        """
+        Returns indices of live individuals inside the domain.
+
+        The active set is cached and updated whenever `in_domain` or
+        `alive` are set, or individuals die (see `kill`). Arrays changed
+        in place must be set again for the change to take effect.
+        Indices are only found again once asked for.
+
+        Parameters
+        ----------
+        mask : bool, optional
+            If True, returns boolean mask instead of indices.
+
+        """
+        active = self._attributes.get('_active')
+        if active is None:
+            m = ones(self.size(), dtype=bool_)
+            if self.in_domain is not None:
+                m &= self.in_domain
+            if self.alive is not None:
+                m &= self.alive
+            active = self._attributes['_active'] = [m, None]
+        if mask:
+            return active[0]
+        if active[1] is None:
+            active[1] = flatnonzero(active[0])
+        return active[1]
 
     def size(self):
         """Returns the size of the community."""
+        if self._population is not None:
+            return len(self._population)
         return len(self.t)
 
     # Default properties (attributes) for each individual.
@@ -214,7 +800,11 @@ class Individual(BaseClass):
 
     @property
     def domain(self):
-        """Domain."""
+        """
+        Domain boundaries given as (x_min, x_max, y_min, y_max, z_min,
+        z_max). Boundaries set to None are open.
+
+        """
         return self._get_attribute('domain')
 
     @domain.setter
@@ -235,7 +825,7 @@ class Individual(BaseClass):
         """Meridional velocity."""
         return self._get_attribute('v')
 
-    @u.setter
+    @v.setter
     def v(self, a):
         self._set_attribute('v', a)
 
@@ -256,6 +846,18 @@ class Individual(BaseClass):
     @in_domain.setter
     def in_domain(self, a):
         self._set_attribute('in_domain', a)
+        self._attributes.pop('_active', None)
+
+    @property
+    def alive(self):
+        """Boolean to check if individual is alive."""
+        return self._get_attribute('alive')
+
+    @alive.setter
+    def alive(self, a):
+        self._set_attribute('alive', a)
+        for key in ['_active', '_free']:
+            self._attributes.pop(key, None)
 
     @property
     def id(self):
@@ -287,27 +889,90 @@ class Plankton(Individual):
     Research Institute -- FERI, FERI-2004-0002-U-D, 2004.
 
     """
+    # Prognostic parameters and environmental variables needed to
+    # calculate their tendencies.
+    prognostic_parameters = ['P', 'N_P']
+    extensive_parameters = ['P', 'N_P']
+    environment_variables = ['T', 'E_0', 'NO3', 'NH4']
+    # Fraction of active individuals below which growth kernels are
+    # evaluated on compacted arrays.
+    compaction = 0.75
+    # Temperature range (in degrees Celsius) of tabulated maximum growth
+    # rates, temperatures outside are evaluated exactly.
+    temperature_range = (-5., 40.)
+
     def __init__(self, log_parameters=[], **kwargs):
         # Runs Individual.__init__ for default object initialization.
         super(Plankton, self).__init__(**kwargs)
         # Some parameters and initializations
-        self.state_parameters = ['t', 'x', 'y', 'z', 'P', 'N_P']
+        self.set_state_parameters(['t', 'x', 'y', 'z', 'P', 'N_P'])
         # ... history list
-        self._attributes['history'] = dict()
+        self._attributes['history'] = History()
         # ... log list
         n = self.size()
         extra = {key: [nan] * n for key in log_parameters}
         # Start history log
         self.append_history(extra=extra)
-        # Assumes every individual is inside the model domain
-        self.in_domain = bool_(self.x) | bool_(self.y)
+        # Assumes every individual is inside the model domain, which
+        # advection updates (see `gaia.advection.inside`).
+        self.in_domain = ones(n, dtype=bool_)
 
     ###########################################################################
     # Some functions
     ###########################################################################
+    def subset(self, start, stop):
+        """
+        Returns individuals from `start` to `stop` as a new object
+        sharing storage with this one (see `Individual.subset`).
+        Response tables do not depend on individuals, hence they are
+        built once and shared with the subset.
+
+        """
+        tables = self.response_tables()
+        other = super(Plankton, self).subset(start, stop)
+        if tables is not None:
+            other._attributes['_tables'] = tables
+        return other
+
+    def response_tables(self):
+        """
+        Returns lookup tables of the temperature and light response
+        functions for the current parameters, or None if `lookup` is
+        not set.
+
+        Tables are built once and kept until one of the parameters they
+        depend on changes. Responses to parameters which vary among
+        individuals or ensemble members are not tabulated.
+
+        Returns
+        -------
+        tables : dictionary
+            Tables of the maximum growth rate as a function of
+            temperature ('mu_mt'), of the Jassby & Platt (1976) light
+            response ('tanh') and of photoinhibition as a function of
+            irradiance ('photoinhibition').
+
+        """
+        tolerance = self.lookup
+        if tolerance is None:
+            return None
+        tables = self._attributes.get('_tables')
+        if tables is not None:
+            return tables
+        tables = self._attributes['_tables'] = dict()
+        tables['tanh'] = tanh_table(tolerance)
+        mu_m, d_r, E_0_inb = self.mu_m, self.d_r, self.E_0_inb
+        if ndim(mu_m) == 0:
+            lower, upper = self.temperature_range
+            tables['mu_mt'] = exp_table(mu_m, 0.0633, 27., lower, upper,
+                                        tolerance)
+        if (ndim(d_r) == 0) and (ndim(E_0_inb) == 0):
+            tables['photoinhibition'] = decay_table(d_r, E_0_inb, tolerance)
+        return tables
+
     def alpha(self):
         """Calculates the photosynthetic efficiency of the individual."""
-        return 0.1 * ones(self.size())
+        return 0.1 * ones(self.size(), dtype=self.dtype)
 
     def mu(self, mu_mt, E_0, alpha, mask=True):
         """
@@ -335,21 +1000,245 @@ class Plankton(Individual):
         mu_ll = self.mu_ll(mu_mt, E_0, alpha)
         mu_nl = self.mu_nl(mu_mt)
         #
-        mu = mu_ll * (mu_ll < mu_nl) + mu_nl * (mu_ll >= mu_nl)
+        mu = minimum(mu_ll, mu_nl)
         #
         return mu * mask, mu_ll * mask, mu_nl * mask
 
+    def growth(self, T, E_0, alpha, NO3, NH4, mask=True, out=None):
+        """
+        Calculates growth rates and nutrient transport fluxes at once.
+
+        Single pass equivalent of `mu`, `rho_NO3` and `rho_NH4` which
+        evaluates shared terms (maximum growth rate, N:C ratio and
+        clipped irradiances) only once and writes every result in
+        place, using the outputs themselves as scratch space.
+
+        Parameters
+        ----------
+        T : float, array like
+            Water temperature (in degrees Celsius).
+        E_0 : float, array like
+            Scalar irradiance.
+        alpha : float, array like
+            Photosynthetic efficiency.
+        NO3, NH4 : float, array like
+            Nitrate and ammonium concentrations.
+        mask : boolean, array like
+            Data mask, either boolean or the sorted indices of active
+            individuals, e. g. as cached by `active`. Results are zero
+            for inactive individuals.
+            When the fraction of active individuals is less than
+            `compaction`, rates are only evaluated for active ones.
+        out : sequence of arrays, optional
+            Five arrays, or a (5, n) array, into which results are
+            written. Allocated if not given; pass the returned value
+            back in to reuse it across time steps.
+
+        Returns
+        -------
+        mu, mu_ll, mu_nl, rho_NO3, rho_NH4 : array like
+            Effective, light-limited and nutrient-limited growth rates,
+            nitrate and ammonium transport fluxes.
+
+        """
+        n = self.size()
+        shape = self._population.shape
+        if out is None:
+            out = empty((5, ) + shape, dtype=self.dtype)
+        P, N_P = self.P, self.N_P
+        if mask is True:
+            self._growth(out, P, N_P, T, E_0, alpha, NO3, NH4,
+                         self._growth_parameters())
+            return out
+        # Finds active individuals and, if only a few of them are left,
+        # evaluates the kernel on compacted arrays.
+        mask = asarray(mask)
+        index = flatnonzero(mask) if mask.dtype == bool_ else mask
+        if len(index) >= self.compaction * n:
+            self._growth(out, P, N_P, T, E_0, alpha, NO3, NH4,
+                         self._growth_parameters())
+            for item in out:
+                self._keep(item, mask if mask.dtype == bool_ else index)
+            return out
+        m = len(index)
+        work = self._attributes.get('_compact')
+        if (work is None) or (work.shape[:-1] != (5, ) + shape[:-1]) or \
+                (work.shape[-1] < m):
+            work = self._attributes['_compact'] = empty(
+                (5, ) + shape[:-1] + (m, ), dtype=self.dtype)
+        work = work[..., :m]
+        args = [_take(item, index, n) for item in (P, N_P, T, E_0, alpha,
+                                                   NO3, NH4)]
+        self._growth(work, *args, p=self._growth_parameters(index))
+        for item, value in zip(out, work):
+            item[...] = 0
+            item[..., index] = value
+        return out
+
+    def _keep(self, value, mask):
+        """
+        Sets entries of `value` of inactive individuals to zero, given a
+        boolean mask or the indices of active ones. The cached active
+        set (see `active`) is applied as a multiplication by its mask,
+        other indices by taking and putting back the active entries.
+
+        """
+        if mask.dtype == bool_:
+            multiply(value, mask, out=value)
+            return
+        if len(mask) == self.size():
+            return
+        active = self._attributes.get('_active')
+        if (active is not None) and (active[1] is mask):
+            multiply(value, active[0], out=value)
+            return
+        kept = value[..., mask]
+        value[...] = 0
+        value[..., mask] = kept
+
+    def _growth_parameters(self, index=None):
+        """
+        Returns parameters of growth kernel, optionally compacted.
+        Parameter arrays are cast to the population data type.
+
+        """
+        n = self.size()
+        dtype = self.dtype
+        p = dict()
+        for key in ['mu_m', 'K_s_NH4', 'K_s_NO3', 'Psi', 'K_Q_N', 'Q_m_N',
+                    'E_0_cp', 'E_0_inb', 'd_r']:
+            value = _take(self._get_attribute(key), index, n)
+            if isinstance(value, ndarray):
+                value = value.astype(dtype, copy=False)
+            p[key] = value
+        p['tables'] = self.response_tables() or dict()
+        return p
+
+    def _growth(self, out, P, N_P, T, E_0, alpha, NO3, NH4, p):
+        """Fused growth kernel, see `growth`."""
+        mu, mu_ll, mu_nl, rho_NO3, rho_NH4 = out
+        tables = p['tables']
+        # 1. Maximum carbon specific growth rate, temporarily in `mu`.
+        mu_mt = mu
+        if 'mu_mt' in tables:
+            tables['mu_mt'](T, out=mu_mt)
+        else:
+            subtract(T, 27., out=mu_mt)
+            multiply(mu_mt, 0.0633, out=mu_mt)
+            exp(mu_mt, out=mu_mt)
+            multiply(mu_mt, p['mu_m'], out=mu_mt)
+        # 2. Ammonium transport flux.
+        add(NH4, p['K_s_NH4'], out=rho_NH4)
+        divide(NH4, rho_NH4, out=rho_NH4)
+        multiply(rho_NH4, N_P, out=rho_NH4)
+        multiply(rho_NH4, mu_mt, out=rho_NH4)
+        # 3. Nitrate transport flux, using `mu_ll` as scratch.
+        multiply(NH4, -p['Psi'], out=rho_NO3)
+        exp(rho_NO3, out=rho_NO3)
+        multiply(rho_NO3, N_P, out=rho_NO3)
+        multiply(rho_NO3, mu_mt, out=rho_NO3)
+        add(NO3, p['K_s_NO3'], out=mu_ll)
+        divide(NO3, mu_ll, out=mu_ll)
+        multiply(rho_NO3, mu_ll, out=rho_NO3)
+        # 4. Nutrient-limited growth rate.
+        divide(N_P, P, out=mu_nl)
+        divide(p['K_Q_N'], mu_nl, out=mu_nl)
+        subtract(1., mu_nl, out=mu_nl)
+        maximum(mu_nl, 0., out=mu_nl)
+        multiply(mu_nl, mu_mt, out=mu_nl)
+        divide(mu_nl, 1. - p['K_Q_N'] / p['Q_m_N'], out=mu_nl)
+        # 5. Light-limited growth rate according to Jassby & Platt (1976)
+        #    with photoinhibition; the last use of `mu_mt` allows its
+        #    storage to be taken as scratch.
+        subtract(E_0, p['E_0_cp'], out=mu_ll)
+        maximum(mu_ll, 0., out=mu_ll)
+        multiply(mu_ll, alpha, out=mu_ll)
+        divide(mu_ll, mu_mt, out=mu_ll)
+        if 'tanh' in tables:
+            tables['tanh'](mu_ll, out=mu_ll)
+        else:
+            tanh(mu_ll, out=mu_ll)
+        multiply(mu_ll, mu_mt, out=mu_ll)
+        if 'photoinhibition' in tables:
+            tables['photoinhibition'](E_0, out=mu)
+        else:
+            subtract(E_0, p['E_0_inb'], out=mu)
+            maximum(mu, 0., out=mu)
+            multiply(mu, -p['d_r'], out=mu)
+            exp(mu, out=mu)
+        multiply(mu_ll, mu, out=mu_ll)
+        # 6. Effective growth rate.
+        minimum(mu_ll, mu_nl, out=mu)
+
+    def tendency(self, t, environments, out, rates=None):
+        """
+        Calculates time derivatives of biomass and particulate nitrogen.
+
+        Biomass grows at the effective growth rate and is lost through
+        respiration, while particulate nitrogen increases by nitrate and
+        ammonium uptake, i. e.
+
+            dP/dt = (mu - r) * P,
+            dN_P/dt = rho_NO3 + rho_NH4.
+
+        Both uptake fluxes are proportional to N_P, hence the linear
+        rates (see `Individual.tendency`) are mu - r and
+        (rho_NO3 + rho_NH4) / N_P.
+
+        Environmental variables are given by `environment_variables`.
+        Only active individuals (see `Individual.active`) change.
+
+        """
+        T, E_0, NO3, NH4 = self.environments(environments,
+                                             self.environment_variables, t)
+        shape = (5, ) + self._population.shape
+        work = self._attributes.get('_workspace')
+        if (work is None) or (work.shape != shape):
+            work = self._attributes['_workspace'] = empty(shape,
+                                                          dtype=self.dtype)
+        if self.executor is None:
+            growth = self.growth
+        else:
+            growth = partial(self.executor.growth, self)
+        # Indices of active individuals are cached, see `active`.
+        index = self.active()
+        with profiler.timer('growth'):
+            mu, _, _, rho_NO3, rho_NH4 = growth(T, E_0, self.alpha(), NO3,
+                                                NH4, mask=index, out=work)
+        dP, dN_P = out
+        subtract(mu, self.r, out=dP)
+        self._keep(dP, index)
+        if rates is not None:
+            rates[0] = dP
+        multiply(dP, self.P, out=dP)
+        add(rho_NO3, rho_NH4, out=dN_P)
+        if rates is not None:
+            N_P = self.N_P
+            rates[1] = 0
+            divide(dN_P, N_P, out=rates[1], where=(N_P != 0))
+        return out
+
     def mu_mt(self, T):
         """Calculates maximum carbon specific growth rate"""
+        tables = self.response_tables() or dict()
+        if 'mu_mt' in tables:
+            return tables['mu_mt'](T)
         return self.mu_m * exp(0.0633 * (T - 27.))
 
     def mu_ll(self, mu_mt, E_0, alpha):
         """Calculates light-limited growth rate."""
+        tables = self.response_tables() or dict()
         # 1. Calculates the light-limited growthrate according to Jassby &
         #    Platt (1976). Considers only E_0 > E_0_cp.
-        _JP76 = tanh(alpha * only_positive(E_0 - self.E_0_cp) / mu_mt)
+        _JP76 = tables.get('tanh', tanh)(alpha *
+                                         only_positive(E_0 - self.E_0_cp) /
+                                         mu_mt)
         # 2. Make sure that photoinhibition only occurs when E_0 > E_0_inb
-        _photoinhibition = exp(-self.d_r * only_positive(E_0 - self.E_0_inb))
+        if 'photoinhibition' in tables:
+            _photoinhibition = tables['photoinhibition'](E_0)
+        else:
+            _photoinhibition = exp(-self.d_r *
+                                   only_positive(E_0 - self.E_0_inb))
         # 3. The light limited growth-rate.
         mu_ll = mu_mt * _JP76 * _photoinhibition
         return mu_ll
@@ -381,6 +1270,34 @@ class Plankton(Individual):
     ###########################################################################
     # Plankton properties (attributes)
     ###########################################################################
+    @property
+    def executor(self):
+        """
+        Executor of growth kernels, e. g. `gaia.parallel.ThreadExecutor`.
+        If not set, kernels are evaluated at once in the current thread.
+
+        """
+        return self._get_attribute('executor')
+
+    @executor.setter
+    def executor(self, a):
+        self._set_attribute('executor', a)
+
+    @property
+    def lookup(self):
+        """
+        Absolute tolerance of tabulated temperature and light response
+        functions, see `response_tables`. If not set, responses are
+        evaluated exactly.
+
+        """
+        return self._get_attribute('lookup')
+
+    @lookup.setter
+    def lookup(self, a):
+        self._set_attribute('lookup', a)
+        self._attributes.pop('_tables', None)
+
     @property
     def P(self):
         """Plankton biomass."""
@@ -425,6 +1342,7 @@ class Plankton(Individual):
     @mu_m.setter
     def mu_m(self, a):
         self._set_attribute('mu_m', a)
+        self._attributes.pop('_tables', None)
 
     @property
     def E_0_cp(self):
@@ -443,6 +1361,7 @@ class Plankton(Individual):
     @E_0_inb.setter
     def E_0_inb(self, a):
         self._set_attribute('E_0_inb', a)
+        self._attributes.pop('_tables', None)
 
     @property
     def d_r(self):
@@ -456,6 +1375,7 @@ class Plankton(Individual):
     @d_r.setter
     def d_r(self, a):
         self._set_attribute('d_r', a)
+        self._attributes.pop('_tables', None)
 
     @property
     def phi_m(self):
@@ -24,13 +24,665 @@ from __future__ import division
 __version__ = '$Revision: 1 $'
 # $Source$
 
-from gaia.base import BaseClass
+import json
+from collections import OrderedDict, deque
+from os import getpid
+from threading import Event, Lock, Thread
+
+from numpy import (absolute, add, array, array_equal, asarray, atleast_1d,
+                   broadcast, broadcast_to, ceil, clip, concatenate, copyto,
+                   diff, divide, dtype as _dtype, empty, expm1, fmax, intp,
+                   isnan, load, maximum, memmap, minimum, multiply,
+                   searchsorted, unique, zeros)
+
+from gaia.base import BaseClass, profiler
+from gaia.parallel import ProcessRunner
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def write_raw(path, data, **kwargs):
+    """
+    Writes gridded data as raw binary file with JSON header.
+
+    Data is written to `path` in C order and the header, which holds
+    data type, shape and any given keyword argument (e. g. coordinates,
+    name or units), to `path` + '.json'. The result can be opened with
+    `MemmapEnvironment`.
+
+    Parameters
+    ----------
+    path : string
+        File name.
+    data : array like
+        Data indexed as [t, z, y, x].
+
+    """
+    data = asarray(data)
+    header = dict(dtype=data.dtype.str, shape=list(data.shape))
+    for key, value in kwargs.items():
+        if key in ['t', 'z', 'y', 'x']:
+            value = asarray(value).tolist()
+        header[key] = value
+    data.tofile(path)
+    with open(path + '.json', 'w') as f:
+        json.dump(header, f)
+
+
+def _same_axes(a, b):
+    """Tells if two lists of variables and their axes are identical."""
+    if len(a) != len(b):
+        return False
+    for (key_a, axes_a), (key_b, axes_b) in zip(a, b):
+        if (key_a != key_b) or \
+                not all(u is v for u, v in zip(axes_a, axes_b)):
+            return False
+    return True
+
 
 ###############################################################################
 # CLASSES
 ###############################################################################
+class Integrator(object):
+    """
+    Base class for explicit time integration schemes.
+
+    Integrators advance the prognostic parameters of populations (see
+    `gaia.individuals.Individual.tendency`). Stage buffers are
+    preallocated once per population and reused at every step. They
+    are indexed by the identity of the population, unless callers
+    which keep several populations alive, e. g. worker processes, give
+    a `key` to `step`.
+
+    """
+    # Number of stage buffers needed by the scheme.
+    stages = 1
+
+    def __init__(self):
+        self._buffers = dict()
+
+    def buffers(self, individual, key=None):
+        """
+        Returns stage buffers for given population, or for a block of
+        it identified by `key`.
+
+        """
+        shape = (self.stages + 2, len(individual.prognostic_parameters)) + \
+            individual.population.shape
+        if key is None:
+            key = id(individual)
+        try:
+            B = self._buffers[key]
+            if B.shape == shape:
+                return B
+        except KeyError:
+            pass
+        B = self._buffers[key] = empty(shape,
+                                       dtype=individual.population.dtype)
+        return B
+
+    def step(self, individual, t, dt, environments, key=None):
+        """
+        Advances `individual` from time `t` to `t + dt`, using the stage
+        buffers of `key`, if given.
+
+        """
+        raise NotImplementedError
+
+    def _stage(self, individual, t, environments, y0, h, k, tmp):
+        """Sets state to `y0 + h * k` and evaluates tendency into `tmp`."""
+        keys = individual.prognostic_parameters
+        multiply(k, h, out=tmp)
+        add(y0, tmp, out=tmp)
+        individual.population.scatter(keys, tmp)
+        individual.tendency(t, environments, tmp)
+
+
+class Euler(Integrator):
+    """Forward Euler scheme."""
+    stages = 1
+
+    def step(self, individual, t, dt, environments, key=None):
+        keys = individual.prognostic_parameters
+        y0, k1, _ = self.buffers(individual, key)
+        individual.population.gather(keys, out=y0)
+        individual.tendency(t, environments, k1)
+        multiply(k1, dt, out=k1)
+        add(y0, k1, out=y0)
+        individual.population.scatter(keys, y0)
+
+
+class RK2(Integrator):
+    """Second order Runge-Kutta (midpoint) scheme."""
+    stages = 2
+
+    def step(self, individual, t, dt, environments, key=None):
+        keys = individual.prognostic_parameters
+        y0, k1, k2, _ = self.buffers(individual, key)
+        individual.population.gather(keys, out=y0)
+        individual.tendency(t, environments, k1)
+        self._stage(individual, t + dt / 2, environments, y0, dt / 2, k1,
+                    k2)
+        multiply(k2, dt, out=k2)
+        add(y0, k2, out=y0)
+        individual.population.scatter(keys, y0)
+
+
+class RK4(Integrator):
+    """Classical fourth order Runge-Kutta scheme."""
+    stages = 4
+
+    def step(self, individual, t, dt, environments, key=None):
+        keys = individual.prognostic_parameters
+        y0, k1, k2, k3, k4, tmp = self.buffers(individual, key)
+        individual.population.gather(keys, out=y0)
+        individual.tendency(t, environments, k1)
+        self._stage(individual, t + dt / 2, environments, y0, dt / 2, k1,
+                    k2)
+        self._stage(individual, t + dt / 2, environments, y0, dt / 2, k2,
+                    k3)
+        self._stage(individual, t + dt, environments, y0, dt, k3, k4)
+        # y = y0 + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        add(k2, k3, out=tmp)
+        multiply(tmp, 2, out=tmp)
+        add(tmp, k1, out=tmp)
+        add(tmp, k4, out=tmp)
+        multiply(tmp, dt / 6, out=tmp)
+        add(y0, tmp, out=y0)
+        individual.population.scatter(keys, y0)
+
+
+class RK23(Integrator):
+    """
+    Adaptive Bogacki-Shampine 3(2) scheme.
+
+    Each model time step is covered by as many sub-steps as needed to
+    keep the embedded error estimate of every prognostic parameter
+    below `atol + rtol * |y|`. Populations are split into blocks of
+    individuals (see `gaia.individuals.Individual.subsets`) which choose
+    their step sizes independently, so that a few stiff individuals do
+    not slow down the whole population. The last accepted step size of
+    each block is kept as first guess for the next model step.
+
+    Parameters
+    ----------
+    rtol, atol : float, optional
+        Relative and absolute error tolerances.
+    block : int, optional
+        Number of individuals sharing the same step size.
+
+    """
+    # Four stages, the update, its error estimate and a scratch buffer.
+    stages = 6
+
+    def __init__(self, rtol=1e-6, atol=1e-9, block=4096):
+        super(RK23, self).__init__()
+        self.rtol = rtol
+        self.atol = atol
+        self.block = int(block)
+        self._steps = dict()
+        # Counters
+        self.accepted = 0
+        self.rejected = 0
+
+    def step(self, individual, t, dt, environments, key=None):
+        n = individual.size()
+        if key is None:
+            key = id(individual)
+        if n <= self.block:
+            self._advance(individual, t, dt, environments, (key, 0))
+            return
+        bounds = [(start, min(start + self.block, n))
+                  for start in range(0, n, self.block)]
+        for (start, stop), block in zip(bounds, individual.subsets(bounds)):
+            self._advance(block, t, dt, environments, (key, start))
+
+    def _advance(self, individual, t, dt, environments, key):
+        """Advances block of individuals from `t` to `t + dt`."""
+        keys = individual.prognostic_parameters
+        y0, k1, k2, k3, k4, y1, err, tmp = self.buffers(individual,
+                                                        key=key)
+        individual.population.gather(keys, out=y0)
+        t_end = t + dt
+        h = min(self._steps.get(key, dt), dt)
+        individual.tendency(t, environments, k1)
+        while t < t_end - 1e-12 * dt:
+            h = min(h, t_end - t)
+            self._stage(individual, t + h / 2, environments, y0, h / 2,
+                        k1, k2)
+            self._stage(individual, t + 3 * h / 4, environments, y0,
+                        3 * h / 4, k2, k3)
+            # y1 = y0 + h * (2 / 9 * k1 + 1 / 3 * k2 + 4 / 9 * k3)
+            multiply(k1, 2 / 9, out=y1)
+            multiply(k2, 1 / 3, out=tmp)
+            add(y1, tmp, out=y1)
+            multiply(k3, 4 / 9, out=tmp)
+            add(y1, tmp, out=y1)
+            multiply(y1, h, out=y1)
+            add(y1, y0, out=y1)
+            individual.population.scatter(keys, y1)
+            individual.tendency(t + h, environments, k4)
+            # Difference to the embedded second order solution.
+            multiply(k1, -5 / 72, out=err)
+            multiply(k2, 1 / 12, out=tmp)
+            add(err, tmp, out=err)
+            multiply(k3, 1 / 9, out=tmp)
+            add(err, tmp, out=err)
+            multiply(k4, -1 / 8, out=tmp)
+            add(err, tmp, out=err)
+            multiply(err, h, out=err)
+            # Stages k2 and k3 are evaluated again in the next step.
+            norm = self._norm(err, y0, y1, tmp, k2)
+            if norm <= 1:
+                t += h
+                y0[...] = y1
+                # First same as last: derivative at the end of the step
+                # is the first stage of the next one.
+                k1[...] = k4
+                self.accepted += 1
+                profiler.count('steps.accepted')
+            else:
+                self.rejected += 1
+                profiler.count('steps.rejected')
+            factor = 5. if norm == 0 else 0.9 * norm ** (-1 / 3)
+            h_new = h * min(5., max(0.2, factor))
+            if h_new < 1e-12 * dt:
+                raise RuntimeError('Step size underflow at time '
+                                   '{0}.'.format(t))
+            h = h_new
+        individual.population.scatter(keys, y0)
+        self._steps[key] = h
+
+    def _norm(self, err, y0, y1, scale, ratio):
+        """
+        Returns largest error relative to tolerance, ignoring NaNs.
+        `scale` and `ratio` are scratch buffers.
+
+        """
+        absolute(y0, out=scale)
+        absolute(y1, out=ratio)
+        maximum(scale, ratio, out=scale)
+        multiply(scale, self.rtol, out=scale)
+        add(scale, self.atol, out=scale)
+        absolute(err, out=ratio)
+        divide(ratio, scale, out=ratio)
+        norm = fmax.reduce(ratio, axis=None)
+        return 0. if isnan(norm) else norm
+
+
+class ExponentialEuler(Integrator):
+    """
+    Exponential Euler scheme for stiff linear terms.
+
+    Tendencies are written as f(y) = L * y + N(y), where L is the
+    diagonal of linear rates given by `tendency` (see its `rates`
+    argument), and advanced as
+
+        y = y0 + dt * phi(L * dt) * f(y0),  phi(z) = (exp(z) - 1) / z,
+
+    which integrates linear growth and decay exactly and stays stable
+    for stiff negative rates at any time step. Individuals without
+    linear rates are advanced by forward Euler.
+
+    """
+    stages = 2
+
+    def step(self, individual, t, dt, environments, key=None):
+        keys = individual.prognostic_parameters
+        y0, k1, L, phi = self.buffers(individual, key)
+        individual.population.gather(keys, out=y0)
+        individual.tendency(t, environments, k1, rates=L)
+        multiply(L, dt, out=L)
+        expm1(L, out=phi)
+        divide(phi, L, out=phi, where=(L != 0))
+        copyto(phi, 1., where=(L == 0))
+        multiply(k1, phi, out=k1)
+        multiply(k1, dt, out=k1)
+        add(y0, k1, out=y0)
+        individual.population.scatter(keys, y0)
+
+
+# Available time integration schemes.
+SCHEMES = dict(euler=Euler, rk2=RK2, rk4=RK4, rk23=RK23,
+               exponential=ExponentialEuler)
+
+
+class Axis(object):
+    """
+    Coordinate axis supporting vectorized cell lookup.
+
+    Lookup tables are computed once per coordinate array. Evenly spaced
+    coordinates are located arithmetically, otherwise by binary search.
+    Descending coordinates are supported.
+
+    """
+    def __init__(self, coord):
+        # Keeps original coordinate object to detect changes.
+        self.source = coord
+        coord = atleast_1d(asarray(coord, dtype=float))
+        self.coord = coord
+        self.size = coord.size
+        # Descending coordinates are handled as ascending ones with
+        # flipped sign.
+        self.sign = -1. if (coord.size > 1) and (coord[-1] < coord[0]) else 1.
+        c = self.sign * coord
+        self._c = c
+        if self.size > 1:
+            dc = diff(c)
+            self.uniform = bool(abs(dc - dc[0]).max() <= 1e-9 * abs(dc[0]))
+            self.start, self.step = c[0], dc[0]
+            self._dc = dc
+        else:
+            self.uniform = True
+            self.start, self.step = c[0], 1.
+
+    def locate(self, values):
+        """
+        Locates values on axis.
+
+        Values outside the axis range are clamped to its edges. NaN
+        values, e. g. positions of dead individuals, are located in a
+        valid cell with NaN weights, hence they read NaN.
+
+        Parameters
+        ----------
+        values : float, array like
+            Coordinate values.
+
+        Returns
+        -------
+        i0, i1 : array like
+            Indices of lower and upper cell edges.
+        w : array like
+            Weight of upper cell edge.
+
+        """
+        values = atleast_1d(values)
+        if self.size == 1:
+            i0 = empty(values.shape, dtype=intp)
+            i0[...] = 0
+            return i0, i0, 0. * values
+        v = values * self.sign
+        if self.uniform:
+            f = (v - self.start) / self.step
+            clip(f, 0, self.size - 1, out=f)
+            # Clipped values are not negative, hence truncation floors
+            # them, and fmax maps NaN to the first cell.
+            i0 = minimum(fmax(f, 0).astype(intp), self.size - 2)
+            w = f - i0
+        else:
+            i0 = searchsorted(self._c, v, side='right') - 1
+            clip(i0, 0, self.size - 2, out=i0)
+            w = (v - self._c[i0]) / self._dc[i0]
+            clip(w, 0, 1, out=w)
+        return i0, i0 + 1, w
+
+
+class SlabCache(object):
+    """
+    Bounded least recently used cache of time slabs.
+
+    Slabs are loaded on demand by `loader` and the least recently used
+    ones are evicted once `size` slabs are kept in memory. Slabs can be
+    requested in advance, in which case they are loaded by a background
+    thread while computation goes on.
+
+    Parameters
+    ----------
+    loader : callable
+        Function that takes a time index and returns the decoded slab.
+    size : int, optional
+        Maximum number of slabs kept in memory.
+
+    """
+    def __init__(self, loader, size=4):
+        self.loader = loader
+        self.size = max(int(size), 1)
+        self._slabs = OrderedDict()
+        self._reset()
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self.prefetches = 0
+
+    def __contains__(self, i):
+        return i in self._slabs
+
+    def __len__(self):
+        return len(self._slabs)
+
+    def get(self, i):
+        """Returns slab at time index `i`."""
+        if self._pid != getpid():
+            self._reset()
+        with self._lock:
+            slab = self._slabs.pop(i, None)
+            if slab is not None:
+                self._slabs[i] = slab
+                self.hits += 1
+                profiler.count('cache.hits')
+                return slab
+            pending = self._pending.get(i)
+        if pending is not None:
+            # Slab is being prefetched, waits for the background thread.
+            pending.wait()
+            with self._lock:
+                slab = self._slabs.get(i)
+                if slab is not None:
+                    self.waits += 1
+                    profiler.count('cache.waits')
+                    return slab
+        slab = self.loader(i)
+        with self._lock:
+            self.misses += 1
+            profiler.count('cache.misses')
+            self._insert(i, slab)
+        return slab
+
+    def prefetch(self, i):
+        """
+        Loads slab at time index `i` in the background. Slabs already
+        in the cache are marked as recently used.
+
+        """
+        if self._pid != getpid():
+            self._reset()
+        with self._lock:
+            if i in self._slabs:
+                self._slabs[i] = self._slabs.pop(i)
+                return
+            if i in self._pending:
+                return
+            event = self._pending[i] = Event()
+            self._requests.append((i, self._generation, event))
+            self.prefetches += 1
+            profiler.count('cache.prefetches')
+            if self._thread is None:
+                # The worker thread stops once there are no requests.
+                self._thread = Thread(target=self._worker)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def clear(self):
+        """
+        Removes every slab from the cache. Slabs being prefetched are
+        discarded once loaded.
+
+        """
+        with self._lock:
+            self._slabs.clear()
+            self._pending.clear()
+            self._requests.clear()
+            self._generation += 1
+
+    def stats(self):
+        """Returns dictionary of cache counters."""
+        return dict(hits=self.hits, misses=self.misses, waits=self.waits,
+                    evictions=self.evictions, prefetches=self.prefetches,
+                    size=len(self._slabs))
+
+    def _reset(self):
+        """Resets synchronization state, e. g. in forked processes."""
+        self._pid = getpid()
+        self._pending = dict()
+        self._requests = deque()
+        self._lock = Lock()
+        self._thread = None
+        # Incremented whenever the cache is cleared.
+        self._generation = 0
+
+    def _insert(self, i, slab):
+        self._slabs.pop(i, None)
+        self._slabs[i] = slab
+        while len(self._slabs) > self.size:
+            self._slabs.popitem(last=False)
+            self.evictions += 1
+            profiler.count('cache.evictions')
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if len(self._requests) == 0:
+                    self._thread = None
+                    return
+                i, generation, event = self._requests.popleft()
+            try:
+                slab = self.loader(i)
+            except Exception:
+                # Errors are raised when the slab is actually requested.
+                slab = None
+            with self._lock:
+                # Slabs requested before the cache was cleared are stale.
+                if (slab is not None) and \
+                        (generation == self._generation):
+                    self._insert(i, slab)
+                if self._pending.get(i) is event:
+                    del self._pending[i]
+            event.set()
+
+
 class Model(BaseClass):
     """Model class."""
+    def run(self, until, populations, environments=None, scheme=None,
+            output=None, nmax=None, advection=None, processes=None,
+            resampler=None):
+        """
+        Runs model until given time.
+
+        Parameters
+        ----------
+        until : float
+            Final model time.
+        populations : Individual, list
+            Populations to advance in time.
+        environments : dictionary, optional
+            Environmental pools, indexed by variable name, passed to
+            the tendency of each population.
+        scheme : string, Integrator, optional
+            Time integration scheme, one of 'euler', 'rk2', 'rk4',
+            'rk23' (adaptive) or 'exponential' (see `SCHEMES`), or an
+            integrator instance. Defaults to model `scheme`, or
+            forward Euler if unset.
+        output : float, optional
+            Output interval. History of populations is appended every
+            `output` time units, or at every time step if not set.
+        nmax : int, optional
+            Number of maximum history items to be stored.
+        advection : Advection, optional
+            If given, individuals are transported by the velocity
+            fields in `environments` before each time step (see
+            `gaia.advection.Advection`).
+        processes : int, optional
+            If greater than one, populations are split among this number
+            of worker processes sharing memory (see
+            `gaia.parallel.ProcessRunner`). Results are identical to
+            those of serial runs.
+        resampler : Resampler, optional
+            If given, individuals are merged or split after each time
+            step to keep their number near a budget (see
+            `gaia.resampling.Resampler`). Not supported with worker
+            processes.
+
+        Returns
+        -------
+        Nothing.
+
+        Timings of each phase of every step are collected by the default
+        profiler (see `gaia.base.Profiler`), if enabled.
+
+        """
+        if not isinstance(populations, (list, tuple)):
+            populations = [populations]
+        if environments is None:
+            environments = dict()
+        if scheme is None:
+            scheme = self.scheme or 'euler'
+        if output is None:
+            output = self.output
+        kwargs = dict() if nmax is None else dict(nmax=nmax)
+        integrator = self.integrator(scheme)
+        #
+        t, dt = self.t, self.dt
+        n = int(ceil((until - t) / dt - 1e-9))
+        t_output = t if output is None else t + output
+        if (processes is not None) and (processes > 1):
+            if resampler is not None:
+                raise ValueError('Resampling is not supported with worker '
+                                 'processes.')
+            runner = ProcessRunner(populations, environments, integrator,
+                                   advection, processes)
+        else:
+            runner = None
+        try:
+            for i in range(n):
+                h = min(dt, until - t)
+                if runner is None:
+                    for population in populations:
+                        if advection is not None:
+                            with profiler.timer('advection'):
+                                advection.step(population, t, h,
+                                               environments)
+                        with profiler.timer('integration'):
+                            integrator.step(population, t, h, environments)
+                else:
+                    with profiler.timer('parallel'):
+                        runner.step(t, h)
+                for population in populations:
+                    if 't' in population.state_parameters:
+                        population.t += h
+                if resampler is not None:
+                    with profiler.timer('resampling'):
+                        for population in populations:
+                            resampler.step(population)
+                t = self.t = t + h
+                #
+                if (output is None) or (t >= t_output - 1e-9 * dt):
+                    for population in populations:
+                        population.append_history(time=t, **kwargs)
+                    if output is not None:
+                        t_output += output
+                profiler.step(t)
+        finally:
+            if runner is not None:
+                runner.close()
+
+    def integrator(self, scheme):
+        """Returns integrator instance for given scheme."""
+        if isinstance(scheme, Integrator):
+            return scheme
+        integrators = self._attributes.setdefault('_integrators', dict())
+        try:
+            return integrators[scheme]
+        except KeyError:
+            try:
+                integrators[scheme] = SCHEMES[scheme]()
+            except KeyError:
+                raise ValueError('Invalid time integration scheme '
+                                 '{0}.'.format(scheme))
+            return integrators[scheme]
+
     # Default properties (attributes) for each model.
     @property
     def t(self):
@@ -48,6 +700,22 @@ class Model(BaseClass):
     def dt(self, a):
         self._set_attribute('dt', a)
 
+    @property
+    def scheme(self):
+        """Time integration scheme."""
+        return self._get_attribute('scheme')
+    @scheme.setter
+    def scheme(self, a):
+        self._set_attribute('scheme', a)
+
+    @property
+    def output(self):
+        """Output interval."""
+        return self._get_attribute('output')
+    @output.setter
+    def output(self, a):
+        self._set_attribute('output', a)
+
 
 class Environment(BaseClass):
     """Environmental pools for models."""
@@ -80,6 +748,14 @@ class Environment(BaseClass):
     def units(self, a):
         self._set_attribute('units', a)
 
+    @property
+    def t(self):
+        """Time coordinate."""
+        return self._get_attribute('t')
+    @t.setter
+    def t(self, a):
+        self._set_attribute('t', a)
+
     @property
     def x(self):
         """Zonal coordinate."""
@@ -103,3 +779,416 @@ class Environment(BaseClass):
     @z.setter
     def z(self, a):
         self._set_attribute('z', a)
+
+
+class GriddedEnvironment(Environment):
+    """
+    Environmental pool defined on a rectilinear grid.
+
+    Data is indexed as data[t, z, y, x] and sampled at arbitrary
+    positions by quadrilinear interpolation, vectorized over all
+    individuals. Coordinates which are not set are taken as singleton
+    axes. Positions outside the grid are clamped to its edges.
+
+    Data may be any object returning a decoded time slab when indexed,
+    e. g. a netCDF variable. If `cache` is set, decoded slabs are kept
+    in a `SlabCache` and the slab following the current time interval
+    is prefetched in the background.
+
+    """
+    def read(self, t, z, y, x):
+        """
+        Reads data at given positions.
+
+        Parameters
+        ----------
+        t, z, y, x : float, array like
+            Time and position of individuals.
+
+        Returns
+        -------
+        values : array like
+            Interpolated data.
+
+        """
+        return self.sample(self.weights(t, z, y, x))
+
+    def weights(self, t, z, y, x):
+        """
+        Calculates interpolation indices and weights on every axis.
+
+        Returns
+        -------
+        weights : list
+            List of (i0, i1, w) tuples for the t, z, y and x axes, as
+            returned by `Axis.locate`. Weights have the data type of
+            the environment, if set.
+
+        """
+        weights = [self.axis(name).locate(value) for name, value in
+                   zip(['t', 'z', 'y', 'x'], [t, z, y, x])]
+        dtype = self.dtype
+        if dtype is not None:
+            weights = [(i0, i1, asarray(w, dtype=dtype)) for i0, i1, w in
+                       weights]
+        return weights
+
+    def sample(self, weights):
+        """Interpolates data using precomputed weights."""
+        (t0, t1, wt), spatial = weights[0], weights[1:]
+        if t0.size == 1:
+            # Every individual is in the same time interval, hence only
+            # the two bracketing time slabs are needed.
+            t0, t1, wt = t0[0], t1[0], wt[0]
+            a = self._trilinear(self.slab(t0), spatial)
+            if (wt != 0) & (t1 != t0):
+                b = self._trilinear(self.slab(t1), spatial)
+                a += wt * (b - a)
+            self.prefetch(t1 + 1)
+            return a
+        # Individuals at different times are processed slab by slab.
+        shape = broadcast(t0, *[w[0] for w in spatial]).shape
+        t0, t1, wt = [broadcast_to(item, shape) for item in (t0, t1, wt)]
+        spatial = [[broadcast_to(item, shape) for item in w]
+                   for w in spatial]
+        result = zeros(shape, dtype=self.dtype or float)
+        for k in unique(concatenate((t0.ravel(), t1.ravel()))):
+            f = (1 - wt) * (t0 == k) + wt * (t1 == k)
+            sel = (f != 0).nonzero()
+            if len(sel[0]) == 0:
+                continue
+            w = [[item[sel] for item in ax] for ax in spatial]
+            result[sel] += f[sel] * self._trilinear(self.slab(k), w)
+        return result
+
+    def prefetch(self, i):
+        """
+        Loads slab at time index `i` in the background, if cached. The
+        slab following the current interval is thereby loaded while the
+        rest of the time step is computed.
+
+        """
+        cache = self.cache
+        if (cache is not None) and (i < self.axis('t').size):
+            cache.prefetch(i)
+
+    def slab(self, i):
+        """Returns three-dimensional data at time index `i`."""
+        cache = self.cache
+        if cache is None:
+            return self.load(i)
+        return cache.get(i)
+
+    def load(self, i):
+        """Loads and decodes data at time index `i`."""
+        return asarray(self.data[i], dtype=self.dtype)
+
+    def axis(self, name):
+        """Returns lookup axis for given coordinate."""
+        axes = self._attributes.setdefault('_axes', dict())
+        coord = self._get_attribute(name)
+        if coord is None:
+            coord = [0.]
+        try:
+            axis = axes[name]
+            if axis.source is coord:
+                return axis
+        except KeyError:
+            pass
+        axis = axes[name] = Axis(coord)
+        return axis
+
+    @staticmethod
+    def _trilinear(slab, weights):
+        """
+        Trilinear interpolation on the last three axes of a slab, e. g.
+        of several stacked variables.
+
+        """
+        (z0, z1, wz), (y0, y1, wy), (x0, x1, wx) = weights
+        s = slab
+        c00 = s[..., z0, y0, x0] + wx * (s[..., z0, y0, x1] -
+                                         s[..., z0, y0, x0])
+        c01 = s[..., z0, y1, x0] + wx * (s[..., z0, y1, x1] -
+                                         s[..., z0, y1, x0])
+        c10 = s[..., z1, y0, x0] + wx * (s[..., z1, y0, x1] -
+                                         s[..., z1, y0, x0])
+        c11 = s[..., z1, y1, x0] + wx * (s[..., z1, y1, x1] -
+                                         s[..., z1, y1, x0])
+        c0 = c00 + wy * (c01 - c00)
+        c1 = c10 + wy * (c11 - c10)
+        return c0 + wz * (c1 - c0)
+
+    @property
+    def data(self):
+        """Gridded data indexed as [t, z, y, x]."""
+        return self._get_attribute('data')
+    @data.setter
+    def data(self, a):
+        self._set_attribute('data', a)
+        if self.cache is not None:
+            self.cache.clear()
+
+    @property
+    def dtype(self):
+        """
+        Data type of decoded slabs and interpolated values, e. g.
+        'float32'. Defaults to the type of data.
+
+        """
+        return self._get_attribute('dtype')
+    @dtype.setter
+    def dtype(self, a):
+        self._set_attribute('dtype', None if a is None else _dtype(a).name)
+        if self.cache is not None:
+            self.cache.clear()
+
+    @property
+    def cache(self):
+        """
+        Cache of decoded time slabs. May be set to the number of slabs
+        to keep in memory, or to True for the default number.
+
+        """
+        return self._get_attribute('cache')
+    @cache.setter
+    def cache(self, a):
+        if isinstance(a, bool):
+            a = SlabCache(self.load) if a else None
+        elif isinstance(a, int):
+            a = SlabCache(self.load, size=a)
+        self._set_attribute('cache', a)
+
+
+class EnvironmentGroup(BaseClass):
+    """
+    Group of environmental pools read together.
+
+    Gridded pools sharing the same coordinates are located once: cell
+    indices and interpolation weights are calculated for the first one
+    and reused to sample every other variable. Their time slabs are
+    stacked, so that all variables are gathered in one pass. Groups can
+    be used wherever a dictionary of environmental pools is expected.
+
+    Parameters
+    ----------
+    environments : dictionary
+        Environmental pools, or constant values, indexed by variable
+        name.
+
+    """
+    def __init__(self, environments=None, **kwargs):
+        super(EnvironmentGroup, self).__init__(**kwargs)
+        self._attributes['environments'] = dict(environments or {})
+
+    def __getitem__(self, key):
+        return self._attributes['environments'][key]
+
+    def __setitem__(self, key, value):
+        self._attributes['environments'][key] = value
+        self._attributes.pop('_grids', None)
+        self._attributes.pop('_stacks', None)
+
+    def __contains__(self, key):
+        return key in self._attributes['environments']
+
+    def keys(self):
+        """Returns list of variable names."""
+        return self._attributes['environments'].keys()
+
+    def read(self, t, z, y, x, keys=None):
+        """
+        Reads several variables at given positions.
+
+        Parameters
+        ----------
+        t, z, y, x : float, array like
+            Time and position of individuals.
+        keys : list, optional
+            Variables to read. Reads every variable if not set.
+
+        Returns
+        -------
+        values : dictionary
+            Values of each variable at the position of individuals.
+
+        """
+        if keys is None:
+            keys = self.keys()
+        environments = self._attributes['environments']
+        result = dict()
+        for grid in self.grids():
+            members = [key for key in grid if key in keys]
+            if len(members) == 0:
+                continue
+            weights = environments[members[0]].weights(t, z, y, x)
+            for key, value in zip(members, self._sample(members, weights)):
+                result[key] = value
+        for key in keys:
+            if key in result:
+                continue
+            item = environments[key]
+            if hasattr(item, 'read'):
+                result[key] = item.read(t, z, y, x)
+            else:
+                result[key] = item
+        return result
+
+    def grids(self):
+        """Returns lists of gridded variables sharing coordinates."""
+        environments = self._attributes['environments']
+        # Axes are replaced whenever coordinates change.
+        signature = [(key, [item.axis(name) for name in 'tzyx'])
+                     for key, item in environments.items()
+                     if isinstance(item, GriddedEnvironment)]
+        cached = self._attributes.get('_grids')
+        if (cached is not None) and _same_axes(cached[0], signature):
+            return cached[1]
+        grids, coords = [], []
+        for key, axes in signature:
+            axes = [axis.coord for axis in axes]
+            for grid, c in zip(grids, coords):
+                if all(array_equal(a, b) for a, b in zip(axes, c)):
+                    grid.append(key)
+                    break
+            else:
+                grids.append([key])
+                coords.append(axes)
+        self._attributes['_grids'] = (signature, grids)
+        self._attributes.pop('_stacks', None)
+        return grids
+
+    def _sample(self, members, weights):
+        """Returns values of variables sharing interpolation weights."""
+        environments = self._attributes['environments']
+        items = [environments[key] for key in members]
+        (t0, t1, wt), spatial = weights[0], weights[1:]
+        if (len(items) == 1) or (t0.size != 1) or \
+                (len(set(item.dtype for item in items)) != 1):
+            return [item.sample(weights) for item in items]
+        t0, t1, wt = t0[0], t1[0], wt[0]
+        a = GriddedEnvironment._trilinear(self._stack(members, t0), spatial)
+        if (wt != 0) & (t1 != t0):
+            b = GriddedEnvironment._trilinear(self._stack(members, t1),
+                                              spatial)
+            a += wt * (b - a)
+        for item in items:
+            item.prefetch(t1 + 1)
+        return a
+
+    def _stack(self, members, i):
+        """
+        Returns slabs of given variables at time index `i`, stacked
+        along the first axis. Stacks of the last two time indices are
+        kept until the slabs of any variable change.
+
+        """
+        environments = self._attributes['environments']
+        slabs = [environments[key].slab(i) for key in members]
+        stacks = self._attributes.setdefault('_stacks', dict()).setdefault(
+            tuple(members), OrderedDict())
+        item = stacks.get(i)
+        # Slabs of the stack are kept alive, hence new slabs at the same
+        # address share their memory.
+        if (item is not None) and all(
+                (a.__array_interface__ == b.__array_interface__)
+                for a, b in zip(slabs, item[0])):
+            return item[1]
+        stacks.pop(i, None)
+        stacks[i] = (slabs, array(slabs))
+        while len(stacks) > 2:
+            stacks.popitem(last=False)
+        return stacks[i][1]
+
+
+class MemmapEnvironment(GriddedEnvironment):
+    """
+    Gridded environmental pool memory-mapped from disk.
+
+    Data is read from a NumPy .npy file or from a raw binary file with
+    a JSON header (see `write_raw`). Files are opened lazily and mapped
+    read-only, so construction does not depend on dataset size and only
+    pages touched by `read` are loaded. Processes mapping the same file
+    share the operating system page cache.
+
+    Coordinates, name, description and units not given as arguments
+    are taken from the JSON header, if present.
+
+    """
+    def __init__(self, path=None, **kwargs):
+        super(MemmapEnvironment, self).__init__(path=path, **kwargs)
+
+    def __getstate__(self):
+        # Mapped data is reopened after unpickling instead of being
+        # copied to other processes. Caches hold threads and locks, only
+        # their size is kept.
+        state = self.__dict__.copy()
+        state['_attributes'] = dict((key, value) for key, value in
+                                    self._attributes.items()
+                                    if key not in ['data', '_axes'])
+        cache = self._attributes.get('cache')
+        if cache is not None:
+            state['_attributes']['cache'] = cache.size
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._attributes.get('cache') is not None:
+            self.cache = self._attributes['cache']
+
+    def header(self):
+        """Returns dictionary with the JSON header, if any."""
+        header = self._attributes.get('_header')
+        if header is None:
+            try:
+                with open(self.path + '.json') as f:
+                    header = json.load(f)
+            except IOError:
+                header = dict()
+            self._attributes['_header'] = header
+        return header
+
+    def load(self, i):
+        """Returns memory-mapped data at time index `i`."""
+        if self.dtype is None:
+            return self.data[i]
+        return asarray(self.data[i], dtype=self.dtype)
+
+    def _get_attribute(self, attrib):
+        value = self._attributes.get(attrib)
+        if (value is None) and (attrib in ['t', 'z', 'y', 'x', 'name',
+                                          'description', 'units']):
+            value = self.header().get(attrib)
+            if value is not None:
+                self._attributes[attrib] = value
+                self._attributes.setdefault('_inherited', set()).add(attrib)
+        return value
+
+    @property
+    def path(self):
+        """File name."""
+        return self._get_attribute('path')
+    @path.setter
+    def path(self, a):
+        self._set_attribute('path', a)
+        self._attributes.pop('_header', None)
+        self._attributes.pop('data', None)
+        # Attributes taken from the header of the previous file.
+        for key in self._attributes.pop('_inherited', []):
+            self._attributes.pop(key, None)
+        if self.cache is not None:
+            self.cache.clear()
+
+    @property
+    def data(self):
+        """Memory-mapped data indexed as [t, z, y, x]."""
+        data = self._attributes.get('data')
+        if data is None:
+            if self.path.endswith('.npy'):
+                data = load(self.path, mmap_mode='r')
+            else:
+                header = self.header()
+                data = memmap(self.path, dtype=_dtype(header['dtype']),
+                              mode='r', shape=tuple(header['shape']))
+            self._attributes['data'] = data
+        return data
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for Lagrangian modelling.
+
+This module implements the streaming output of history to disk.
+
+Disclaimer
+----------
+This software may be used, copied, or redistributed as long as it is
+not sold and this copyright notice is reproduced on each copy made.
+This routine is provided as is without any express or implied
+warranties whatsoever.
+
+Author
+------
+Sebastian Krieger (sebastian.krieger@usp.br)
+
+Revision
+--------
+1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+import json
+from os import makedirs, rename
+from os.path import isdir, join
+from threading import Thread
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from numpy import asarray, concatenate, empty, load as _load, save as _save
+
+from gaia.base import profiler
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+# Name of stream index file.
+INDEX = 'index.json'
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def load(path, name, keys=None, mmap_mode='r'):
+    """
+    Loads history written by `StreamWriter`.
+
+    Parameters
+    ----------
+    path : string
+        Output directory.
+    name : string
+        Name of the history, as given to `StreamWriter.append`.
+    keys : list, optional
+        List of keys to return, if not set returns all variables.
+    mmap_mode : string, optional
+        Memory-map mode of chunk files, see `numpy.load`.
+
+    Returns
+    -------
+    H : dictionary
+        Dictionary with arrays of the history of each variable. Chunks
+        of different item shapes, e. g. after individuals were born,
+        are returned as lists of arrays.
+
+    """
+    with open(join(path, INDEX)) as f:
+        index = json.load(f)[name]
+    if keys is None:
+        keys = index.keys()
+    result = dict()
+    for key in keys:
+        chunks = [_load(join(path, item['file']), mmap_mode=mmap_mode)
+                  for item in index[key]]
+        shapes = set(chunk.shape[1:] for chunk in chunks)
+        if len(chunks) == 0:
+            result[key] = None
+        elif len(shapes) == 1:
+            result[key] = concatenate(chunks, axis=0)
+        else:
+            result[key] = chunks
+    return result
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class StreamWriter(object):
+    """
+    Asynchronous writer of history to append-only chunk files.
+
+    Appended items are copied into preallocated chunks of `chunk` rows
+    per variable. Full chunks are handed to a background thread which
+    saves them as .npy files and updates a JSON index, so that
+    computation does not wait on disk. At most `queue` chunks wait to be
+    written; once the queue is full, appending blocks until the disk
+    catches up, which bounds memory use.
+
+    Histories are streamed by `gaia.individuals.Individual.stream`, in
+    which case in-memory history can be bounded by `nmax` (see
+    `gaia.models.Model.run`).
+
+    Parameters
+    ----------
+    path : string
+        Output directory, created if needed.
+    chunk : int, optional
+        Number of items per chunk file.
+    queue : int, optional
+        Maximum number of chunks waiting to be written.
+
+    """
+    def __init__(self, path, chunk=1024, queue=4):
+        if not isdir(path):
+            makedirs(path)
+        self.path = path
+        self.chunk = max(int(chunk), 1)
+        self._buffers = dict()
+        self._index = dict()
+        self._queue = Queue(maxsize=max(int(queue), 1))
+        self._error = None
+        self._thread = Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+        # Counters
+        self.chunks = 0
+        self.waits = 0
+
+    def append(self, name, key, value):
+        """Appends `value` to the history of variable `key` of `name`."""
+        self._check()
+        value = asarray(value)
+        buf = self._buffers.get((name, key))
+        if (buf is not None) and ((buf[0].shape[1:] != value.shape) or
+                                  (buf[0].dtype != value.dtype)):
+            # Shape changed, e. g. individuals were born.
+            self._send(name, key)
+            buf = None
+        if buf is None:
+            buf = self._buffers[(name, key)] = [
+                empty((self.chunk, ) + value.shape, dtype=value.dtype), 0]
+        buf[0][buf[1]] = value
+        buf[1] += 1
+        if buf[1] == self.chunk:
+            self._send(name, key)
+
+    def flush(self):
+        """Hands partially filled chunks to the writer thread."""
+        for name, key in list(self._buffers.keys()):
+            self._send(name, key)
+
+    def close(self):
+        """Writes every pending item and stops the writer thread."""
+        if self._thread is None:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._check()
+
+    def _send(self, name, key):
+        """Queues chunk of given variable to be written."""
+        buf = self._buffers.pop((name, key), None)
+        if (buf is None) or (buf[1] == 0):
+            return
+        if self._queue.full():
+            self.waits += 1
+            profiler.count('stream.waits')
+        self._queue.put((name, key, buf[0][:buf[1]]))
+
+    def _check(self):
+        """Raises errors of the writer thread."""
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _worker(self):
+        """Writes queued chunks and updates the index."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            name, key, data = item
+            try:
+                chunks = self._index.setdefault(name, dict()).setdefault(
+                    key, [])
+                fname = '{0}.{1}.{2:06d}.npy'.format(name, key, len(chunks))
+                with open(join(self.path, fname), 'wb') as f:
+                    _save(f, data)
+                chunks.append(dict(file=fname, rows=data.shape[0],
+                                   shape=list(data.shape[1:]),
+                                   dtype=data.dtype.str))
+                tmp = join(self.path, INDEX + '.tmp')
+                with open(tmp, 'w') as f:
+                    json.dump(self._index, f)
+                rename(tmp, join(self.path, INDEX))
+                self.chunks += 1
+            except Exception as error:
+                self._error = error
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for Lagrangian modelling.
+
+This module implements the parallel execution of models using worker
+processes and shared memory.
+
+Disclaimer
+----------
+This software may be used, copied, or redistributed as long as it is
+not sold and this copyright notice is reproduced on each copy made.
+This routine is provided as is without any express or implied
+warranties whatsoever.
+
+Author
+------
+Sebastian Krieger (sebastian.krieger@usp.br)
+
+Revision
+--------
+1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+from os import getpid
+from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import ThreadPool
+from multiprocessing.sharedctypes import RawArray
+
+from numpy import asarray, bool_, empty, frombuffer, ndarray, searchsorted
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+# State of the running job, inherited by forked worker processes.
+_job = dict()
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def shared(a):
+    """Returns copy of array `a` in shared memory."""
+    buf = RawArray('b', max(a.nbytes, 1))
+    b = frombuffer(buf, dtype=a.dtype, count=a.size).reshape(a.shape)
+    b[...] = a
+    return b
+
+
+def share(individual):
+    """
+    Moves state parameters and per individual arrays of `individual`
+    into shared memory.
+
+    """
+    n = individual.size()
+    individual.population.share()
+    for key, value in individual._attributes.items():
+        if key.startswith('_'):
+            continue
+        if isinstance(value, ndarray) and (value.shape[-1:] == (n, )):
+            individual._attributes[key] = shared(value)
+    individual._attributes.pop('_active', None)
+
+
+def partition(n, parts):
+    """Splits `n` items into at most `parts` contiguous ranges."""
+    parts = max(min(int(parts), n), 1)
+    bounds = [(i * n) // parts for i in range(parts + 1)]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def _slice(value, start, stop, n):
+    """Slices per individual arrays, other values are kept."""
+    if isinstance(value, ndarray) and (value.shape[-1:] == (n, )):
+        return value[..., start:stop]
+    return value
+
+
+def _step(task):
+    """Advances one slice of a population, run by worker processes."""
+    k, start, stop, t, dt = task
+    subsets = _job['subsets']
+    try:
+        individual = subsets[k, start, stop]
+    except KeyError:
+        individual = subsets[k, start, stop] = \
+            _job['populations'][k].subset(start, stop)
+    environments = _job['environments']
+    if _job['advection'] is not None:
+        _job['advection'].step(individual, t, dt, environments)
+    # Stage buffers are indexed by slice, identities of objects may be
+    # reused once they are freed.
+    _job['integrator'].step(individual, t, dt, environments,
+                            key=(k, start, stop))
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class ProcessRunner(object):
+    """
+    Advances populations in parallel worker processes.
+
+    Populations are moved into shared memory and split into contiguous
+    slices, one per process. At each step every worker advances its
+    slices in place and the step only returns once all of them are
+    done. Kernels act on each individual independently, hence results
+    are identical to those of serial runs.
+
+    Worker processes are forked and inherit populations, environmental
+    pools and integrators, so only time and slice bounds are sent at
+    every step.
+
+    Parameters
+    ----------
+    populations : list
+        Populations to advance in time.
+    environments : dictionary
+        Environmental pools.
+    integrator : Integrator
+        Time integration scheme.
+    advection : Advection, optional
+        Transport of individuals.
+    processes : int
+        Number of worker processes.
+
+    """
+    def __init__(self, populations, environments, integrator,
+                 advection=None, processes=2):
+        if _job:
+            raise RuntimeError('Only one parallel run at a time is '
+                               'supported.')
+        try:
+            for population in populations:
+                share(population)
+            self.populations = populations
+            self.tasks = [(k, start, stop) for k, population in
+                          enumerate(populations) for start, stop in
+                          partition(population.size(), processes)]
+            _job.update(populations=populations, environments=environments,
+                        integrator=integrator, advection=advection,
+                        subsets=dict())
+            self.pool = Pool(processes)
+        except:
+            # Later runs are not blocked by a failed setup.
+            _job.clear()
+            raise
+
+    def step(self, t, dt):
+        """Advances every population from time `t` to `t + dt`."""
+        self.pool.map(_step, [task + (t, dt) for task in self.tasks],
+                      chunksize=1)
+
+    def close(self):
+        """Stops worker processes."""
+        self.pool.close()
+        self.pool.join()
+        _job.clear()
+        # Masks may have been changed by worker processes.
+        for population in self.populations:
+            population._attributes.pop('_active', None)
+
+
+class ThreadExecutor(object):
+    """
+    Evaluates kernels in chunks on a pool of threads.
+
+    NumPy ufuncs release the global interpreter lock, so evaluating
+    cache sized chunks of a population concurrently scales with the
+    number of cores without the overhead of worker processes. Assign
+    an executor to `Plankton.executor` to use it for growth kernels.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of threads. Defaults to the number of processors.
+    chunk : int, optional
+        Number of individuals per chunk.
+
+    """
+    def __init__(self, workers=None, chunk=16384):
+        self.workers = workers or cpu_count()
+        self.chunk = int(chunk)
+        self._pool = None
+        self._pid = getpid()
+
+    def chunks(self, n):
+        """Returns list of (start, stop) bounds of chunks of `n` items."""
+        return [(i, min(i + self.chunk, n)) for i in range(0, n, self.chunk)]
+
+    def map(self, function, n):
+        """
+        Calls `function(start, stop)` for every chunk of `n` items.
+
+        """
+        chunks = self.chunks(n)
+        if (self.workers == 1) or (len(chunks) < 2):
+            for start, stop in chunks:
+                function(start, stop)
+            return
+        if (self._pool is None) or (self._pid != getpid()):
+            # Threads are not inherited by forked processes.
+            self._pool = ThreadPool(self.workers)
+            self._pid = getpid()
+        self._pool.map(lambda bounds: function(*bounds), chunks)
+
+    def growth(self, individual, T, E_0, alpha, NO3, NH4, mask=True,
+               out=None):
+        """
+        Chunked equivalent of `gaia.individuals.Plankton.growth`.
+
+        """
+        n = individual.size()
+        if out is None:
+            out = empty((5, ) + individual.population.shape,
+                        dtype=individual.dtype)
+        bounds = self.chunks(n)
+        subsets = dict(zip(bounds, individual.subsets(bounds)))
+        if mask is not True:
+            mask = asarray(mask)
+
+        def task(start, stop):
+            args = [_slice(item, start, stop, n) for item in
+                    (T, E_0, alpha, NO3, NH4)]
+            if mask is True:
+                m = True
+            elif mask.dtype == bool_:
+                m = _slice(mask, start, stop, n)
+            else:
+                # Sorted indices of active individuals.
+                a, b = searchsorted(mask, (start, stop))
+                m = mask[a:b] - start
+            subsets[start, stop].growth(
+                *args, mask=m, out=[item[..., start:stop] for item in out])
+
+        self.map(task, n)
+        return out
+
+    def close(self):
+        """Stops threads."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for Lagrangian modelling.
+
+This module implements the columnar storage of state variables shared
+by every individual in a population.
+
+Disclaimer
+----------
+This software may be used, copied, or redistributed as long as it is
+not sold and this copyright notice is reproduced on each copy made.
+This routine is provided as is without any express or implied
+warranties whatsoever.
+
+Author
+------
+Sebastian Krieger (sebastian.krieger@usp.br)
+
+Revision
+--------
+1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+from multiprocessing.sharedctypes import RawArray
+
+from numpy import atleast_1d, dtype as _dtype, empty, float64, frombuffer, nan
+from numpy.core.records import fromarrays, fromrecords
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def from_records(records, names, dtype=float64):
+    """
+    Creates population from sequence of records.
+
+    Parameters
+    ----------
+    records : list
+        List of tuples, one per individual, with values in the same
+        order as `names`.
+    names : list
+        Names of the state variables.
+    dtype : data-type, optional
+        Data type of the columns.
+
+    Returns
+    -------
+    population : Population
+        Population with one column per state variable.
+
+    """
+    formats = ','.join([_dtype(dtype).str] * len(names))
+    R = fromrecords(records, formats=formats, names=names)
+    population = Population(names, size=len(R), dtype=dtype)
+    for name in names:
+        population[name] = R[name]
+    return population
+
+
+def common_size(values):
+    """
+    Returns the common length of given values.
+
+    Scalars and items of length one broadcast against the others, None
+    items are ignored. The length is one if there are only scalars.
+
+    """
+    n = None
+    for value in values:
+        if value is None:
+            continue
+        m = atleast_1d(value).shape[0]
+        if (n is None) or (n == 1):
+            n = m
+        elif (m != 1) and (m != n):
+            raise ValueError('State variables must share the same length.')
+    return 1 if n is None else n
+
+
+def _fill_value(dtype):
+    """Returns value of new items of given data type."""
+    if dtype.kind in 'fc':
+        return nan
+    elif dtype.kind == 'b':
+        return False
+    elif dtype.kind in 'iu':
+        return -1
+    return None
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class Population(object):
+    """
+    Structure-of-arrays storage for the state of a population.
+
+    Every state variable is a row of one preallocated block, so that
+    all columns share the same data type and length and each one is
+    contiguous in memory. Item access returns views into the block,
+    hence vectorized kernels work in place.
+
+    Populations may hold an ensemble of members, e. g. for parameter
+    sweeps, in which case each column has shape (members, size).
+
+    Parameters
+    ----------
+    columns : list
+        Names of the state variables.
+    size : int, optional
+        Number of individuals.
+    capacity : int, optional
+        Number of preallocated individuals. Defaults to `size`.
+    dtype : data-type, optional
+        Data type of the columns.
+    members : int, optional
+        Number of ensemble members.
+
+    """
+    def __init__(self, columns, size=0, capacity=None, dtype=float64,
+                 members=1):
+        self._columns = list(columns)
+        self._index = dict((name, i) for i, name in
+                           enumerate(self._columns))
+        self._size = int(size)
+        if capacity is None:
+            capacity = self._size
+        self._block = empty((len(self._columns), int(members),
+                             max(capacity, self._size)), dtype=dtype)
+        self._block[:, :, :self._size] = _fill_value(self._block.dtype)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        if self._block.shape[1] == 1:
+            return self._block[self._index[name], 0, :self._size]
+        return self._block[self._index[name], :, :self._size]
+
+    def __setitem__(self, name, value):
+        self._block[self._index[name], :, :self._size] = value
+
+    @property
+    def columns(self):
+        """Names of the state variables."""
+        return list(self._columns)
+
+    @property
+    def capacity(self):
+        """Number of preallocated individuals."""
+        return self._block.shape[2]
+
+    @property
+    def members(self):
+        """Number of ensemble members."""
+        return self._block.shape[1]
+
+    @property
+    def shape(self):
+        """Shape of each column."""
+        if self._block.shape[1] == 1:
+            return (self._size, )
+        return (self._block.shape[1], self._size)
+
+    @property
+    def dtype(self):
+        """Data type of the columns."""
+        return self._block.dtype
+
+    def block(self):
+        """Returns view of all columns, stacked along first axis."""
+        if self._block.shape[1] == 1:
+            return self._block[:, 0, :self._size]
+        return self._block[:, :, :self._size]
+
+    def gather(self, columns, out=None):
+        """
+        Copies given columns into array.
+
+        Parameters
+        ----------
+        columns : list
+            Names of the state variables.
+        out : array like, optional
+            Array of shape (len(columns), ) + shape into which values
+            are copied.
+
+        """
+        if out is None:
+            out = empty((len(columns), ) + self.shape,
+                        dtype=self._block.dtype)
+        for i, name in enumerate(columns):
+            out[i] = self[name]
+        return out
+
+    def scatter(self, columns, values):
+        """Copies rows of `values` into given columns."""
+        for i, name in enumerate(columns):
+            self[name] = values[i]
+
+    def resize(self, size):
+        """
+        Changes the number of individuals.
+
+        Storage capacity grows by doubling, so that resizing is
+        amortized O(1) per individual. New individuals are set to NaN,
+        or to the fill value of other data types.
+
+        """
+        size = int(size)
+        if size > self.capacity:
+            block = empty(self._block.shape[:2] +
+                          (max(size, 2 * self.capacity), ),
+                          dtype=self._block.dtype)
+            block[:, :, :self._size] = self._block[:, :, :self._size]
+            self._block = block
+        if size > self._size:
+            self._block[:, :, self._size:size] = _fill_value(
+                self._block.dtype)
+        self._size = size
+
+    def astype(self, dtype):
+        """Converts storage to given data type."""
+        if self._block.dtype != dtype:
+            self._block = self._block.astype(dtype)
+
+    def set_members(self, members):
+        """
+        Turns population into an ensemble of `members` identical
+        copies of the current state.
+
+        """
+        if self.members != 1:
+            raise ValueError('Population is already an ensemble.')
+        block = empty((self._block.shape[0], int(members),
+                       self._block.shape[2]), dtype=self._block.dtype)
+        block[...] = self._block
+        self._block = block
+
+    def view(self, start, stop):
+        """
+        Returns population sharing the storage of individuals from
+        `start` to `stop`. Views cannot be resized.
+
+        """
+        population = Population.__new__(Population)
+        population._columns = self._columns
+        population._index = self._index
+        population._block = self._block[:, :, start:stop]
+        population._size = population._block.shape[2]
+        return population
+
+    def share(self):
+        """
+        Moves storage into shared memory, which is inherited by worker
+        processes. Resizing beyond capacity moves it back to private
+        memory.
+
+        """
+        buf = RawArray('b', self._block.nbytes)
+        block = frombuffer(buf, dtype=self._block.dtype).reshape(
+            self._block.shape)
+        block[...] = self._block
+        self._block = block
+
+    def to_records(self):
+        """
+        Returns copy of the population as a record array. Ensemble
+        members are stacked.
+
+        """
+        return fromarrays([item.ravel() for item in self.block()],
+                          names=self._columns)
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for Lagrangian modelling.
+
+This module implements super-individual resampling, which merges
+similar individuals and splits heavy ones to keep the number of agents
+near a target budget.
+
+Disclaimer
+----------
+This software may be used, copied, or redistributed as long as it is
+not sold and this copyright notice is reproduced on each copy made.
+This routine is provided as is without any express or implied
+warranties whatsoever.
+
+Author
+------
+Sebastian Krieger (sebastian.krieger@usp.br)
+
+Revision
+--------
+1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+from numpy import (add, argpartition, asarray, bool_, broadcast_to, errstate,
+                   flatnonzero, floor, intp, lexsort, ndarray, unique, zeros)
+
+from gaia.base import profiler
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def merge(individual, cell, ratio=None):
+    """
+    Merges active individuals which share the same cell, ratio bin and
+    group into one super-individual.
+
+    Extensive parameters (see `Individual.extensive_parameters`) of
+    every bin are summed up into its first individual, which is moved
+    to their weighted mean position. The other ones die (see
+    `Individual.kill`) and their state parameters are set to NaN, so
+    that totals over live individuals are conserved.
+
+    Parameters
+    ----------
+    individual : Individual
+        Population of individuals.
+    cell : float, array like
+        Cell size along the x, y and z axes.
+    ratio : float, optional
+        Width of bins of the ratio of every extensive parameter to the
+        first one, e. g. the N:C ratio of plankton. Not considered if
+        not set.
+
+    Returns
+    -------
+    count : int
+        Number of individuals merged into others.
+
+    """
+    keys = _check(individual)
+    index = individual.active()
+    if len(index) < 2:
+        return 0
+    W = individual._get_attribute(keys[0])
+    w = W[index]
+    # Integer bin codes, the last one is the primary sort key.
+    codes = []
+    for key in (keys[1:] if ratio is not None else []):
+        with errstate(divide='ignore', invalid='ignore'):
+            q = individual._get_attribute(key)[index] / w
+        q[w == 0] = 0
+        codes.append(floor(q / ratio).astype(intp))
+    coords = []
+    for key, size in zip(['x', 'y', 'z'],
+                         broadcast_to(asarray(cell, dtype=float), (3, ))):
+        value = individual._get_attribute(key)
+        if not isinstance(value, ndarray):
+            continue
+        coords.append(value)
+        codes.append(floor(value[index] / size).astype(intp))
+    group = individual.group
+    if isinstance(group, ndarray) and (group.shape == W.shape):
+        codes.append(unique(group[index], return_inverse=True)[1])
+    order = lexsort(codes)
+    change = zeros(len(index), dtype=bool_)
+    change[0] = True
+    for code in codes:
+        sorted_code = code[order]
+        change[1:] |= sorted_code[1:] != sorted_code[:-1]
+    starts = flatnonzero(change)
+    if len(starts) == len(index):
+        return 0
+    index = index[order]
+    survivors = index[starts]
+    merged = index[~change]
+    # Weighted mean position.
+    w = W[index]
+    total = add.reduceat(w, starts)
+    heavy = total > 0
+    for value in coords:
+        mean = add.reduceat(w * value[index], starts)
+        value[survivors[heavy]] = mean[heavy] / total[heavy]
+    # Extensive parameters are summed up, merged individuals die as in
+    # `Individual.kill`, hence their state parameters become NaN.
+    for key in keys:
+        value = individual._get_attribute(key)
+        value[survivors] = add.reduceat(value[index], starts)
+    individual.kill(merged)
+    return len(merged)
+
+
+def split(individual, count, heavy=2.):
+    """
+    Splits the heaviest active individuals into two halves.
+
+    Individuals heavier than `heavy` times the mean weight, given by
+    the first extensive parameter, divide in equal parts (see
+    `Individual.divide`), hence daughters take the slots of dead
+    individuals or new ones if there are not enough of them.
+
+    Parameters
+    ----------
+    individual : Individual
+        Population of individuals.
+    count : int
+        Maximum number of individuals to split.
+    heavy : float, optional
+        Weight relative to the mean above which individuals are split.
+
+    Returns
+    -------
+    count : int
+        Number of individuals split.
+
+    """
+    keys = _check(individual)
+    index = individual.active()
+    if (count < 1) or (len(index) == 0):
+        return 0
+    w = individual._get_attribute(keys[0])[index]
+    candidates = flatnonzero(w > heavy * w.mean())
+    if len(candidates) > count:
+        candidates = candidates[argpartition(-w[candidates], count - 1)
+                                [:count]]
+    k = len(candidates)
+    if k == 0:
+        return 0
+    individual.divide(index[candidates])
+    return k
+
+
+def _check(individual):
+    """Returns extensive parameters of individuals to resample."""
+    if individual.members != 1:
+        raise ValueError('Ensembles cannot be resampled.')
+    keys = individual.extensive_parameters
+    if len(keys) == 0:
+        raise ValueError('Individuals have no extensive parameters.')
+    return keys
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class Resampler(object):
+    """
+    Super-individual resampling stage.
+
+    Keeps the number of active individuals near `budget`. Whenever it
+    is exceeded by more than `tolerance`, similar individuals are
+    merged (see `merge`), coarsening cells and ratio bins by a factor
+    of two until the budget is met or `levels` coarsenings were tried.
+    Whenever the number falls short of the budget by more than
+    `tolerance`, heavy individuals are split (see `split`). Both
+    operations conserve the totals of extensive parameters.
+
+    Parameters
+    ----------
+    budget : int
+        Target number of active individuals.
+    cell : float, array like, optional
+        Cell size along the x, y and z axes.
+    ratio : float, optional
+        Width of bins of ratios of extensive parameters.
+    heavy : float, optional
+        Weight relative to the mean above which individuals are split.
+    tolerance : float, optional
+        Relative deviation from the budget which is tolerated.
+    levels : int, optional
+        Maximum number of coarsenings.
+
+    """
+    def __init__(self, budget, cell=1., ratio=0.01, heavy=2., tolerance=0.1,
+                 levels=8):
+        self.budget = int(budget)
+        self.cell = cell
+        self.ratio = ratio
+        self.heavy = heavy
+        self.tolerance = tolerance
+        self.levels = int(levels)
+        # Counters
+        self.merged = 0
+        self.split = 0
+
+    def step(self, individual):
+        """Resamples individuals, returns change of their number."""
+        n = len(individual.active())
+        upper = self.budget * (1 + self.tolerance)
+        lower = self.budget * (1 - self.tolerance)
+        if n > upper:
+            cell = asarray(self.cell, dtype=float)
+            ratio = self.ratio
+            removed = 0
+            for level in range(self.levels):
+                removed += merge(individual, cell, ratio)
+                if n - removed <= upper:
+                    break
+                cell = 2 * cell
+                ratio = None if ratio is None else 2 * ratio
+            self.merged += removed
+            profiler.count('resampling.merged', removed)
+            return -removed
+        elif n < lower:
+            added = split(individual, self.budget - n, self.heavy)
+            self.split += added
+            profiler.count('resampling.split', added)
+            return added
+        return 0
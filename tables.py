@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for Lagrangian modelling.
+
+This module implements lookup tables of smooth response functions,
+evaluated by vectorized linear interpolation on uniform grids.
+
+Disclaimer
+----------
+This software may be used, copied, or redistributed as long as it is
+not sold and this copyright notice is reproduced on each copy made.
+This routine is provided as is without any express or implied
+warranties whatsoever.
+
+Author
+------
+Sebastian Krieger (sebastian.krieger@usp.br)
+
+Revision
+--------
+1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+from functools import partial
+
+from numpy import (abs as _abs, add, arange, arctanh, asarray, ceil, clip,
+                   concatenate, diff, empty, errstate, exp, float64, fmax,
+                   fmin, intp, linspace, log, maximum, multiply, subtract,
+                   take, tanh)
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+
+###############################################################################
+# CLASSES
+###############################################################################
+class Table(object):
+    """
+    Tabulated function of one variable.
+
+    The function is sampled on a uniform grid whose spacing h is chosen
+    such that the error of linear interpolation, bounded by
+    h**2 / 8 * max|f''|, does not exceed `tolerance`. The second
+    derivative is estimated from finite differences on a pilot grid,
+    hence `function` should be twice continuously differentiable on
+    the table range.
+
+    Parameters
+    ----------
+    function : callable
+        Vectorized function to tabulate.
+    lower, upper : float
+        Range of the table.
+    tolerance : float, optional
+        Maximum absolute interpolation error.
+    clamp : bool, optional
+        If set, arguments outside the table range take the value at the
+        nearest edge, e. g. for functions which are constant beyond
+        it. Otherwise they are evaluated exactly.
+    size : int, optional
+        Maximum number of nodes.
+
+    """
+    def __init__(self, function, lower, upper, tolerance=1e-6, clamp=False,
+                 size=2**20):
+        self.function = function
+        self.lower, self.upper = float(lower), float(upper)
+        self.clamp = clamp
+        # Estimates the maximum curvature on a pilot grid.
+        x = linspace(self.lower, self.upper, 1025)
+        h = x[1] - x[0]
+        curvature = _abs(diff(function(x), 2)).max() / h ** 2
+        if curvature > 0:
+            n = int(ceil((self.upper - self.lower) /
+                         (8 * tolerance / curvature) ** 0.5)) + 1
+        else:
+            n = 2
+        n = min(max(n, 2), size)
+        self.x = linspace(self.lower, self.upper, n)
+        self.y = asarray(function(self.x), dtype=float)
+        self.slope = diff(self.y)
+        self._scale = (n - 1) / (self.upper - self.lower)
+        # Value at the fractional node index u is slope[i] * u +
+        # intercept[i], where i = floor(u). The last node has its own
+        # entry, so that indices need no further clipping.
+        slope = concatenate((self.slope, [0.]))
+        self._slope = slope
+        self._intercept = self.y - slope * arange(n)
+        # Error bound of linear interpolation on the final grid.
+        self.error = curvature / (8 * self._scale ** 2)
+
+    def __len__(self):
+        return self.x.size
+
+    def __call__(self, x, out=None):
+        """
+        Evaluates tabulated function at `x`.
+
+        Parameters
+        ----------
+        x : float, array like
+            Arguments.
+        out : array like, optional
+            Array into which results are written.
+
+        """
+        x = asarray(x, dtype=float)
+        # Arguments outside the table are kept, since `out` may share
+        # memory with `x`. NaN arguments are not outside.
+        outside = None
+        if (not self.clamp) and (x.size > 0):
+            with errstate(invalid='ignore'):
+                if (fmin.reduce(x, axis=None) < self.lower) or \
+                        (fmax.reduce(x, axis=None) > self.upper):
+                    outside = (x < self.lower) | (x > self.upper)
+                    x_outside = x[outside]
+        u = empty(x.shape)
+        multiply(x, self._scale, out=u)
+        subtract(u, self.lower * self._scale, out=u)
+        clip(u, 0., self.x.size - 1, out=u)
+        i = u.astype(intp)
+        if (out is not None) and (out.dtype == float64) and \
+                (out.shape == x.shape):
+            result = out
+        else:
+            result = empty(x.shape)
+        # Indices of NaN arguments are undefined, but their results are
+        # NaN nonetheless.
+        take(self._slope, i, out=result, mode='clip')
+        multiply(result, u, out=result)
+        take(self._intercept, i, out=u, mode='clip')
+        add(result, u, out=result)
+        if outside is not None:
+            result[outside] = self.function(x_outside)
+        if (out is None) or (out is result):
+            return result
+        out[...] = result
+        return out
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def tanh_table(tolerance=1e-6):
+    """
+    Returns table of the hyperbolic tangent for non-negative arguments.
+    Half of `tolerance` is taken by interpolation, the other half by
+    clamping arguments where tanh differs from one by less than that.
+
+    """
+    try:
+        return _TANH[tolerance]
+    except KeyError:
+        table = _TANH[tolerance] = Table(tanh, 0.,
+                                         arctanh(1 - tolerance / 2),
+                                         tolerance / 2, clamp=True)
+        return table
+
+
+def decay_table(rate, threshold, tolerance=1e-6):
+    """
+    Returns table of exp(-rate * max(x - threshold, 0)), e. g. for
+    photoinhibition. As in `tanh_table`, arguments are clamped to the
+    range where the function differs from zero by more than half of
+    `tolerance`.
+
+    """
+    f = partial(_decay, rate, threshold)
+    if rate <= 0:
+        upper = threshold + 1.
+    else:
+        upper = threshold - log(tolerance / 2) / rate
+    return Table(f, threshold, upper, tolerance / 2, clamp=True)
+
+
+def exp_table(scale, rate, offset, lower, upper, tolerance=1e-6):
+    """
+    Returns table of scale * exp(rate * (x - offset)) on the range from
+    `lower` to `upper`, e. g. for temperature dependent growth rates.
+
+    """
+    return Table(partial(_exp, scale, rate, offset), lower, upper,
+                 tolerance)
+
+
+def _exp(scale, rate, offset, x):
+    return scale * exp(rate * (x - offset))
+
+
+def _decay(rate, threshold, x):
+    return exp(-rate * maximum(x - threshold, 0.))
+
+
+# Tables of the hyperbolic tangent, indexed by tolerance.
+_TANH = dict()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements benchmarks for history bookkeeping, growth
+kernels and environment sampling.
+
+Each case runs in its own process and reports the best time per call,
+the throughput in individuals per second and the peak resident memory
+increase (in kB). Results are written as JSON and can be compared with
+a stored baseline to flag regressions.
+
+Usage
+-----
+    python benchmark.py --sizes 1000 100000 --output result.json
+    python benchmark.py --compare baseline.json
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import argparse
+import json
+import platform
+import sys
+from multiprocessing import Process, Queue
+from resource import RUSAGE_SELF, getrusage
+from timeit import default_timer
+from traceback import format_exc
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import numpy
+from numpy import linspace, meshgrid, ones
+from numpy.random import RandomState
+
+import gaia
+
+import fixtures
+
+
+###############################################################################
+# CASES
+###############################################################################
+def plankton(n):
+    rand = RandomState(42).rand
+    return fixtures.plankton(t=0, x=rand(n), y=rand(n), z=50 * rand(n),
+                             P=1 + rand(n), N_P=0.3 * rand(n))
+
+
+def forcing(n):
+    rand = RandomState(1).rand
+    return 30 * rand(n), 80 * rand(n), rand(n), 1e-2 * rand(n)
+
+
+def append_history(n, nmax=None):
+    p = plankton(n)
+    kwargs = dict() if nmax is None else dict(nmax=nmax)
+
+    def run():
+        for i in range(100):
+            p.append_history(**kwargs)
+    return run, 100
+
+
+def history_query(n):
+    p = plankton(n)
+    for i in range(100):
+        p.append_history()
+
+    def run():
+        p.history(keys=['P', 'N_P'])
+        p.history()
+    return run, 1
+
+
+def history_trajectory(n):
+    p = plankton(n)
+    for i in range(100):
+        p.t += 1
+        p.append_history()
+
+    def run():
+        for i in range(100):
+            p.history(id=(i * n) // 100, keys=['x', 'y', 'z'], t=(20, 80))
+    return run, 100
+
+
+def mu(n):
+    p = plankton(n)
+    T, E_0, NO3, NH4 = forcing(n)
+    alpha = p.alpha()
+
+    def run():
+        p.mu(p.mu_mt(T), E_0, alpha)
+    return run, 1
+
+
+def rho(n):
+    p = plankton(n)
+    T, E_0, NO3, NH4 = forcing(n)
+
+    def run():
+        mu_mt = p.mu_mt(T)
+        p.rho_NO3(mu_mt, NO3, NH4)
+        p.rho_NH4(mu_mt, NH4)
+    return run, 1
+
+
+def growth(n, lookup=None):
+    p = plankton(n)
+    p.lookup = lookup
+    T, E_0, NO3, NH4 = forcing(n)
+    alpha = p.alpha()
+    out = p.growth(T, E_0, alpha, NO3, NH4)
+
+    def run():
+        p.growth(T, E_0, alpha, NO3, NH4, out=out)
+    return run, 1
+
+
+def environment_read(n):
+    t, z = linspace(0, 10, 11), linspace(0, 50, 26)
+    y = x = linspace(0, 1, 51)
+    T, Z, Y, X = meshgrid(t, z, y, x, indexing='ij')
+    env = gaia.models.GriddedEnvironment(t=t, z=z, y=y, x=x,
+                                         data=20 - Z / 5 + T + X * Y)
+    p = plankton(n)
+
+    def run():
+        env.read(5.5, p.z, p.y, p.x)
+    return run, 1
+
+
+CASES = [
+    ('append_history', append_history, dict()),
+    ('append_history_nmax', append_history, dict(nmax=10)),
+    ('history_query', history_query, dict()),
+    ('history_trajectory', history_trajectory, dict()),
+    ('mu', mu, dict()),
+    ('rho', rho, dict()),
+    ('growth', growth, dict()),
+    ('growth_lookup', growth, dict(lookup=1e-6)),
+    ('environment_read', environment_read, dict()),
+]
+
+
+###############################################################################
+# FUNCTIONS
+###############################################################################
+def measure(case, size, repeat, queue):
+    """
+    Runs one case and puts its result, or the traceback of its
+    failure, into `queue`.
+
+    """
+    name, setup, kwargs = case
+    try:
+        start = getrusage(RUSAGE_SELF).ru_maxrss
+        run, calls = setup(size, **kwargs)
+        best = float('inf')
+        for i in range(repeat):
+            tic = default_timer()
+            run()
+            best = min(best, (default_timer() - tic) / calls)
+        queue.put(dict(case=name, size=size, time=best,
+                       throughput=size / best,
+                       memory=getrusage(RUSAGE_SELF).ru_maxrss - start))
+    except Exception:
+        queue.put(dict(case=name, size=size, error=format_exc()))
+
+
+def collect(process, queue, case, size, poll=1.):
+    """
+    Returns result of benchmark process, or an error if it exits
+    without result, e. g. when it is killed.
+
+    """
+    while True:
+        try:
+            return queue.get(timeout=poll)
+        except Empty:
+            if not process.is_alive():
+                break
+    # The result may have been put right before the process exited.
+    try:
+        return queue.get(timeout=poll)
+    except Empty:
+        return dict(case=case, size=size, error='Process exited with '
+                    'code {0}.\n'.format(process.exitcode))
+
+
+def benchmark(sizes, repeat=3, cases=None):
+    """
+    Runs benchmark cases for every population size.
+
+    Returns
+    -------
+    results : dictionary
+        Environment description, list of results and list of failed
+        cases with their traceback.
+
+    """
+    results, failures = [], []
+    for case in CASES:
+        if (cases is not None) and (case[0] not in cases):
+            continue
+        for size in sizes:
+            queue = Queue()
+            process = Process(target=measure,
+                              args=(case, size, repeat, queue))
+            process.start()
+            result = collect(process, queue, case[0], size)
+            process.join()
+            if 'error' in result:
+                failures.append(result)
+                sys.stderr.write('{case:>20s} {size:>10d} failed\n{error}'
+                                 .format(**result))
+                continue
+            results.append(result)
+            sys.stderr.write('{case:>20s} {size:>10d} {time:12.6f} s '
+                             '{throughput:12.4g} 1/s {memory:10d} kB\n'
+                             .format(**result))
+    return dict(python=platform.python_version(),
+                numpy=numpy.__version__, machine=platform.machine(),
+                results=results, failures=failures)
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compares results with baseline.
+
+    Returns
+    -------
+    regressions : list
+        Results whose time per call is more than `threshold` larger
+        than in the baseline, with the baseline time and ratio.
+
+    """
+    reference = dict(((item['case'], item['size']), item) for item in
+                     baseline['results'])
+    regressions = []
+    for item in results['results']:
+        before = reference.get((item['case'], item['size']))
+        if before is None:
+            continue
+        ratio = item['time'] / before['time']
+        if ratio > 1 + threshold:
+            regressions.append(dict(item, baseline=before['time'],
+                                    ratio=ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gaia benchmarks.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000, 1000000],
+                        help='Population sizes.')
+    parser.add_argument('--cases', nargs='+', default=None,
+                        help='Cases to run, all by default.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of repetitions of each case.')
+    parser.add_argument('--output', default=None,
+                        help='File to write JSON results to.')
+    parser.add_argument('--compare', default=None,
+                        help='JSON baseline to compare results with.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative slow down flagged as regression.')
+    args = parser.parse_args()
+    #
+    results = benchmark(args.sizes, repeat=args.repeat, cases=args.cases)
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    #
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for item in regressions:
+            sys.stderr.write('Regression: {case} ({size}) {time:.6f} s, '
+                             'baseline {baseline:.6f} s ({ratio:.2f}x)\n'
+                             .format(**item))
+        if regressions:
+            sys.exit(1)
+    if results['failures']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements fixtures shared by tests and benchmarks.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import gaia
+
+# Growth parameters of plankton fixtures.
+PLANKTON = dict(C_Chla=6., r=0.1, mu_m=0.58, E_0_cp=1.0, E_0_inb=40,
+                d_r=0.1, phi_m=0.0833, Q_m_N=0.29, K_Q_N=0.18, K_s_NO3=0.1,
+                K_s_NH4=0.05, Psi=1000., gamma=0.1)
+
+
+def plankton_args(**kwargs):
+    """
+    Returns keyword arguments of plankton, i. e. the growth parameters
+    of `PLANKTON` updated by `kwargs`, e. g. positions and biomass.
+
+    """
+    return dict(PLANKTON, **kwargs)
+
+
+def plankton(**kwargs):
+    """Returns plankton with arguments given by `plankton_args`."""
+    return gaia.individuals.Plankton(**plankton_args(**kwargs))
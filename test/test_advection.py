@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for the advection of individuals.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import unittest
+
+from numpy import cos, linspace, meshgrid, ones, pi, sin, zeros
+from numpy.testing import assert_allclose
+
+import gaia
+
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        n = 7
+        self.individual = gaia.individuals.Individual(t=0,
+            x=linspace(0.1, 1, n), y=zeros(n), z=ones(n),
+            domain=(None, None, None, None, 0, 10))
+        self.individual.set_state_parameters(['t', 'x', 'y', 'z'])
+        self.individual.in_domain = ones(n, dtype=bool)
+
+
+    def test_advection_rotation(self):
+        # Solid body rotation, u = -y, v = x.
+        x = y = linspace(-2, 2, 41)
+        X, Y = meshgrid(x, y, indexing='xy')
+        args = dict(t=[0.], z=[0.], y=y, x=x)
+        environments = dict(
+            u=gaia.models.GriddedEnvironment(data=-Y[None, None], **args),
+            v=gaia.models.GriddedEnvironment(data=X[None, None], **args),
+            w=0.)
+        r = self.individual.x.copy()
+        advection = gaia.advection.Advection(chunk=3)
+        dt = pi / 50
+        for i in range(25):
+            advection.step(self.individual, i * dt, dt, environments)
+        # Linear interpolation of linear fields is exact, hence errors are
+        # due to time stepping only.
+        assert_allclose(self.individual.x, r * cos(pi / 2), atol=1e-6)
+        assert_allclose(self.individual.y, r * sin(pi / 2), atol=1e-6)
+
+
+    def test_advection_domain(self):
+        environments = dict(u=0., v=0., w=1.)
+        advection = gaia.advection.Advection()
+        model = gaia.models.Model(t=0., dt=1.)
+        self.individual.z = linspace(0, 9, 7)
+        model.run(3., self.individual, environments, advection=advection)
+        self.assertEqual(list(self.individual.in_domain),
+                         [True] * 5 + [False] * 2)
+        # Individuals stop once they leave the domain.
+        self.assertTrue((self.individual.z <= 11).all())
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
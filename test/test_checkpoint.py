@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for checkpoints of models.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import json
+import unittest
+from os.path import exists, getmtime, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from warnings import catch_warnings, simplefilter
+
+from numpy import linspace, ones
+from numpy.testing import assert_allclose, assert_array_equal
+
+import gaia
+
+import fixtures
+
+
+def plankton():
+    return fixtures.plankton(t=0, x=linspace(1, 2, 5), y=linspace(1, 2, 5),
+                             z=0, P=ones(5), N_P=0.2 * ones(5))
+
+
+def header(path):
+    with open(join(path, gaia.checkpoint.HEADER)) as f:
+        return json.load(f)
+
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        self.environments = dict(T=20., E_0=30., NO3=0.5, NH4=1e-3)
+
+
+    def tearDown(self):
+        rmtree(self.path)
+
+
+    def test_checkpoint_restart(self):
+        reference = plankton()
+        model = gaia.models.Model(t=0., dt=0.1, scheme='rk4')
+        model.run(2., reference, self.environments)
+        #
+        population = plankton()
+        model = gaia.models.Model(t=0., dt=0.1, scheme='rk4')
+        model.run(1., population, self.environments, nmax=4)
+        gaia.checkpoint.save(self.path, model, [population])
+        model, (restored, ) = gaia.checkpoint.load(self.path)
+        self.assertTrue(isinstance(restored, gaia.individuals.Plankton))
+        self.assertAlmostEqual(model.t, 1.)
+        self.assertEqual(model.scheme, 'rk4')
+        assert_array_equal(restored.P, population.P)
+        assert_array_equal(restored.history()['P'],
+                           population.history()['P'])
+        model.run(2., restored, self.environments)
+        assert_array_equal(restored.P, reference.P)
+        assert_array_equal(restored.history()['N_P'][-10:],
+                           reference.history()['N_P'][-10:])
+
+
+    def test_checkpoint_incremental(self):
+        population = plankton()
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1., population, self.environments)
+        gaia.checkpoint.save(self.path, model, [population])
+        files = header(self.path)['populations'][0]
+        mask = join(self.path, files['arrays']['in_domain']['file'])
+        mtime = getmtime(mask)
+        model.run(2., population, self.environments)
+        gaia.checkpoint.save(self.path, model, [population])
+        # Unchanged arrays are not written again, changed ones are
+        # written to new files and the old ones removed.
+        self.assertEqual(getmtime(mask), mtime)
+        after = header(self.path)['populations'][0]
+        for key, value in after['history'].items():
+            self.assertEqual(value['file'], files['history'][key]['file'])
+        self.assertFalse(exists(join(self.path,
+                                     files['population']['file'])))
+        model, (restored, ) = gaia.checkpoint.load(self.path)
+        assert_array_equal(restored.P, population.P)
+        H = restored.history()
+        self.assertEqual(H['P'].shape, (21, 5))
+        assert_array_equal(H['P'], population.history()['P'])
+        # Only new items of compressed history are read when saving.
+        population.compress_history(chunk=4, cache=1)
+        gaia.checkpoint.save(self.path, model, [population])
+        model.run(2.2, population, self.environments)
+        record = population._attributes['history'].record('P')
+        record._cache.clear()
+        gaia.checkpoint.save(self.path, model, [population])
+        self.assertEqual(len(record._cache), 0)
+        model, (restored, ) = gaia.checkpoint.load(self.path)
+        assert_array_equal(restored.history()['P'],
+                           population.history()['P'])
+
+
+    def test_checkpoint_recording(self):
+        def recording(population):
+            population.set_recording(P=gaia.history.Every(5),
+                                     x=gaia.history.OnChange(0.),
+                                     N_P=gaia.history.Aggregate(
+                                         gaia.history.Interval(0.5)))
+            return population
+        reference = recording(plankton())
+        gaia.models.Model(t=0., dt=0.1).run(2., reference,
+                                            self.environments)
+        population = recording(plankton())
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1.2, population, self.environments)
+        gaia.checkpoint.save(self.path, model, [population])
+        model, (restored, ) = gaia.checkpoint.load(self.path)
+        model.run(2., restored, self.environments)
+        H, expected = restored.history(), reference.history()
+        self.assertEqual(sorted(H.keys()), sorted(expected.keys()))
+        for key in expected:
+            assert_allclose(H[key], expected[key], rtol=1e-12)
+        assert_array_equal(restored.history(t=(1.4, 2.))['P'],
+                           reference.history(t=(1.4, 2.))['P'])
+        self.assertEqual(len(H['P']), 5)
+
+
+    def test_checkpoint_interrupted(self):
+        population = plankton()
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1., population, self.environments)
+        gaia.checkpoint.save(self.path, model, [population])
+        P, H = population.P.copy(), population.history()['P'].copy()
+        model.run(2., population, self.environments)
+        # Saving fails before the header is replaced.
+        rename = gaia.checkpoint.rename
+        def fail(src, dst):
+            raise OSError('Interrupted.')
+        gaia.checkpoint.rename = fail
+        try:
+            self.assertRaises(OSError, gaia.checkpoint.save, self.path,
+                              model, [population])
+        finally:
+            gaia.checkpoint.rename = rename
+        model, (restored, ) = gaia.checkpoint.load(self.path)
+        self.assertAlmostEqual(model.t, 1.)
+        assert_array_equal(restored.P, P)
+        assert_array_equal(restored.history()['P'], H)
+        # Attributes which cannot be saved are reported.
+        population.executor = gaia.parallel.ThreadExecutor(workers=1)
+        with catch_warnings(record=True) as warnings:
+            simplefilter('always')
+            gaia.checkpoint.save(self.path, model, [population])
+        self.assertTrue(any('executor' in str(item.message)
+                            for item in warnings))
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for the history storage backend.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import unittest
+
+from numpy import arange, array, cos, isnan, linspace, nan, sin
+from numpy.testing import assert_allclose, assert_array_equal
+
+import gaia
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        self.record = gaia.history.Record(capacity=2)
+
+
+    def test_record_grows(self):
+        for i in range(10):
+            self.record.append([i, 2 * i])
+        self.assertEqual(len(self.record), 10)
+        assert_array_equal(self.record.view()[:, 0], arange(10))
+        assert_array_equal(self.record.view()[:, 1], 2 * arange(10))
+
+
+    def test_record_view_is_not_copy(self):
+        for i in range(3):
+            self.record.append(i)
+        H = self.record.view()
+        H[0] = 42
+        self.assertEqual(self.record.view()[0], 42)
+
+
+    def test_record_circular(self):
+        for i in range(10):
+            self.record.append(i, nmax=4)
+        self.assertEqual(len(self.record), 4)
+        assert_array_equal(self.record.view(), [6, 7, 8, 9])
+
+
+    def test_record_nmax_reduced(self):
+        for i in range(10):
+            self.record.append(i)
+        for i in range(10, 13):
+            self.record.append(i, nmax=4)
+        self.assertEqual(len(self.record), 4)
+        assert_array_equal(self.record.view(), [9, 10, 11, 12])
+
+
+    def test_record_upcast(self):
+        self.record.append(1)
+        self.record.append(1.5)
+        assert_array_equal(self.record.view(), [1., 1.5])
+
+
+    def test_record_shape_mismatch(self):
+        self.record.append([1, 2])
+        self.assertRaises(ValueError, self.record.append, [1, 2, 3])
+
+
+    def test_record_resize(self):
+        self.record.append([1., 2.])
+        self.record.resize(5)
+        self.record.append([3., 4., 5., 6., 7.])
+        self.record.append([8., 9., 10., 11., 12.])
+        H = self.record.view()
+        self.assertEqual(H.shape, (3, 5))
+        assert_array_equal(H[0], [1., 2., nan, nan, nan])
+        assert_array_equal(H[2], [8., 9., 10., 11., 12.])
+        self.assertRaises(ValueError, self.record.append, [1., 2.])
+
+
+    def test_record_select(self):
+        for i in range(6):
+            self.record.append(10 * i + arange(4), nmax=5)
+        # The circular buffer has wrapped around.
+        assert_array_equal(self.record.select(1, 3, index=2), [22, 32])
+        assert_array_equal(self.record.select(index=[0, 3])[:, 1],
+                           [13, 23, 33, 43, 53])
+        record = gaia.history.Record()
+        for i in range(6):
+            record.append(10 * i + arange(4))
+        column = record.select(2, None, index=1)
+        assert_array_equal(column, [21, 31, 41, 51])
+        self.assertTrue(column.base is not None)
+
+
+    def test_compressed_record(self):
+        record = gaia.history.CompressedRecord(chunk=4, cache=1)
+        reference = gaia.history.Record()
+        for i in range(10):
+            value = sin(0.1 * i + arange(3.))
+            record.append(value)
+            reference.append(value)
+        self.assertEqual(len(record), 10)
+        assert_array_equal(record.view(), reference.view())
+        assert_array_equal(record.select(3, 9, index=[2, 0]),
+                           reference.select(3, 9, index=[2, 0]))
+        # Items which are not compressed yet are views.
+        self.assertTrue(record.select(8).base is not None)
+        # Discarded items, resizing and promotion.
+        record.append(arange(3), nmax=6)
+        reference.append(arange(3), nmax=6)
+        self.assertEqual(len(record), 6)
+        record.resize(4)
+        reference.resize(4)
+        assert_array_equal(record.view(), reference.view())
+        self.assertRaises(ValueError, record.append, [1., 2.])
+        for i in range(3):
+            record.append([i, 2 * i, 3 * i, 4 * i], nmax=6)
+            reference.append([i, 2 * i, 3 * i, 4 * i], nmax=6)
+        assert_array_equal(record.view(), reference.view())
+        # Shrinking and growing again does not bring back old entries.
+        record = gaia.history.CompressedRecord(chunk=2)
+        reference = gaia.history.Record()
+        for i in range(3):
+            record.append(arange(5.) + i)
+            reference.append(arange(5.) + i)
+        for width, fill in [(3, None), (5, None), (4, -1.), (6, None)]:
+            record.resize(width, fill)
+            reference.resize(width, fill)
+            record.append(arange(width))
+            reference.append(arange(width))
+            assert_array_equal(record.view(), reference.view())
+        self.assertTrue(isnan(record.view()[0, 3]))
+        self.assertEqual(len(record), 7)
+        record = gaia.history.CompressedRecord(chunk=2)
+        for i in range(5):
+            record.append(i * 1000)
+        assert_array_equal(record.view(), 1000 * arange(5))
+        self.assertEqual(record.total, 5)
+
+
+    def test_compressed_history(self):
+        H = gaia.history.History()
+        t = linspace(0, 100, 4096)
+        for i in range(t.size):
+            H.append('time', t[i])
+            H.append('x', cos(0.01 * t[i]) + arange(8.))
+            H.append('z', [0.] * 8)
+        expected = H.asdict()
+        nbytes = H.nbytes
+        H.compress(chunk=512)
+        self.assertTrue(H.nbytes < nbytes / 5)
+        result = H.query(keys=['x'], ids=3, t=(10., 20.))
+        mask = (t >= 10.) & (t <= 20.)
+        assert_array_equal(result['x'], expected['x'][mask, 3])
+        for key, value in expected.items():
+            assert_array_equal(H[key], value)
+        H.compress(None)
+        assert_array_equal(H['x'], expected['x'])
+
+
+    def test_history_query(self):
+        H = gaia.history.History()
+        for i in range(10):
+            H.append('time', 0.5 * i)
+            H.append('x', i + arange(3.))
+        result = H.query(keys=['x'], ids=1, t=(1., 2.))
+        assert_array_equal(result['x'], [3., 4., 5.])
+        result = H.query(ids=set([2, 0]), t=(None, 0.5))
+        assert_array_equal(result['x'], [[0., 2.], [1., 3.]])
+        assert_array_equal(result['time'], [0., 0.5])
+        self.assertRaises(ValueError, gaia.history.History().query,
+                          t=(0., 1.))
+
+
+    def test_recording_policies(self):
+        H = gaia.history.History()
+        H.policy('a', gaia.history.Every(3))
+        H.policy('b', gaia.history.Interval(1.))
+        H.policy('c', gaia.history.OnChange(0.5))
+        H.policy('d', gaia.history.Aggregate(gaia.history.Every(2)))
+        for i in range(7):
+            time = 0.4 * i
+            H.append('time', time)
+            for key in 'abcd':
+                H.append(key, array([i, i // 3], dtype=float), time=time)
+        assert_array_equal(H['a'][:, 0], [0, 3, 6])
+        assert_allclose(H['a.time'], [0., 1.2, 2.4])
+        assert_allclose(H['b.time'], [0., 1.2, 2.4])
+        assert_array_equal(H['c'][:, 0], [0, 1, 2, 3, 4, 5, 6])
+        assert_array_equal(H['d.min'][:, 0], [0, 1, 3, 5])
+        assert_array_equal(H['d.max'][:, 0], [0, 2, 4, 6])
+        assert_array_equal(H['d.mean'][:, 0], [0, 1.5, 3.5, 5.5])
+        # Queries use the times of each variable.
+        result = H.query(t=(1., 2.))
+        assert_array_equal(result['a'][:, 0], [3])
+        assert_allclose(result['time'], [1.2, 1.6, 2.])
+        H.policy('c', gaia.history.OnChange(1.5))
+        for i in range(3):
+            H.append('c', array([7., 2.]), time=3.)
+        self.assertEqual(len(H['c']), 8)
+        self.assertRaises(ValueError, H.append, 'b', 0.)
+
+
+    def test_individual_history(self):
+        individual = gaia.individuals.Individual(t=array([0.]),
+                                                 x=array([1., 2.]))
+        individual.set_state_parameters(['t', 'x'])
+        for i in range(5):
+            individual.t = array([i])
+            individual.append_history(nmax=3)
+        H = individual.history()
+        assert_array_equal(H['t'][:, 0], [2, 3, 4])
+        # Time is only recorded if given, or once queried by time.
+        self.assertFalse('time' in H)
+        self.assertEqual(H['x'].shape, (3, 2))
+        assert_array_equal(individual.history(id=1, keys='x')['x'],
+                           [2., 2., 2.])
+        H = individual.history(id=0, t=(3, None))
+        assert_array_equal(H['t'], [3, 4])
+        individual.t = array([5])
+        individual.append_history(nmax=3, time=4.5)
+        assert_array_equal(individual.history()['time'], [3, 4, 4.5])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,8 +20,14 @@ __version__ = '$Revision: 1 $'
 
 import unittest
 
+from numpy import arange, array, empty, isnan, zeros
+from numpy.random import rand
+from numpy.testing import assert_allclose, assert_array_equal
+
 import gaia
 
+import fixtures
+
 class TestData(unittest.TestCase):
     def setUp(self):
         args = dict(t=0, x=-45.71605, y=-23.77226, z=0)
@@ -75,7 +81,95 @@ class TestData(unittest.TestCase):
 
     def test_plankton_mu_mt(self):
         self.assertEqual(self.plankton.mu_mt(27.), self.plankton.mu_m)
-    
+
+    def test_plankton_growth(self):
+        n = 50
+        plankton = fixtures.plankton(t=0, x=rand(n), y=rand(n), z=rand(n),
+                                     P=1 + rand(n), N_P=0.3 * rand(n))
+        T, E_0, NO3, NH4 = 30 * rand(n), 80 * rand(n), rand(n), rand(n)
+        alpha = plankton.alpha()
+        mask = rand(n) > 0.3
+        mu_mt = plankton.mu_mt(T)
+        out = empty((5, n))
+        result = plankton.growth(T, E_0, alpha, NO3, NH4, mask=mask, out=out)
+        self.assertTrue(result is out)
+        for a, b in zip(out[:3], plankton.mu(mu_mt, E_0, alpha, mask)):
+            assert_allclose(a, b, atol=1e-12)
+        assert_allclose(out[3], plankton.rho_NO3(mu_mt, NO3, NH4) * mask,
+                        atol=1e-12)
+        assert_allclose(out[4], plankton.rho_NH4(mu_mt, NH4) * mask,
+                        atol=1e-12)
+        # Sparse masks are evaluated on compacted arrays.
+        mask = rand(n) > 0.9
+        index = mask.nonzero()[0]
+        expected = plankton.growth(T, E_0, alpha, NO3, NH4).copy() * mask
+        assert_allclose(plankton.growth(T, E_0, alpha, NO3, NH4, mask=mask),
+                        expected)
+        assert_allclose(plankton.growth(T, E_0, alpha, NO3, NH4,
+                                        mask=index), expected)
+        # Dense indices are kept without building a mask.
+        mask = rand(n) > 0.1
+        expected = plankton.growth(T, E_0, alpha, NO3, NH4).copy() * mask
+        assert_allclose(plankton.growth(T, E_0, alpha, NO3, NH4,
+                                        mask=mask.nonzero()[0]), expected)
+
+    def test_plankton_active(self):
+        plankton = fixtures.plankton(t=0, x=arange(1., 5.), y=1., z=0.,
+                                     P=1., N_P=0.2)
+        assert_array_equal(plankton.active(), [0, 1, 2, 3])
+        plankton.alive = array([True, False, True, True])
+        plankton.in_domain = array([True, True, True, False])
+        assert_array_equal(plankton.active(), [0, 2])
+        out = empty((2, 4))
+        plankton.tendency(0., dict(T=20., E_0=30., NO3=0.5, NH4=1e-3), out)
+        self.assertTrue((out[:, [1, 3]] == 0).all())
+        self.assertTrue((out[:, [0, 2]] != 0).all())
+
+
+    def test_plankton_birth_and_death(self):
+        plankton = fixtures.plankton(t=0, x=arange(1., 5.), y=1., z=0.,
+                                     P=1., N_P=0.2, birthday=zeros(4))
+        ids = plankton.spawn(2, x=[5., 6.], y=1., z=0., P=2., N_P=0.4,
+                             birthday=1.)
+        assert_array_equal(ids, [4, 5])
+        assert_array_equal(plankton.id, arange(6))
+        assert_array_equal(plankton.birthday, [0, 0, 0, 0, 1, 1])
+        assert_array_equal(plankton.active(), arange(6))
+        plankton.append_history()
+        plankton.kill([1, 4])
+        assert_array_equal(plankton.active(), [0, 2, 3, 5])
+        self.assertTrue(isnan(plankton.P[[1, 4]]).all())
+        plankton.append_history()
+        # Freed ids are reused before storage grows.
+        assert_array_equal(plankton.divide([5], fraction=0.25), [1])
+        assert_array_equal(plankton.P[[1, 5]], [0.5, 1.5])
+        self.assertEqual(plankton.x[1], 6.)
+        self.assertEqual(plankton.id[1], 1)
+        assert_array_equal(plankton.spawn(), [4])
+        self.assertEqual(plankton.size(), 6)
+        plankton.append_history()
+        # History is aligned to ids.
+        H = plankton.history()['P']
+        self.assertEqual(H.shape, (4, 6))
+        self.assertTrue(isnan(H[0, 4:]).all())
+        assert_array_equal(H[2:, 5], [2., 1.5])
+        self.assertTrue(isnan(H[2, 1]))
+        self.assertEqual(H[3, 1], 0.5)
+        # Kill and spawn only touch the individuals involved, storage
+        # and the cached active set are not built again.
+        ids, mask = plankton.id, plankton.active(mask=True)
+        plankton.kill([2])
+        self.assertTrue(plankton.active(mask=True) is mask)
+        self.assertFalse(mask[2])
+        assert_array_equal(plankton.spawn(), [2])
+        self.assertTrue(plankton.id is ids)
+        self.assertTrue(plankton.active()[2] == 2)
+        # Storage grows by doubling.
+        for i in range(100):
+            plankton.spawn()
+        self.assertEqual(plankton.size(), 106)
+        self.assertEqual(plankton.population.capacity, 128)
+
 
 def main():
     unittest.main()
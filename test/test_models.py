@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for models and environments.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import pickle
+import unittest
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event
+
+from numpy import (array, exp, isnan, linspace, memmap, meshgrid, nan, ones,
+                   save, zeros)
+from numpy.random import rand
+from numpy.testing import assert_allclose
+
+import gaia
+
+import fixtures
+
+
+class Decay(gaia.individuals.Individual):
+    """Individuals whose biomass decays exponentially."""
+    prognostic_parameters = ['P']
+
+    def tendency(self, t, environments, out, rates=None):
+        out[0] = -environments['k'] * self.P
+        if rates is not None:
+            rates[0] = -environments['k']
+        return out
+
+    @property
+    def P(self):
+        """Biomass."""
+        return self._get_attribute('P')
+
+    @P.setter
+    def P(self, a):
+        self._set_attribute('P', a)
+
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        self.individual = Decay(t=0, P=linspace(1, 2, 5))
+        self.individual.set_state_parameters(['t', 'P'])
+        self.individual.append_history()
+        self.plankton_args = fixtures.plankton_args(t=0,
+            x=linspace(1, 2, 4), y=linspace(1, 2, 4), z=0, P=ones(4),
+            N_P=0.2 * ones(4))
+        self.plankton = gaia.individuals.Plankton(**self.plankton_args)
+        self.environments = dict(k=0.5, T=20., E_0=30., NO3=0.5, NH4=1e-3)
+
+
+    def test_model_run_schemes(self):
+        P0 = self.individual.P.copy()
+        for scheme, rtol in [('euler', 1e-2), ('rk2', 1e-4), ('rk4', 1e-8)]:
+            self.individual.P = P0
+            self.individual.t = 0
+            model = gaia.models.Model(t=0., dt=0.01)
+            model.run(1., self.individual, self.environments, scheme=scheme)
+            self.assertAlmostEqual(model.t, 1.)
+            assert_allclose(self.individual.t, 1.)
+            assert_allclose(self.individual.P, P0 * exp(-0.5), rtol=rtol)
+
+
+    def test_model_run_adaptive(self):
+        P0 = self.individual.P.copy()
+        results = []
+        for block in [2, 4096]:
+            self.individual.P = P0
+            integrator = gaia.models.RK23(rtol=1e-8, atol=1e-12, block=block)
+            model = gaia.models.Model(t=0., dt=1.)
+            model.run(2., self.individual, self.environments,
+                      scheme=integrator)
+            assert_allclose(self.individual.P, P0 * exp(-1.), rtol=1e-6)
+            self.assertTrue(integrator.accepted > 2)
+            results.append(self.individual.P.copy())
+            if block == 2:
+                # Blocks are kept between model runs.
+                subsets = self.individual._attributes['_subsets'][2]
+                before = [subsets[key] for key in sorted(subsets)]
+                self.assertEqual(len(before), 3)
+                model.run(3., self.individual, self.environments,
+                          scheme=integrator)
+                after = [subsets[key] for key in sorted(subsets)]
+                self.assertTrue(all(a is b for a, b in zip(before, after)))
+        assert_allclose(results[0], results[1], rtol=1e-12)
+        # Stiff plankton uptake with large steps.
+        reference = gaia.individuals.Plankton(**self.plankton_args)
+        gaia.models.Model(t=0., dt=0.01).run(1., reference,
+                                             self.environments, scheme='rk4')
+        model = gaia.models.Model(t=0., dt=0.5)
+        model.run(1., self.plankton, self.environments, scheme='rk23')
+        assert_allclose(self.plankton.P, reference.P, rtol=1e-5)
+        assert_allclose(self.plankton.N_P, reference.N_P, rtol=1e-5)
+        self.assertEqual(self.plankton.history()['P'].shape, (3, 4))
+
+
+    def test_model_run_exponential(self):
+        # Linear decay is integrated exactly at any time step.
+        P0 = self.individual.P.copy()
+        model = gaia.models.Model(t=0., dt=10.)
+        model.run(20., self.individual, self.environments,
+                  scheme='exponential')
+        assert_allclose(self.individual.P, P0 * exp(-10.), rtol=1e-12)
+        model = gaia.models.Model(t=0., dt=0.1)
+        P0 = self.plankton.P.copy()
+        model.run(1., self.plankton, self.environments, scheme='exponential')
+        self.assertTrue((self.plankton.P > P0).all())
+        self.assertTrue((self.plankton.N_P > 0).all())
+
+
+    def test_model_run_output(self):
+        model = gaia.models.Model(t=0., dt=0.1, scheme='rk4', output=0.25)
+        model.run(1., self.individual, self.environments)
+        H = self.individual.history()
+        assert_allclose(H['t'][:, 0], [0, 0.3, 0.5, 0.8, 1.0])
+
+
+    def test_model_run_plankton(self):
+        model = gaia.models.Model(t=0., dt=0.1)
+        P0 = self.plankton.P.copy()
+        model.run(1., [self.plankton], self.environments, scheme='rk4')
+        self.assertTrue((self.plankton.P > P0).all())
+        self.assertEqual(self.plankton.history()['P'].shape, (11, 4))
+        # Individuals at the origin are inside the domain as well.
+        origin = gaia.individuals.Plankton(**dict(self.plankton_args,
+                                                  x=zeros(4), y=zeros(4)))
+        self.assertTrue(origin.in_domain.all())
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1., origin, self.environments, scheme='rk4')
+        self.assertTrue((origin.P > 1).all())
+
+
+    def test_model_run_killed(self):
+        # Dead individuals have NaN positions, which read NaN from
+        # gridded environments instead of invalid cells.
+        t, z, y = linspace(0, 2, 3), array([0., 1., 5., 10.]), [0., 3.]
+        T = gaia.models.GriddedEnvironment(t=t, z=z, y=y, x=y,
+            data=20 + meshgrid(t, z, y, y, indexing='ij')[1])
+        args = dict(self.plankton_args, z=linspace(0, 5, 4))
+        reference = gaia.individuals.Plankton(**args)
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1., reference, dict(self.environments, T=T))
+        for environments in [dict(self.environments, T=T),
+                             gaia.models.EnvironmentGroup(
+                                 dict(self.environments, T=T))]:
+            individual = gaia.individuals.Plankton(**args)
+            individual.kill([1])
+            model = gaia.models.Model(t=0., dt=0.1)
+            model.run(1., individual, environments)
+            self.assertTrue(isnan(individual.P[1]))
+            assert_allclose(individual.P[[0, 2, 3]], reference.P[[0, 2, 3]])
+        self.assertTrue(isnan(T.read(0.5, nan, nan, nan)).all())
+
+
+    def test_model_run_recording(self):
+        self.plankton.set_recording(P=gaia.history.Every(5),
+                                    x=gaia.history.OnChange(0.),
+                                    N_P=gaia.history.Aggregate(
+                                        gaia.history.Interval(0.5)))
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1., [self.plankton], self.environments, scheme='rk4')
+        H = self.plankton.history()
+        self.assertEqual(H['z'].shape, (11, 4))
+        self.assertEqual(H['P'].shape, (3, 4))
+        assert_allclose(H['P.time'], [0., 0.1, 0.6])
+        # Positions do not change, only the first item after setting the
+        # policy is recorded.
+        self.assertEqual(H['x'].shape, (2, 4))
+        assert_allclose(H['x.time'], [0., 0.1])
+        assert_allclose(H['N_P.time'], [0.1, 0.6])
+        self.assertTrue((H['N_P.min'] <= H['N_P.mean']).all())
+        assert_allclose(self.plankton.history(t=(0.4, 0.7))['P.time'],
+                        [0.6])
+
+
+    def test_model_run_float32(self):
+        reference = self.plankton
+        single = gaia.individuals.Plankton(**dict(self.plankton_args,
+                                                  dtype='float32'))
+        self.assertEqual(single.P.dtype, 'float32')
+        t, z = linspace(0, 2, 3), linspace(0, 10, 3)
+        T = gaia.models.GriddedEnvironment(t=t, z=z,
+            data=20 + 0 * meshgrid(t, z, [0], [0], indexing='ij')[0],
+            dtype='float32')
+        self.assertEqual(T.read(0.5, single.z, 0, 0).dtype, 'float32')
+        environments = dict(self.environments, T=T)
+        for individual in [reference, single]:
+            model = gaia.models.Model(t=0., dt=0.1)
+            model.run(1., individual, environments, scheme='rk4')
+        self.assertEqual(single.P.dtype, 'float32')
+        self.assertEqual(single.history()['P'].dtype, 'float32')
+        self.assertEqual(single._attributes['_workspace'].dtype, 'float32')
+        assert_allclose(single.P, reference.P, rtol=1e-5)
+        single.dtype = 'float64'
+        self.assertEqual(single.N_P.dtype, 'float64')
+
+
+    def test_model_run_ensemble(self):
+        def plankton(**kwargs):
+            return gaia.individuals.Plankton(**dict(self.plankton_args,
+                                                    **kwargs))
+        mu_m, K_Q_N = [0.4, 0.5, 0.6], [0.15, 0.18, 0.2]
+        ensemble = plankton()
+        ensemble.set_ensemble(mu_m=mu_m, K_Q_N=K_Q_N)
+        self.assertEqual(ensemble.members, 3)
+        self.assertEqual(ensemble.P.shape, (3, 4))
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1., ensemble, self.environments, scheme='rk4')
+        for k in range(3):
+            member = plankton(mu_m=mu_m[k], K_Q_N=K_Q_N[k])
+            model = gaia.models.Model(t=0., dt=0.1)
+            model.run(1., member, self.environments, scheme='rk4')
+            assert_allclose(ensemble.P[k], member.P, rtol=1e-12)
+            assert_allclose(ensemble.history(member=k)['N_P'],
+                            member.history()['N_P'], rtol=1e-12)
+        # Extra values are not expanded for the ensemble, hence they
+        # are returned as recorded.
+        ensemble.append_history(extra=dict(light=ones((2, 4))))
+        H = ensemble.history(member=1, keys=['P', 'light'])
+        self.assertEqual(H['P'].shape, (12, 4))
+        self.assertEqual(H['light'].shape, (1, 2, 4))
+
+
+    def test_model_profiler(self):
+        profiler = gaia.base.profiler
+        profiler.enabled = True
+        profiler.reset()
+        try:
+            t = linspace(0, 1, 3)
+            environments = dict(self.environments)
+            environments['T'] = gaia.models.GriddedEnvironment(t=t,
+                data=20 + t.reshape(3, 1, 1, 1), cache=2)
+            model = gaia.models.Model(t=0., dt=0.1)
+            model.run(1., self.plankton, environments, scheme='rk2')
+        finally:
+            profiler.enabled = False
+        summary = profiler.summary()
+        self.assertEqual(len(profiler.records), 10)
+        self.assertEqual(summary['integration']['calls'], 10)
+        self.assertEqual(summary['growth']['calls'], 20)
+        self.assertEqual(summary['history']['calls'], 10)
+        self.assertTrue(summary['cache.hits'] > 0)
+        self.assertTrue('environment' in profiler.records[0])
+        self.assertTrue('growth' in profiler.report())
+        profiler.reset()
+        model.run(2., self.plankton, environments)
+        self.assertEqual(profiler.summary(), dict())
+
+
+    def test_gridded_environment_read(self):
+        # Linear fields are reproduced exactly by quadrilinear
+        # interpolation.
+        t, z = linspace(0, 10, 11), array([0., 5., 20., 50.])
+        y, x = linspace(10, -10, 21), linspace(0, 1, 6)
+        T, Z, Y, X = meshgrid(t, z, y, x, indexing='ij')
+        env = gaia.models.GriddedEnvironment(name='T', t=t, z=z, y=y, x=x,
+                                             data=T + 2 * Z - Y + 3 * X)
+        n = 100
+        pt, pz, py, px = 10 * rand(n), 50 * rand(n), 20 * rand(n) - 10, rand(n)
+        expected = pt + 2 * pz - py + 3 * px
+        assert_allclose(env.read(pt, pz, py, px), expected)
+        assert_allclose(env.read(2.5, pz, py, px), expected - pt + 2.5)
+        # Positions outside the grid are clamped to its edges.
+        assert_allclose(env.read(20., 0., 0., 0.), 10.)
+
+
+    def test_gridded_environment_singleton(self):
+        env = gaia.models.GriddedEnvironment(t=[0., 1.],
+                                             data=array([0., 1.]).reshape(
+                                                 2, 1, 1, 1))
+        assert_allclose(env.read(0.25, rand(3), rand(3), rand(3)), 0.25)
+
+
+    def test_environment_cache(self):
+        t = linspace(0, 10, 11)
+        data = t.reshape(11, 1, 1, 1) * ones((11, 2, 2, 2))
+        env = gaia.models.GriddedEnvironment(t=t, data=data, cache=3)
+        cache = env.cache
+        for time in linspace(0, 10, 41):
+            assert_allclose(env.read(time, 0, 0, 0), time)
+        stats = cache.stats()
+        self.assertTrue(len(cache) <= 3)
+        self.assertTrue(stats['evictions'] > 0)
+        self.assertTrue(stats['prefetches'] > 0)
+        # Only the first two slabs are not prefetched.
+        self.assertEqual(stats['misses'], 2)
+        env.cache = False
+        self.assertTrue(env.cache is None)
+        env.cache = True
+        self.assertEqual(env.cache.size, 4)
+
+
+    def test_environment_cache_clear(self):
+        ready = Event()
+        def loader(i):
+            ready.wait()
+            return i
+        cache = gaia.models.SlabCache(loader)
+        cache.prefetch(1)
+        worker = cache._thread
+        cache.clear()
+        ready.set()
+        worker.join()
+        # Slabs prefetched before clearing are discarded and the worker
+        # stops once idle.
+        self.assertFalse(1 in cache)
+        self.assertTrue(cache._thread is None)
+        self.assertEqual(cache.get(1), 1)
+
+
+    def test_memmap_environment(self):
+        t, z = linspace(0, 10, 11), linspace(0, 50, 6)
+        y, x = linspace(-1, 1, 5), linspace(0, 1, 3)
+        T, Z, Y, X = meshgrid(t, z, y, x, indexing='ij')
+        data = T + 2 * Z - Y + 3 * X
+        path = mkdtemp()
+        try:
+            gaia.models.write_raw(join(path, 'T.raw'), data, t=t, z=z, y=y,
+                                  x=x, name='T', units='degC')
+            save(join(path, 'T.npy'), data)
+            raw = gaia.models.MemmapEnvironment(join(path, 'T.raw'))
+            npy = gaia.models.MemmapEnvironment(join(path, 'T.npy'), t=t,
+                                                z=z, y=y, x=x)
+            self.assertEqual(raw.units, 'degC')
+            self.assertTrue(isinstance(raw.data, memmap))
+            n = 10
+            pt, pz, py, px = 10 * rand(n), 50 * rand(n), rand(n), rand(n)
+            expected = pt + 2 * pz - py + 3 * px
+            assert_allclose(raw.read(pt, pz, py, px), expected)
+            assert_allclose(npy.read(3.5, pz, py, px), expected - pt + 3.5)
+            # Cached environments are pickled without their cache, and
+            # slabs of previous files are not served after the path
+            # changes.
+            raw.cache = 2
+            raw.read(pt, pz, py, px)
+            copy = pickle.loads(pickle.dumps(raw))
+            assert_allclose(copy.read(pt, pz, py, px), expected)
+            self.assertEqual(copy.cache.size, 2)
+            gaia.models.write_raw(join(path, 'S.raw'), -data, t=t, z=z,
+                                  y=y, x=x, units='psu')
+            raw.path = join(path, 'S.raw')
+            assert_allclose(raw.read(pt, pz, py, px), -expected)
+            self.assertEqual(raw.units, 'psu')
+            del raw, npy, copy
+        finally:
+            rmtree(path)
+
+
+    def test_environment_group(self):
+        t, z = linspace(0, 10, 11), linspace(0, 50, 6)
+        y, x = linspace(-1, 1, 5), linspace(0, 1, 3)
+        T, Z, Y, X = meshgrid(t, z, y, x, indexing='ij')
+        args = dict(t=t, z=z, y=y, x=x)
+        group = gaia.models.EnvironmentGroup(dict(
+            T=gaia.models.GriddedEnvironment(data=20 + Z, **args),
+            E_0=gaia.models.GriddedEnvironment(data=T + X, **args),
+            NO3=gaia.models.GriddedEnvironment(data=Y, t=t, z=z, y=-y, x=x),
+            NH4=1e-3))
+        self.assertEqual(len(group.grids()), 2)
+        n = 10
+        pt, pz, py, px = 10 * rand(n), 50 * rand(n), rand(n), rand(n)
+        values = group.read(pt, pz, py, px)
+        assert_allclose(values['T'], 20 + pz)
+        assert_allclose(values['E_0'], pt + px)
+        assert_allclose(values['NO3'], -py)
+        self.assertEqual(values['NH4'], 1e-3)
+        # Variables on the same grid are gathered from stacked slabs,
+        # which are kept while slabs do not change.
+        stack = group._stack(['T', 'E_0'], 2)
+        self.assertEqual(stack.shape, (2, 6, 5, 3))
+        self.assertTrue(group._stack(['T', 'E_0'], 2) is stack)
+        group['E_0'].data = T - X
+        assert_allclose(group.read(pt, pz, py, px)['E_0'], pt - px)
+        # Grids follow changes of coordinates.
+        group['NO3'].y = y
+        self.assertEqual(len(group.grids()), 1)
+        assert_allclose(group.read(pt, pz, py, px)['NO3'], py)
+        # Groups are accepted by models.
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1., self.plankton, group, scheme='rk2')
+
+
+    def test_model_invalid_scheme(self):
+        model = gaia.models.Model(t=0., dt=0.1)
+        self.assertRaises(ValueError, model.run, 1., self.individual,
+                          self.environments, 'foo')
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
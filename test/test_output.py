@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for the streaming output of history.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import json
+import unittest
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from numpy import isnan, linspace, ones
+from numpy.testing import assert_array_equal
+
+import gaia
+
+import fixtures
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        self.args = fixtures.plankton_args(t=0, x=linspace(1, 2, 4),
+            y=linspace(1, 2, 4), z=0, P=ones(4), N_P=0.2 * ones(4))
+        self.environments = dict(T=20., E_0=30., NO3=0.5, NH4=1e-3)
+
+
+    def tearDown(self):
+        rmtree(self.path)
+
+
+    def test_stream_model_run(self):
+        reference = gaia.individuals.Plankton(**self.args)
+        gaia.models.Model(t=0., dt=0.1).run(1., reference, self.environments)
+        plankton = gaia.individuals.Plankton(**self.args)
+        writer = gaia.output.StreamWriter(self.path, chunk=3, queue=1)
+        plankton.stream(writer, 'plankton')
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(1., plankton, self.environments, nmax=2)
+        writer.close()
+        self.assertEqual(len(plankton.history()['P']), 2)
+        H = gaia.output.load(self.path, 'plankton', keys=['P', 'time'])
+        expected = reference.history()
+        # The initial item was appended before streaming started.
+        assert_array_equal(H['P'], expected['P'][1:])
+        assert_array_equal(H['time'], expected['time'][1:])
+        with open(join(self.path, gaia.output.INDEX)) as f:
+            index = json.load(f)
+        self.assertEqual([item['rows'] for item in
+                          index['plankton']['P']], [3, 3, 3, 1])
+
+
+    def test_stream_shape_change(self):
+        plankton = gaia.individuals.Plankton(**self.args)
+        writer = gaia.output.StreamWriter(self.path, chunk=4)
+        plankton.stream(writer, 'plankton')
+        plankton.append_history(time=0.)
+        plankton.spawn(2, P=1., N_P=0.2)
+        plankton.append_history(time=0.)
+        plankton.stream(None, 'plankton')
+        plankton.append_history()
+        writer.close()
+        H = gaia.output.load(self.path, 'plankton')
+        self.assertEqual([item.shape for item in H['P']], [(1, 4), (1, 6)])
+        self.assertTrue(isnan(H['x'][1][0, 4:]).all())
+        assert_array_equal(H['time'], [0., 0.])
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for the parallel execution of models.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import unittest
+
+from numpy import linspace, meshgrid
+from numpy.random import RandomState
+from numpy.testing import assert_array_equal
+
+import gaia
+
+import fixtures
+
+
+def plankton(n, seed=42):
+    rand = RandomState(seed).rand
+    return fixtures.plankton(t=0, x=rand(n), y=rand(n), z=10 * rand(n),
+                             P=1 + rand(n), N_P=0.3 * rand(n),
+                             domain=(0, 1, 0, 1, 0, 20))
+
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        t, z = linspace(0, 2, 3), linspace(0, 20, 5)
+        y = x = linspace(0, 1, 11)
+        T, Z, Y, X = meshgrid(t, z, y, x, indexing='ij')
+        args = dict(t=t, z=z, y=y, x=x)
+        Grid = gaia.models.GriddedEnvironment
+        self.environments = gaia.models.EnvironmentGroup(dict(
+            T=Grid(data=25 - Z / 4 + T, **args),
+            E_0=Grid(data=60 - 3 * Z, **args), NO3=0.5, NH4=1e-3,
+            u=Grid(data=0.1 * Y, **args), v=Grid(data=-0.1 * X, **args),
+            w=0.5))
+
+
+    def test_parallel_partition(self):
+        self.assertEqual(list(gaia.parallel.partition(10, 3)),
+                         [(0, 3), (3, 6), (6, 10)])
+        self.assertEqual(list(gaia.parallel.partition(2, 4)),
+                         [(0, 1), (1, 2)])
+
+
+    def test_parallel_equals_serial(self):
+        serial, parallel = plankton(101), plankton(101)
+        for population, processes in [(serial, None), (parallel, 3)]:
+            model = gaia.models.Model(t=0., dt=0.1)
+            model.run(2., population, self.environments, scheme='rk4',
+                      advection=gaia.advection.Advection(chunk=16),
+                      processes=processes)
+        for key in ['x', 'y', 'z', 'P', 'N_P']:
+            assert_array_equal(getattr(serial, key), getattr(parallel, key))
+        assert_array_equal(serial.in_domain, parallel.in_domain)
+        assert_array_equal(serial.history()['P'], parallel.history()['P'])
+        self.assertFalse(serial.in_domain.all())
+
+
+    def test_parallel_setup_failure(self):
+        population = plankton(10)
+        integrator = gaia.models.RK4()
+        self.assertRaises(ValueError, gaia.parallel.ProcessRunner,
+                          [population], self.environments, integrator,
+                          processes=0)
+        # Failed setups do not block later runs.
+        self.assertFalse(gaia.parallel._job)
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(0.2, population, self.environments, scheme=integrator,
+                  processes=2)
+        # Stage buffers may be indexed by key instead of identity.
+        integrator.step(population, 0.2, 0.1, self.environments,
+                        key=(0, 0, 10))
+        self.assertTrue((0, 0, 10) in integrator._buffers)
+
+
+    def test_thread_executor_growth(self):
+        population = plankton(1000)
+        rand = RandomState(1).rand
+        T, E_0, NO3, NH4 = 30 * rand(1000), 80 * rand(1000), rand(1000), 1e-3
+        alpha = population.alpha()
+        mask = rand(1000) > 0.5
+        executor = gaia.parallel.ThreadExecutor(workers=4, chunk=64)
+        expected = population.growth(T, E_0, alpha, NO3, NH4, mask).copy()
+        result = executor.growth(population, T, E_0, alpha, NO3, NH4, mask)
+        assert_array_equal(result, expected)
+        # Indices of active individuals are split between chunks.
+        result = executor.growth(population, T, E_0, alpha, NO3, NH4,
+                                 mask.nonzero()[0])
+        assert_array_equal(result, expected)
+        # Chunks and their workspaces are reused by later calls, until
+        # attributes of the population are replaced.
+        chunk = population.subsets([(0, 64)])[0]
+        work = chunk._attributes['_compact']
+        executor.growth(population, T, E_0, alpha, NO3, NH4, mask)
+        self.assertTrue(population.subsets([(0, 64)])[0] is chunk)
+        self.assertTrue(chunk._attributes['_compact'] is work)
+        population.mu_m = 0.5
+        self.assertFalse(population.subsets([(0, 64)])[0] is chunk)
+        executor.close()
+
+
+    def test_thread_executor_model(self):
+        serial, threaded = plankton(200), plankton(200)
+        threaded.executor = gaia.parallel.ThreadExecutor(workers=3, chunk=32)
+        for population in [serial, threaded]:
+            model = gaia.models.Model(t=0., dt=0.1)
+            model.run(1., population, self.environments, scheme='rk2')
+        threaded.executor.close()
+        assert_array_equal(serial.P, threaded.P)
+        assert_array_equal(serial.N_P, threaded.N_P)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
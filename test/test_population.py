@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for the columnar population storage.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import unittest
+
+from numpy import arange, isnan
+from numpy.testing import assert_array_equal
+
+import gaia
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        self.population = gaia.population.Population(['x', 'y'], size=4)
+        self.population['x'] = arange(4)
+        self.population['y'] = 2 * arange(4)
+
+
+    def test_population_columns_are_views(self):
+        x = self.population['x']
+        x[0] = 42
+        self.assertEqual(self.population['x'][0], 42)
+        self.assertTrue(self.population['x'].flags['C_CONTIGUOUS'])
+
+
+    def test_population_resize(self):
+        self.population.resize(5)
+        self.assertEqual(len(self.population), 5)
+        self.assertTrue(self.population.capacity >= 8)
+        assert_array_equal(self.population['y'][:4], 2 * arange(4))
+        self.assertTrue(isnan(self.population['y'][4]))
+        population = gaia.population.Population(['id'], size=2,
+                                                dtype='int64')
+        population.resize(3)
+        assert_array_equal(population['id'], [-1, -1, -1])
+
+
+    def test_population_records(self):
+        R = self.population.to_records()
+        P = gaia.population.from_records(R.tolist(), ['x', 'y'])
+        assert_array_equal(P.block(), self.population.block())
+
+
+    def test_individual_state_in_population(self):
+        individual = gaia.individuals.Individual(t=0, x=arange(3.),
+                                                 y=arange(3.))
+        individual.set_state_parameters(['t', 'x', 'y'])
+        self.assertEqual(individual.size(), 3)
+        assert_array_equal(individual.t, [0, 0, 0])
+        individual.x *= 2
+        assert_array_equal(individual.population['x'], [0, 2, 4])
+        self.assertRaises(ValueError, setattr, individual, 'y', arange(4.))
+        self.assertEqual(gaia.population.common_size([0, arange(0.)]), 0)
+        self.assertEqual(gaia.population.common_size([0, None]), 1)
+        individual = gaia.individuals.Individual(t=0, x=arange(0.))
+        individual.set_state_parameters(['t', 'x'])
+        self.assertEqual(individual.size(), 0)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for super-individual resampling.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import unittest
+
+from numpy import array, isnan, nansum
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+
+import gaia
+
+import fixtures
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        rand = RandomState(7).rand
+        n = 200
+        self.args = fixtures.plankton_args(t=0, x=1 + rand(n),
+            y=1 + rand(n), z=10 * rand(n), P=1 + rand(n),
+            N_P=0.2 + 0.01 * rand(n), group=array([0, 1] * 100))
+        self.plankton = gaia.individuals.Plankton(**self.args)
+        self.environments = dict(T=20., E_0=30., NO3=0.5, NH4=1e-3)
+
+
+    def totals(self):
+        return nansum(self.plankton.P), nansum(self.plankton.N_P)
+
+
+    def test_merge(self):
+        p = self.plankton
+        before = self.totals()
+        merged = gaia.resampling.merge(p, cell=(0.5, 0.5, 5.), ratio=0.1)
+        self.assertTrue(merged > 0)
+        self.assertEqual(len(p.active()), 200 - merged)
+        assert_allclose(self.totals(), before, rtol=1e-12)
+        # Only individuals of the same group are merged.
+        self.assertEqual(set(p.group[p.active()]), set([0, 1]))
+        self.assertTrue(isnan(p.P[~p.alive]).all())
+        self.assertTrue((p.x[p.active()] >= 1).all())
+
+
+    def test_split(self):
+        p = self.plankton
+        p.P[:3] = 100.
+        before = self.totals()
+        self.assertEqual(gaia.resampling.split(p, 2, heavy=2.), 2)
+        self.assertEqual(p.size(), 202)
+        assert_allclose(self.totals(), before, rtol=1e-12)
+        assert_allclose(sorted(p.P)[-5:], [50., 50., 50., 50., 100.])
+        self.assertEqual(p.group.shape, (202, ))
+        # History of new individuals is NaN before they were born.
+        p.append_history()
+        H = p.history()['P']
+        self.assertEqual(H.shape, (2, 202))
+        self.assertTrue(isnan(H[0, 200:]).all())
+        # Dead individuals are replaced first.
+        gaia.resampling.merge(p, cell=100., ratio=None)
+        n = p.size()
+        gaia.resampling.split(p, 1, heavy=1.)
+        self.assertEqual(p.size(), n)
+
+
+    def test_model_resampler(self):
+        resampler = gaia.resampling.Resampler(budget=50, cell=0.1, ratio=0.01)
+        reference = gaia.individuals.Plankton(**self.args)
+        gaia.models.Model(t=0., dt=0.1).run(0.1, reference,
+                                            self.environments)
+        model = gaia.models.Model(t=0., dt=0.1)
+        model.run(0.1, self.plankton, self.environments, scheme='euler',
+                  resampler=resampler)
+        self.assertTrue(len(self.plankton.active()) <= 55)
+        self.assertTrue(resampler.merged >= 145)
+        assert_allclose(self.totals(), (reference.P.sum(),
+                                        reference.N_P.sum()), rtol=1e-12)
+        self.assertRaises(ValueError, model.run, 0.2, self.plankton,
+                          self.environments, resampler=resampler,
+                          processes=2)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Gaia
+
+Gaia is a Python library for ecological modelling.
+
+This module implements tests for tabulated response functions.
+
+AUTHOR
+    Sebastian Krieger
+    email: sebastian.krieger@usp.br
+
+REVISION
+    1 (2014-12-16 18:37 -0300 DST)
+
+"""
+from __future__ import division
+
+__version__ = '$Revision: 1 $'
+# $Source$
+
+import unittest
+
+from numpy import array, exp, isnan, linspace, nan, ones, tanh
+from numpy.random import RandomState
+from numpy.testing import assert_allclose
+
+import gaia
+
+import fixtures
+
+class TestData(unittest.TestCase):
+    def setUp(self):
+        self.rand = RandomState(3).rand
+        n = 1000
+        self.plankton = fixtures.plankton(t=0, x=1 + self.rand(n),
+            y=1 + self.rand(n), z=0, P=1 + self.rand(n),
+            N_P=0.3 * self.rand(n))
+
+
+    def test_table_error_bound(self):
+        f = lambda x: exp(0.0633 * (x - 27.))
+        table = gaia.tables.Table(f, -5., 40., tolerance=1e-6)
+        self.assertTrue(table.error <= 1e-6)
+        x = -5 + 45 * self.rand(10000)
+        self.assertTrue(abs(table(x) - f(x)).max() <= 1e-6)
+        # Arguments outside the range are evaluated exactly, NaN
+        # propagates.
+        result = table(array([-10., 50., nan]))
+        assert_allclose(result[:2], f(array([-10., 50.])))
+        self.assertTrue(isnan(result[2]))
+        self.assertEqual(table(27.).shape, ())
+
+
+    def test_clamped_tables(self):
+        x = 50 * self.rand(10000)
+        self.assertTrue(abs(gaia.tables.tanh_table(1e-6)(x) -
+                            tanh(x)).max() <= 1e-6)
+        table = gaia.tables.decay_table(0.1, 40., 1e-6)
+        x = 500 * self.rand(10000)
+        expected = exp(-0.1 * (x - 40.) * (x > 40.))
+        self.assertTrue(abs(table(x) - expected).max() <= 1e-6)
+
+
+    def test_plankton_lookup(self):
+        p = self.plankton
+        T, E_0 = 30 * self.rand(p.size()), 80 * self.rand(p.size())
+        NO3, NH4 = self.rand(p.size()), 1e-2 * self.rand(p.size())
+        alpha = p.alpha()
+        expected = p.growth(T, E_0, alpha, NO3, NH4)
+        p.lookup = 1e-7
+        result = p.growth(T, E_0, alpha, NO3, NH4)
+        assert_allclose(result, expected, atol=1e-6)
+        mu_mt = p.mu_mt(T)
+        assert_allclose(mu_mt, 0.58 * exp(0.0633 * (T - 27.)), atol=1e-7)
+        assert_allclose(p.mu_ll(mu_mt, E_0, alpha), expected[1], atol=1e-6)
+        # Tables are memoized and rebuilt when parameters change.
+        tables = p.response_tables()
+        self.assertTrue(p.response_tables() is tables)
+        p.mu_m = 0.4
+        self.assertFalse(p.response_tables() is tables)
+        assert_allclose(p.mu_mt(T), 0.4 * exp(0.0633 * (T - 27.)),
+                        atol=1e-7)
+        # Parameters which vary among individuals are not tabulated.
+        p.d_r = 0.1 * ones(p.size())
+        self.assertFalse('photoinhibition' in p.response_tables())
+        # Subsets, e. g. chunks of executors, share the tables.
+        tables = p.response_tables()
+        self.assertTrue(p.subset(0, 10).response_tables() is tables)
+        p.lookup = None
+        self.assertTrue(p.response_tables() is None)
+
+
+def main():
+    unittest.main()
+
+
+if __name__ == '__main__':
+    main()